@@ -4,252 +4,1417 @@ TB Clinical Data Analysis Script
 Performs comprehensive analysis of TB clinical data and generates CSV/JSON outputs
 """
 
-import pandas as pd
-import numpy as np
 import json
 from pathlib import Path
+import argparse
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
 import datetime
+import hashlib
+import importlib.util
+import math
+import os
+import shutil
 import sys
+import time
+
+def _lazy_import(name):
+    """Module that is only really imported when one of its attributes is first used"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+# pandas and numpy take most of a second to import; deferring them keeps --help, --check-inputs
+# on cached files and the helper scripts importing this module fast
+pd = _lazy_import('pandas')
+np = _lazy_import('numpy')
+
+# The 22 documented columns of the screening workbook
+DATA_COLUMNS = [
+    'ID', 'Age', 'Age_Group', 'Sex', 'CXR_results', 'Cough', 'Fever', 'Weight_Loss',
+    'Tiredness', 'Hemoptysis', 'Night_Sweat', 'Symptom_Cumulative', 'DM', 'HIV',
+    'TB_Contact_History', 'TB_History', 'Sputum_R1', 'R1_Grading', 'Sputum_R2',
+    'R2_Grading', 'GeneXpertMTB', 'Diagnosis'
+]
+
+# Optional site columns, read when present; work is sharded by whole sites across processes
+# (finest first) and --hierarchy repeats the analysis for every site at each level
+OPTIONAL_COLUMNS = ['Facility', 'District', 'Region']
+
+# Optional screening date, read when present; drives the weekly/monthly trend section
+DATE_COLUMN = 'Screening_Date'
+READ_COLUMNS = DATA_COLUMNS + OPTIONAL_COLUMNS + [DATE_COLUMN]
+
+SYMPTOM_COLS = ['Cough', 'Fever', 'Weight_Loss', 'Tiredness', 'Hemoptysis', 'Night_Sweat']
+TB_POSITIVE = 'Clinically_Diagnosed_TB'
+ABNORMAL_CXR = ['TB_Suspect', 'Abnormal_TB']
+
+# Yes/No columns stored as bool when they hold nothing else
+BOOLEAN_COLS = SYMPTOM_COLS + ['TB_Contact_History', 'TB_History']
+
+# Expected values of the coded columns; anything else is reported and kept as an extra category
+CATEGORY_LEVELS = {
+    'Age_Group': ['0-4', '5-14', '15-54', '>54'],
+    'Sex': ['Male', 'Female'],
+    'CXR_results': ['Normal', 'TB_Suspect', 'Abnormal_TB', 'Not_Done'],
+    'DM': ['Yes', 'No', 'Unknown'],
+    'HIV': ['Yes', 'No', 'Unknown'],
+    'Sputum_R1': ['Positive', 'Negative', 'Not_Done'],
+    'R1_Grading': ['Scanty', '1+', '2+', '3+', 'Not_Applicable'],
+    'Sputum_R2': ['Positive', 'Negative', 'Not_Done'],
+    'R2_Grading': ['Scanty', '1+', '2+', '3+', 'Not_Applicable'],
+    'GeneXpertMTB': ['MTB_Detected', 'MTB_Not_Detected', 'Not_Done'],
+    'Diagnosis': [TB_POSITIVE, 'No_TB']
+}
+
+# Input formats load_data understands; only CSV and Parquet can be streamed in chunks
+DATA_SUFFIXES = ['.xlsx', '.csv', '.parquet']
+CHUNKED_SUFFIXES = ['.csv', '.parquet']
+
+# Memory-mapped patient stores of ingested files, reused while the source file is unchanged
+CACHE_DIR = Path('.tb_cache')
+STORE_SUFFIX = '.store'
+
+# Per-section result cache, evicted least-recently-used first beyond the size limit
+SECTION_CACHE_DIR = CACHE_DIR / 'sections'
+SECTION_CACHE_MB = 200
+
+# Per-section result files for the dashboard, listed with their hashes in the manifest
+SECTION_DIR = 'sections'
+MANIFEST_FILE = 'analysis_manifest.json'
+
+# Fitted predictive models, keyed by their training data and code
+MODEL_CACHE_DIR = CACHE_DIR / 'models'
+
+# Count cube and seen IDs of the last --incremental run, kept next to analysis_results.json
+STATE_FILE = Path('analysis_state.pkl')
 
 def get_data_filename():
     """Ask user for data filename and validate it exists"""
     while True:
-        filename = input("Enter the name of your Excel data file (e.g., realdata.xlsx): ").strip()
+        filename = input("Enter the name of your data file (.xlsx, .csv or .parquet, e.g., realdata.xlsx): ").strip()
 
         if not filename:
             print("Please enter a filename.")
             continue
 
         # Add .xlsx extension if not provided
-        if not filename.endswith('.xlsx'):
+        if Path(filename).suffix.lower() not in DATA_SUFFIXES:
             filename += '.xlsx'
 
         try:
-            # Test if file can be opened
-            df = pd.read_excel(filename)
-            print(f"✅ Found file: {filename} with {len(df)} records")
+            # Test if file can be opened (this also builds the patient store for load_data);
+            # a file whose store is up to date is not parsed again
+            store_path, _ = ingest_data(filename)
+            print(f"✅ Found file: {filename} with {store_meta(store_path)['rows']} records")
             return filename
         except FileNotFoundError:
             print(f"❌ File '{filename}' not found in current directory.")
 
-            # Show available Excel files in current directory
+            # Show available data files in current directory
             import glob
-            excel_files = glob.glob("*.xlsx")
-            if excel_files:
-                print("Available Excel files in this directory:")
-                for i, file in enumerate(excel_files, 1):
+            data_files = [file for suffix in DATA_SUFFIXES for file in glob.glob(f"*{suffix}")]
+            if data_files:
+                print("Available data files in this directory:")
+                for i, file in enumerate(data_files, 1):
                     print(f"  {i}. {file}")
                 print("Please try again with the correct filename.")
             else:
-                print("No .xlsx files found in current directory.")
+                print("No .xlsx, .csv or .parquet files found in current directory.")
                 print("Make sure your data file is in the same folder as this script.")
         except Exception as e:
             print(f"❌ Error reading '{filename}': {e}")
             print("Please check the file format and try again.")
 
+def _to_categorical(values, levels, col, reported):
+    """Convert values to a Categorical over levels, keeping (and reporting) unexpected values"""
+    observed = pd.unique(values.dropna())
+    unexpected = [value for value in observed if value not in levels]
+    new = [value for value in unexpected if (col, value) not in reported]
+    if new:
+        print(f"⚠️  {col}: unexpected values {new}")
+        reported.update((col, value) for value in new)
+    return pd.Categorical(values, categories=list(levels) + unexpected)
+
+def encode_data(df, reported=None):
+    """Convert the raw frame to compact dtypes (bool, Categorical, small ints)
+
+    reported collects the (column, value) pairs already warned about, so encoding a
+    file chunk by chunk reports each unexpected value once.
+    """
+    df = df.copy()
+    reported = set() if reported is None else reported
+
+    for col in BOOLEAN_COLS:
+        if col not in df.columns:
+            continue
+        if df[col].isin(['Yes', 'No']).all():
+            df[col] = (df[col] == 'Yes').to_numpy()
+        else:
+            df[col] = _to_categorical(df[col], ['Yes', 'No'], col, reported)
+
+    for col, levels in CATEGORY_LEVELS.items():
+        if col in df.columns:
+            df[col] = _to_categorical(df[col], levels, col, reported)
+
+    for col in OPTIONAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+
+    if DATE_COLUMN in df.columns:
+        dates = pd.to_datetime(df[DATE_COLUMN], errors='coerce')
+        unparsed = int((dates.isna() & df[DATE_COLUMN].notna()).sum())
+        if unparsed and (DATE_COLUMN, 'unparsed') not in reported:
+            print(f"⚠️  {unparsed} unreadable {DATE_COLUMN} value(s); those records are left out of the trends")
+            reported.add((DATE_COLUMN, 'unparsed'))
+        df[DATE_COLUMN] = dates
+
+    # Whole numbers become the smallest int type (nullable Int when values are missing)
+    for col in ['Age', 'Symptom_Cumulative']:
+        if col not in df.columns:
+            continue
+        present = df[col].dropna()
+        if len(present) and (present == present.round()).all():
+            small = pd.to_numeric(present, downcast='integer').dtype
+            df[col] = df[col].astype(small if len(present) == len(df) else str(small).capitalize())
+
+    return df
+
+def decode_data(df):
+    """Turn the encoded bool columns back into Yes/No for CSV export"""
+    df = df.copy()
+    for col in BOOLEAN_COLS:
+        if col in df.columns and df[col].dtype == bool:
+            df[col] = np.where(df[col], 'Yes', 'No')
+    return df
+
+def _file_digest(path):
+    """SHA-256 of a file's contents, read in 1 MB blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _encoding_version():
+    """Short hash of the column/encoding rules, so cached frames are rebuilt when they change"""
+    rules = json.dumps([READ_COLUMNS, BOOLEAN_COLS, CATEGORY_LEVELS])
+    return hashlib.sha256(rules.encode()).hexdigest()[:12]
+
+def _store_version():
+    """_encoding_version plus the validation rules behind a patient store's valid-row bitmap"""
+    rules = json.dumps([_encoding_version(), REQUIRED_COLUMNS, AGE_RANGE])
+    return hashlib.sha256(rules.encode()).hexdigest()[:12]
+
+def _columnar_suffix():
+    """Parquet when pyarrow is installed, otherwise a pandas pickle"""
+    try:
+        import pyarrow  # noqa: F401
+        return '.parquet'
+    except ImportError:
+        return '.pkl'
+
+def _write_atomic(path, write):
+    """Call write(tmp_path) and move the result into place, so readers never see partial files"""
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def _read_raw(path):
+    """Read the documented columns of an .xlsx, .csv or .parquet file"""
+    suffix = path.suffix.lower()
+    if suffix == '.csv':
+        return pd.read_csv(path, usecols=lambda col: col in READ_COLUMNS)
+    if suffix == '.parquet':
+        import pyarrow.parquet as pq
+        columns = [col for col in pq.read_schema(path).names if col in READ_COLUMNS]
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_excel(path, usecols=lambda col: col in READ_COLUMNS)
+
+def iter_data_chunks(filename, chunk_size, reported=None):
+    """Yield encoded row batches of a CSV or Parquet file without loading it whole"""
+    path = Path(filename)
+    suffix = path.suffix.lower()
+    reported = set() if reported is None else reported
+
+    if suffix == '.csv':
+        for chunk in pd.read_csv(path, usecols=lambda col: col in READ_COLUMNS, chunksize=chunk_size):
+            yield encode_data(chunk, reported)
+    elif suffix == '.parquet':
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        columns = [col for col in parquet_file.schema_arrow.names if col in READ_COLUMNS]
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            yield encode_data(batch.to_pandas(), reported)
+    else:
+        raise ValueError(f"Chunked reading needs a CSV or Parquet file, got '{filename}'")
+
+def write_patient_store(df, path, valid=None):
+    """Save encoded rows as one .npy file per column plus a packed bitmap per category value
+
+    Yes/No and categorical columns are stored as their codes, with one bit row per value
+    in bitmaps/<column>.npy (the last row marks missing values). Nullable numbers and
+    strings get a .mask.npy of missing entries. valid, the rows passing validate_data, is
+    kept packed in valid.npy so that queries skip quarantined rows like the count cube
+    does. The directory is written under a temporary
+    name and moved into place, so readers never see half a store.
+    """
+    path = Path(path)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    (tmp / 'bitmaps').mkdir(parents=True)
+
+    meta = {'rows': len(df), 'columns': {}}
+    for col in df.columns:
+        values = df[col]
+        mask = None
+        if values.dtype == bool:
+            info = {'kind': 'bool', 'labels': ['Yes', 'No']}
+            data = values.to_numpy()
+            bits = [data, ~data, np.zeros(len(data), dtype=bool)]
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            info = {'kind': 'category', 'labels': values.cat.categories.tolist()}
+            data = values.cat.codes.to_numpy()
+            bits = [data == code for code in range(len(info['labels']))] + [data < 0]
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            info = {'kind': 'datetime'}
+            data = values.to_numpy(dtype=f"datetime64[{values.dt.unit}]")
+            bits = None
+        elif pd.api.types.is_numeric_dtype(values):
+            info = {'kind': 'numeric', 'dtype': str(values.dtype)}
+            mask = values.isna().to_numpy()
+            data = values.to_numpy(dtype=float if mask.any() else None, na_value=np.nan)
+            bits = None
+        else:
+            info = {'kind': 'string'}
+            mask = values.isna().to_numpy()
+            data = values.fillna('').astype(str).to_numpy(dtype=str)
+            bits = None
+
+        np.save(tmp / f"{col}.npy", data)
+        if mask is not None and mask.any():
+            np.save(tmp / f"{col}.mask.npy", mask)
+            info['masked'] = True
+        if bits is not None:
+            np.save(tmp / 'bitmaps' / f"{col}.npy", np.packbits(np.vstack(bits), axis=1))
+        meta['columns'][col] = info
+    if valid is not None:
+        np.save(tmp / 'valid.npy', np.packbits(valid))
+        meta['valid_rows'] = int(valid.sum())
+
+    (tmp / 'meta.json').write_text(json.dumps(meta, indent=2, default=str))
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return path
+
+def store_meta(path):
+    """Row count and column descriptions of a patient store, without mapping any column"""
+    return json.loads((Path(path) / 'meta.json').read_text())
+
+def open_patient_store(path):
+    """Memory-map a patient store; nothing is read until a column or bitmap is used"""
+    path = Path(path)
+    meta = store_meta(path)
+    store = {'path': path, 'rows': meta['rows'], 'columns': meta['columns'], 'data': {}, 'masks': {}, 'bitmaps': {},
+             'valid': np.load(path / 'valid.npy', mmap_mode='r') if 'valid_rows' in meta else None}
+    for col, info in meta['columns'].items():
+        store['data'][col] = np.load(path / f"{col}.npy", mmap_mode='r')
+        if info.get('masked'):
+            store['masks'][col] = np.load(path / f"{col}.mask.npy", mmap_mode='r')
+        if info['kind'] in ('bool', 'category'):
+            store['bitmaps'][col] = np.load(path / 'bitmaps' / f"{col}.npy", mmap_mode='r')
+    return store
+
+def store_frame(store, columns=None):
+    """Encoded DataFrame of the given store columns (all by default), built on the memory maps"""
+    frame = {}
+    for col in columns or list(store['columns']):
+        info = store['columns'][col]
+        data = store['data'][col]
+        mask = store['masks'].get(col)
+        if info['kind'] == 'category':
+            frame[col] = pd.Categorical.from_codes(data, categories=info['labels'], validate=False)
+        elif info['kind'] == 'numeric' and mask is not None:
+            frame[col] = pd.Series(data).astype(info['dtype'])
+        elif info['kind'] == 'string':
+            frame[col] = pd.Series(data) if mask is None else pd.Series(data).where(~mask)
+        else:
+            frame[col] = data
+    return pd.DataFrame(frame, copy=False)
+
+def store_mask(store, filters):
+    """Packed bitmap of the rows matching every filter (OR within a column, AND across columns)
+
+    filters maps a Yes/No or categorical column to the values to keep, like query_cube;
+    only the packed bitmaps of those values are read, never the columns themselves.
+    Rows quarantined by validate_data never match, as they are left out of the cube.
+    """
+    mask = store['valid']
+    for col, values in filters.items():
+        if col not in store['bitmaps']:
+            raise ValueError(f"No bitmap index for '{col}' (choose from {', '.join(store['bitmaps'])})")
+        labels = [str(label) for label in store['columns'][col]['labels']]
+        unknown = [value for value in values if value not in labels]
+        if unknown:
+            raise ValueError(f"Unknown values for {col}: {', '.join(unknown)} (choose from {', '.join(labels)})")
+        rows = [labels.index(value) for value in values]
+        selected = np.bitwise_or.reduce(store['bitmaps'][col][rows], axis=0)
+        mask = selected if mask is None else mask & selected
+    if mask is None:
+        return np.packbits(np.ones(store['rows'], dtype=bool))
+    return mask
+
+def store_rows(store, filters, limit=None):
+    """Row positions of the patients matching filters (the first limit of them), resolved on the bitmap indexes"""
+    mask = store_mask(store, filters)
+    if limit is not None:
+        # Every non-zero byte holds at least one match, so the first limit of them are enough
+        nonzero = np.flatnonzero(mask)
+        if len(nonzero) > limit:
+            mask = mask[:nonzero[limit - 1] + 1]
+    return np.flatnonzero(np.unpackbits(mask, count=min(len(mask) * 8, store['rows'])))[:limit]
+
+def store_count(store, filters):
+    """Number of patients matching filters, without decoding any column"""
+    return int(np.unpackbits(store_mask(store, filters), count=store['rows']).sum())
+
+def ingest_data(filename):
+    """Make sure a data file has an up-to-date patient store; returns (store_path, from_cache)
+
+    Stores are looked up by the source path, size and mtime; when those change the file
+    contents are hashed, so a touched but identical workbook still reuses its store
+    instead of being parsed again.
+    """
+    path = Path(filename).resolve()
+    stat = path.stat()
+
+    index_file = CACHE_DIR / 'index.json'
+    index = json.loads(index_file.read_text()) if index_file.exists() else {}
+    entry = index.get(str(path))
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        digest = entry['sha256']
+    else:
+        digest = _file_digest(path)
+    store_path = CACHE_DIR / f"{digest[:20]}-{_store_version()}{STORE_SUFFIX}"
+
+    from_cache = (store_path / 'meta.json').exists()
+    if not from_cache:
+        raw = _read_raw(path)
+        df = encode_data(raw)
+        raw_mb = raw.memory_usage(deep=True).sum() / 1e6
+        encoded_mb = df.memory_usage(deep=True).sum() / 1e6
+        print(f"Memory footprint: {raw_mb:.2f} MB raw -> {encoded_mb:.2f} MB encoded")
+        del raw
+        valid, _, _ = validate_data(df)
+        CACHE_DIR.mkdir(exist_ok=True)
+        write_patient_store(df, store_path, valid)
+
+    index[str(path)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+    CACHE_DIR.mkdir(exist_ok=True)
+    _write_atomic(index_file, lambda tmp: tmp.write_text(json.dumps(index, indent=2)))
+    return store_path, from_cache
+
+def read_data(filename, columns=None):
+    """Read and encode a data file through its memory-mapped patient store
+
+    Returns (df, from_cache); columns limits the frame to the columns a caller needs.
+    """
+    store_path, from_cache = ingest_data(filename)
+    return store_frame(open_patient_store(store_path), columns), from_cache
+
 def load_data(filename):
-    """Load the TB clinical data from Excel file"""
-    df = pd.read_excel(filename)
-    print(f"Loaded {len(df)} patient records with {len(df.columns)} variables from {filename}")
+    """Load the TB clinical data file (or its memory-mapped patient store), encoded to compact dtypes"""
+    df, from_cache = read_data(filename)
+    source = f"{filename} (patient store)" if from_cache else filename
+    print(f"Loaded {len(df)} patient records with {len(df.columns)} variables from {source}")
     return df, filename
 
-def analyze_demographics(df):
+def check_inputs(filenames):
+    """Report whether each data file can be read, building missing patient stores; returns the failures
+
+    A file whose store is up to date is checked from the cache index and the store's
+    metadata alone, so pandas is never imported for it.
+    """
+    failed = []
+    for filename in filenames:
+        try:
+            store_path, from_cache = ingest_data(filename)
+        except FileNotFoundError:
+            print(f"❌ File '{filename}' not found.")
+            failed.append(filename)
+            continue
+        except Exception as e:
+            print(f"❌ Error reading '{filename}': {e}")
+            failed.append(filename)
+            continue
+        meta = store_meta(store_path)
+        state = "patient store up to date" if from_cache else "patient store built"
+        print(f"✅ {filename}: {meta['rows']} records, {len(meta['columns'])} columns ({state})")
+    return failed
+
+# Records without these values cannot be counted and are always quarantined
+REQUIRED_COLUMNS = ['ID', 'Diagnosis']
+AGE_RANGE = (0, 120)
+QUARANTINE_FILE = 'quarantine.csv'
+
+def _id_hashes(ids):
+    """64-bit hashes of patient IDs, for duplicate checks across chunks"""
+    return pd.util.hash_pandas_object(ids.astype(str), index=False).to_numpy()
+
+def _seen_before(seen_ids, hashes):
+    """Mask of hashes present in seen_ids, a sorted array of unique ID hashes (binary search)"""
+    if not len(seen_ids):
+        return np.zeros(len(hashes), dtype=bool)
+    positions = np.minimum(np.searchsorted(seen_ids, hashes), len(seen_ids) - 1)
+    return seen_ids[positions] == hashes
+
+def _merge_seen_ids(seen_ids, hashes):
+    """seen_ids with the new hashes added, still sorted and unique
+
+    Only the chunk's hashes are sorted; they are inserted with one linear merge, so a
+    file costs O(rows x log chunk_size) plus a copy of the seen array per chunk.
+    """
+    new = np.unique(hashes)
+    new = new[~_seen_before(seen_ids, new)]
+    return np.insert(seen_ids, np.searchsorted(seen_ids, new), new)
+
+def _level_positions(values, levels):
+    """Position of every value in levels, -1 for missing or unexpected values (via the categorical codes)"""
+    if values.dtype == bool:
+        return np.where(values.to_numpy(), levels.index('Yes'), levels.index('No'))
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        positions = pd.Index(levels).get_indexer(values.cat.categories)
+        return np.append(positions, -1)[values.cat.codes.to_numpy()]
+    return pd.Index(levels).get_indexer(values.astype(object))
+
+def _unexpected(values, levels):
+    """Mask of present values outside levels"""
+    return values.notna().to_numpy() & (_level_positions(values, levels) < 0)
+
+def validate_data(df, seen_ids=None, row_offset=0):
+    """Vectorized checks of the encoded rows against the documented 22-column schema
+
+    Flags values outside the allowed levels, missing IDs / diagnoses, ages out of range
+    or inconsistent with Age_Group, a Symptom_Cumulative that differs from the six
+    symptom columns, and repeated IDs (also against seen_ids, the sorted ID hashes of
+    earlier chunks kept by _merge_seen_ids). Returns (valid, quarantine, summary): the
+    mask of rows that pass, the rejected rows with their file row number (header = row 1)
+    and reasons, and the issue counts.
+    """
+    checks = []
+    summary = {
+        'records': len(df),
+        'quarantined': 0,
+        'issues': {},
+        'unexpected_values': {},
+        'missing_values': {},
+        'missing_columns': [col for col in DATA_COLUMNS if col not in df.columns]
+    }
+
+    for col in DATA_COLUMNS:
+        if col in df.columns:
+            missing = int(df[col].isna().sum())
+            if missing:
+                summary['missing_values'][col] = missing
+
+    # Allowed values of every coded column
+    allowed = {**{col: ['Yes', 'No'] for col in BOOLEAN_COLS}, **CATEGORY_LEVELS}
+    for col, levels in allowed.items():
+        if col not in df.columns:
+            continue
+        bad = _unexpected(df[col], levels)
+        if bad.any():
+            checks.append((f"{col}: unexpected value", bad, col))
+            counts = df.loc[bad, col].astype(str).value_counts()
+            summary['unexpected_values'][col] = {value: int(count) for value, count in counts.items()}
+
+    for col in REQUIRED_COLUMNS:
+        if col in df.columns:
+            checks.append((f"{col}: missing", df[col].isna().to_numpy(), None))
+
+    if 'Age' in df.columns:
+        age = df['Age'].to_numpy(dtype=float, na_value=np.nan)
+        has_age = ~np.isnan(age)
+        checks.append(("Age: out of range", has_age & ((age < AGE_RANGE[0]) | (age > AGE_RANGE[1])), None))
+        if 'Age_Group' in df.columns:
+            group = _level_positions(df['Age_Group'], CATEGORY_LEVELS['Age_Group'])
+            expected = np.digitize(np.where(has_age, age, 0), [5, 15, 55])
+            checks.append(("Age_Group: does not match Age", has_age & (group >= 0) & (group != expected), None))
+
+    if 'Symptom_Cumulative' in df.columns and all(symptom in df.columns for symptom in SYMPTOM_COLS):
+        known = np.logical_and.reduce([_level_positions(df[symptom], ['Yes', 'No']) >= 0 for symptom in SYMPTOM_COLS])
+        recomputed = sum(_yes(df, symptom).astype(np.int16) for symptom in SYMPTOM_COLS)
+        stated = df['Symptom_Cumulative'].to_numpy(dtype=float, na_value=np.nan)
+        checks.append(("Symptom_Cumulative: does not match symptom columns",
+                       known & ~np.isnan(stated) & (stated != recomputed), None))
+
+    if 'ID' in df.columns:
+        duplicate = df['ID'].duplicated().to_numpy()
+        if seen_ids is not None and len(seen_ids):
+            duplicate = duplicate | _seen_before(seen_ids, _id_hashes(df['ID']))
+        duplicate = duplicate & df['ID'].notna().to_numpy()
+        checks.append(("ID: duplicate", duplicate, None))
+
+    rejected = np.zeros(len(df), dtype=bool)
+    for reason, flagged, _ in checks:
+        if flagged.any():
+            summary['issues'][reason] = int(flagged.sum())
+            rejected |= flagged
+    summary['quarantined'] = int(rejected.sum())
+
+    # Reasons are only spelled out for the (few) rejected rows
+    rows = np.flatnonzero(rejected)
+    quarantine = decode_data(df.iloc[rows])
+    reasons = [[] for _ in rows]
+    for reason, flagged, col in checks:
+        for i in np.flatnonzero(flagged[rows]):
+            value = f" '{df[col].iloc[rows[i]]}'" if col else ''
+            reasons[i].append(f"{reason}{value}")
+    quarantine.insert(0, 'Row', rows + row_offset + 2)
+    quarantine['Reasons'] = ['; '.join(reason) for reason in reasons]
+    return ~rejected, quarantine, summary
+
+def merge_quality_summaries(summaries):
+    """Add up the validation counts of several chunks or files"""
+    merged = {'records': 0, 'quarantined': 0, 'issues': {}, 'unexpected_values': {},
+              'missing_values': {}, 'missing_columns': []}
+    for summary in summaries:
+        merged['records'] += summary['records']
+        merged['quarantined'] += summary['quarantined']
+        for key in ['issues', 'missing_values']:
+            for name, count in summary[key].items():
+                merged[key][name] = merged[key].get(name, 0) + count
+        for col, counts in summary['unexpected_values'].items():
+            merged_counts = merged['unexpected_values'].setdefault(col, {})
+            for value, count in counts.items():
+                merged_counts[value] = merged_counts.get(value, 0) + count
+        merged['missing_columns'] += [col for col in summary['missing_columns'] if col not in merged['missing_columns']]
+    return merged
+
+def data_quality_section(summary, quarantine_file=None, kept_invalid=False):
+    """Data quality summary of the validation stage for the JSON results"""
+    records = summary['records']
+    return {
+        'total_records': records,
+        'valid_records': records - summary['quarantined'],
+        'quarantined_records': summary['quarantined'],
+        'quarantine_rate': round(summary['quarantined'] / records * 100, 2) if records else 0,
+        'issues': dict(sorted(summary['issues'].items(), key=lambda item: -item[1])),
+        'unexpected_values': summary['unexpected_values'],
+        'missing_values': summary['missing_values'],
+        'missing_columns': summary['missing_columns'],
+        'quarantine_file': quarantine_file,
+        'invalid_records_analyzed': kept_invalid
+    }
+
+def print_quality(summary, quarantine_file, keep_invalid=False):
+    """One line per validation issue, and where the rejected rows went"""
+    if not summary['quarantined']:
+        print(f"✅ All {summary['records']} records passed validation")
+        return
+    action = "kept in the analysis, listed in" if keep_invalid else "left out of the analysis, written to"
+    print(f"⚠️  {summary['quarantined']} of {summary['records']} records failed validation "
+          f"({action} {quarantine_file}):")
+    for reason, count in summary['issues'].items():
+        print(f"   - {reason}: {count}")
+
+def write_quarantine(quarantine, path, append=False):
+    """Write (or append) rejected rows with their reasons; a stale file is removed when nothing was rejected"""
+    path = Path(path)
+    if len(quarantine):
+        quarantine.to_csv(path, mode='a' if append else 'w', header=not append, index=False)
+    elif not append and path.exists():
+        path.unlink()
+
+# Stratifiers kept in the count cube; every analysis section is a marginal of these
+CUBE_DIMENSIONS = ['Age_Group', 'Sex', 'CXR_results'] + SYMPTOM_COLS + [
+    'Symptom_Cumulative', 'DM', 'HIV', 'TB_Contact_History', 'TB_History',
+    'Sputum_R1', 'R1_Grading', 'Sputum_R2', 'R2_Grading', 'GeneXpertMTB', 'Diagnosis'
+]
+CUBE_COUNTS = ['n', 'first_row', 'age_n', 'age_sum', 'age_sq_sum']
+
+def cube_dimensions(cube):
+    """Dimension columns of a cube: CUBE_DIMENSIONS followed by any site levels"""
+    return [col for col in cube.columns if col not in CUBE_COUNTS]
+
+def build_count_cube(df, row_offset=0, dimensions=CUBE_DIMENSIONS):
+    """Aggregate patient rows into a count cube over dimensions in one encoded pass
+
+    Each cube row is one observed combination of stratifier values (bool columns read
+    back as 'Yes'/'No', missing values kept as their own label) with its patient count
+    'n', the row number where it first appeared (shifted by row_offset when df is a
+    slice of a larger file) and the Age sums needed for the Age/TB correlation. Cells
+    are ordered by first appearance, so cube[col].unique() lists the values in the same
+    order as df[col].unique(). Site columns appended to CUBE_DIMENSIONS give a leaf cube
+    that national_cube() and site_cubes() roll up.
+    """
+    missing = [col for col in dimensions if col not in df.columns]
+    if missing:
+        raise ValueError(f"Missing columns for the count cube: {', '.join(missing)}")
+
+    key = np.zeros(len(df), dtype=np.int64)
+    radix = 1
+    codes_by_col = {}
+    labels_by_col = {}
+    for col in dimensions:
+        codes, labels = pd.factorize(df[col], use_na_sentinel=False)
+        if df[col].dtype == bool:
+            labels = np.where(labels, 'Yes', 'No')
+        # Missing values as NaN, so cube comparisons behave like they do on the raw column
+        labels = np.array([np.nan if pd.isna(label) else label for label in labels], dtype=object)
+        # Re-densify the combined key before the mixed-radix product can overflow
+        if radix * max(len(labels), 1) >= 2 ** 62:
+            _, key = np.unique(key, return_inverse=True)
+            radix = int(key.max()) + 1
+        key = key * max(len(labels), 1) + codes
+        radix *= max(len(labels), 1)
+        codes_by_col[col] = codes.astype(np.min_scalar_type(max(len(labels) - 1, 0)))
+        labels_by_col[col] = labels
+
+    _, first_row, cell = np.unique(key, return_index=True, return_inverse=True)
+    cell = cell.ravel()
+
+    age = df['Age'].to_numpy(dtype=float, na_value=np.nan)
+    age_valid = ~np.isnan(age)
+    age = np.where(age_valid, age, 0.0)
+
+    cube = pd.DataFrame({
+        col: labels_by_col[col].take(codes_by_col[col][first_row])
+        for col in dimensions
+    }).infer_objects()
+    cube['n'] = np.bincount(cell)
+    cube['first_row'] = first_row + row_offset
+    cube['age_n'] = np.bincount(cell, weights=age_valid)
+    cube['age_sum'] = np.bincount(cell, weights=age)
+    cube['age_sq_sum'] = np.bincount(cell, weights=age * age)
+
+    return cube.sort_values('first_row', kind='stable').reset_index(drop=True)
+
+def merge_count_cubes(cubes, dimensions=None):
+    """Combine cubes built from disjoint sets of rows into the cube of all of them
+
+    Summing over dimensions (default: every dimension of the cubes) drops the others,
+    which is how leaf cubes roll up to coarser site levels.
+    """
+    merged = pd.concat(cubes, ignore_index=True)
+    dimensions = cube_dimensions(merged) if dimensions is None else list(dimensions)
+    merged = merged.groupby(dimensions, dropna=False, sort=False).agg(
+        n=('n', 'sum'),
+        first_row=('first_row', 'min'),
+        age_n=('age_n', 'sum'),
+        age_sum=('age_sum', 'sum'),
+        age_sq_sum=('age_sq_sum', 'sum')
+    ).reset_index()
+    return merged.sort_values('first_row', kind='stable').reset_index(drop=True)
+
+def national_cube(cube):
+    """Roll a leaf cube with site levels up to the CUBE_DIMENSIONS cube the sections run on"""
+    if cube_dimensions(cube) == CUBE_DIMENSIONS:
+        return cube
+    return merge_count_cubes([cube], CUBE_DIMENSIONS)
+
+def site_cubes(cube, levels):
+    """(site labels, cube) pairs for every observed combination of the levels columns
+
+    The leaf cube is summed over the finer levels once and then split by site, so the
+    cost depends on the number of cube cells, not on the number of patients.
+    """
+    rolled = merge_count_cubes([cube], CUBE_DIMENSIONS + list(levels))
+    for key, site in rolled.groupby(list(levels), dropna=False, sort=True):
+        yield key, site[CUBE_DIMENSIONS + CUBE_COUNTS].reset_index(drop=True)
+
+def build_count_cube_chunked(filename, chunk_size, raw_csv=None, workers=1, trend_period='week',
+                             quarantine_file=None, keep_invalid=False, dimensions=CUBE_DIMENSIONS):
+    """Build the count cube of a CSV/Parquet file one row batch at a time
+
+    Peak memory stays bounded by chunk_size plus the cube itself (times the number of
+    batches in flight when workers > 1 spreads the batches over a process pool). When
+    raw_csv is given the decoded rows are streamed there as well. Every batch is
+    validated first; rejected rows go to quarantine_file and are left out unless
+    keep_invalid. Returns (cube, trends, quality): trends is the merged trend table of
+    the batches (None without screening dates), quality the validation summary.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    pending = deque()
+    cube = None
+    trends = None
+    summaries = []
+    seen_ids = np.array([], dtype=np.uint64)
+    row_offset = 0
+    reported = set()
+    try:
+        for raw_chunk in iter_data_chunks(filename, chunk_size, reported):
+            valid, quarantine, summary = validate_data(raw_chunk, seen_ids, row_offset)
+            if quarantine_file:
+                write_quarantine(quarantine, quarantine_file,
+                                 append=any(previous['quarantined'] for previous in summaries))
+            summaries.append(summary)
+            if 'ID' in raw_chunk.columns:
+                seen_ids = _merge_seen_ids(seen_ids, _id_hashes(raw_chunk['ID']))
+            chunk = raw_chunk if keep_invalid else raw_chunk[valid]
+
+            if len(chunk) and pool:
+                pending.append(pool.submit(build_count_cube, chunk, row_offset, dimensions))
+            elif len(chunk):
+                chunk_cube = build_count_cube(chunk, row_offset, dimensions)
+                cube = chunk_cube if cube is None else merge_count_cubes([cube, chunk_cube])
+            trends = merge_trend_tables([trends, build_trend_table(chunk, trend_period)])
+            if raw_csv:
+                decode_data(raw_chunk).to_csv(raw_csv, mode='a' if row_offset else 'w',
+                                              header=not row_offset, index=False)
+            row_offset += len(raw_chunk)
+            print(f"  ...{row_offset} records read")
+
+            # Keep at most two batches per worker queued
+            while len(pending) > 2 * workers or (pending and pending[0].done()):
+                chunk_cube = pending.popleft().result()
+                cube = chunk_cube if cube is None else merge_count_cubes([cube, chunk_cube])
+
+        while pending:
+            chunk_cube = pending.popleft().result()
+            cube = chunk_cube if cube is None else merge_count_cubes([cube, chunk_cube])
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+    if cube is None:
+        raise ValueError(f"No valid records found in '{filename}'")
+    return cube, trends, merge_quality_summaries(summaries)
+
+def _partition_rows(df, workers):
+    """Row positions handled by each worker
+
+    Whole facilities (or regions) go to one worker, largest first onto the least
+    loaded worker, when the data has such a column; otherwise rows are split into
+    equal contiguous ranges.
+    """
+    for col in OPTIONAL_COLUMNS:
+        if col in df.columns:
+            codes, _ = pd.factorize(df[col], use_na_sentinel=False)
+            sizes = np.bincount(codes)
+            owner = np.empty(len(sizes), dtype=np.int64)
+            load = np.zeros(workers, dtype=np.int64)
+            for group in np.argsort(-sizes, kind='stable'):
+                owner[group] = load.argmin()
+                load[owner[group]] += sizes[group]
+            row_owner = owner[codes]
+            return [np.flatnonzero(row_owner == worker) for worker in range(workers) if load[worker]]
+
+    return [rows for rows in np.array_split(np.arange(len(df)), workers) if len(rows)]
+
+def _shard_cube(shard, positions, dimensions=CUBE_DIMENSIONS):
+    """Process-pool task: count cube of one shard, with first_row mapped back to positions in the full frame"""
+    cube = build_count_cube(shard, dimensions=dimensions)
+    cube['first_row'] = positions[cube['first_row'].to_numpy()]
+    return cube
+
+def build_count_cube_parallel(df, workers, dimensions=CUBE_DIMENSIONS):
+    """Build the count cube of an in-memory frame with one shard per worker process
+
+    Shard cubes hold exact counts, so merging them gives the same cube (and the same
+    results) as the serial build_count_cube(df).
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    shards = _partition_rows(df, workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        cubes = list(pool.map(_shard_cube, [df.iloc[rows] for rows in shards], shards,
+                              [dimensions] * len(shards)))
+    return merge_count_cubes(cubes)
+
+def build_count_cube_incremental(df, filename, workers=1, state_file=STATE_FILE, dimensions=CUBE_DIMENSIONS):
+    """Fold only the records whose ID is new since the last run into the saved count cube
+
+    Falls back to a full build when there is no usable state: first run, another
+    source file, encoding rules or cube dimensions, or a file whose previously seen records
+    changed in number (rows deleted or IDs rewritten). The updated state is saved afterwards.
+    """
+    source = str(Path(filename).resolve())
+    state = pd.read_pickle(state_file) if state_file.exists() else None
+    if state is not None and (state['source'] != source or state['version'] != _encoding_version()
+                              or cube_dimensions(state['cube']) != list(dimensions)):
+        state = None
+
+    if state is not None:
+        is_new = ~df['ID'].isin(state['ids']).to_numpy()
+        if len(df) - is_new.sum() != state['rows']:
+            print(f"⚠️  {len(df) - is_new.sum()} previously seen records found, expected {state['rows']}; "
+                  f"recomputing everything")
+            state = None
+
+    if state is None:
+        print("Building full count cube (no usable incremental state)...")
+        if workers > 1:
+            cube = build_count_cube_parallel(df, workers, dimensions)
+        else:
+            cube = build_count_cube(df, dimensions=dimensions)
+    else:
+        new_rows = np.flatnonzero(is_new)
+        print(f"Folding {len(new_rows)} new records into the saved count cube...")
+        cube = state['cube']
+        if len(new_rows):
+            cube = merge_count_cubes([cube, _shard_cube(df.iloc[new_rows], new_rows, dimensions)])
+
+    state = {
+        'source': source,
+        'version': _encoding_version(),
+        'rows': len(df),
+        'ids': df['ID'].to_numpy(),
+        'cube': cube
+    }
+    _write_atomic(state_file, lambda tmp: pd.to_pickle(state, tmp))
+    return cube
+
+# Screening periods of the trend section and the strata broken down within each period
+TREND_PERIODS = {'week': 'W', 'month': 'M'}
+TREND_STRATA = ['Age_Group', 'Sex']
+TREND_WINDOW = 4
+
+# Per-period counts and seen IDs of the last --incremental run, kept next to analysis_results.json
+TREND_STATE_FILE = Path('trend_state.pkl')
+
+def _period_labels(dates, period):
+    """Start date of the week (YYYY-MM-DD) or the month (YYYY-MM) of each date; NaN when undated"""
+    periods = dates.dt.to_period(TREND_PERIODS[period])
+    if period == 'week':
+        return periods.dt.start_time.dt.strftime('%Y-%m-%d')
+    return periods.dt.strftime('%Y-%m')
+
+def _period_range(labels, period):
+    """Every period label from the first to the last one, so gaps show up as empty periods"""
+    first, last = min(labels), max(labels)
+    return _period_labels(pd.Series(pd.period_range(first, last, freq=TREND_PERIODS[period])
+                                    .to_timestamp()), period).tolist()
+
+def build_trend_table(df, period='week'):
+    """Indicator counts per screening period and stratum, all strata in one groupby
+
+    One row per observed (Period, Age_Group, Sex) with the number of patients, TB
+    diagnoses, symptomatic patients, each symptom, and tests done / positive. Records
+    without a usable date are kept under a missing Period. Returns None when the data
+    has no screening date column.
+    """
+    if DATE_COLUMN not in df.columns:
+        return None
+
+    symptoms = np.column_stack([_yes(df, symptom) for symptom in SYMPTOM_COLS])
+    sputum_done = df['Sputum_R1'].isin(['Positive', 'Negative']) | df['Sputum_R2'].isin(['Positive', 'Negative'])
+    counts = pd.DataFrame({
+        'n': 1,
+        'tb': df['Diagnosis'] == TB_POSITIVE,
+        'any_symptom': symptoms.any(axis=1),
+        **{symptom: symptoms[:, i] for i, symptom in enumerate(SYMPTOM_COLS)},
+        'cxr_done': df['CXR_results'].isin(['Normal'] + ABNORMAL_CXR),
+        'cxr_abnormal': df['CXR_results'].isin(ABNORMAL_CXR),
+        'sputum_done': sputum_done,
+        'sputum_positive': (df['Sputum_R1'] == 'Positive') | (df['Sputum_R2'] == 'Positive'),
+        'xpert_done': df['GeneXpertMTB'].isin(['MTB_Detected', 'MTB_Not_Detected']),
+        'xpert_detected': df['GeneXpertMTB'] == 'MTB_Detected'
+    }, index=df.index)
+
+    keys = [_period_labels(df[DATE_COLUMN], period).rename('Period')] + [df[col] for col in TREND_STRATA]
+    table = counts.groupby(keys, observed=True, dropna=False).sum().reset_index()
+    for col in TREND_STRATA:
+        table[col] = table[col].astype(object)
+    return table
+
+def merge_trend_tables(tables):
+    """Combine trend tables built from disjoint sets of rows; None when none of them has dates"""
+    tables = [table for table in tables if table is not None]
+    if not tables:
+        return None
+    merged = pd.concat(tables, ignore_index=True)
+    return merged.groupby(['Period'] + TREND_STRATA, dropna=False).sum().reset_index()
+
+def build_trend_table_incremental(df, filename, period, state_file=TREND_STATE_FILE):
+    """Add only the records whose ID is new since the last run to the saved per-period counts
+
+    New screenings fall into the latest periods, so adding a week of data aggregates
+    just that week's bucket. Falls back to a full build like build_count_cube_incremental,
+    and also when --trend-period changed.
+    """
+    if DATE_COLUMN not in df.columns:
+        return None
+
+    source = str(Path(filename).resolve())
+    state = pd.read_pickle(state_file) if state_file.exists() else None
+    if state is not None and (state['source'] != source or state['version'] != _encoding_version()
+                              or state['period'] != period):
+        state = None
+
+    if state is not None:
+        is_new = ~df['ID'].isin(state['ids']).to_numpy()
+        if len(df) - is_new.sum() != state['rows']:
+            state = None
+
+    if state is None:
+        table = build_trend_table(df, period)
+    else:
+        table = merge_trend_tables([state['table'], build_trend_table(df.iloc[np.flatnonzero(is_new)], period)])
+
+    state = {
+        'source': source,
+        'version': _encoding_version(),
+        'period': period,
+        'rows': len(df),
+        'ids': df['ID'].to_numpy(),
+        'table': table
+    }
+    _write_atomic(state_file, lambda tmp: pd.to_pickle(state, tmp))
+    return table
+
+def save_count_cube(cube, output_dir):
+    """Write the count cube next to the results (Parquet, or a pickle without pyarrow) for drill-down queries"""
+    path = Path(output_dir) / f"count_cube{_columnar_suffix()}"
+    if path.suffix == '.parquet':
+        _write_atomic(path, lambda tmp: cube.to_parquet(tmp, index=False))
+    else:
+        _write_atomic(path, lambda tmp: cube.to_pickle(tmp))
+    return path
+
+def load_count_cube(path):
+    """Read a saved count cube with its dimensions as categoricals, ready for query_cube"""
+    path = Path(path)
+    cube = pd.read_parquet(path) if path.suffix == '.parquet' else pd.read_pickle(path)
+    missing = [col for col in CUBE_DIMENSIONS + ['n'] if col not in cube]
+    if missing:
+        raise ValueError(f"{path} is not a count cube of this version (missing {', '.join(missing)})")
+    for col in cube_dimensions(cube):
+        cube[col] = cube[col].astype('category')
+    return cube
+
+def _match_values(column, values):
+    """Filter values as given on a query string, converted to the column's label type"""
+    if pd.api.types.is_numeric_dtype(column.cat.categories if hasattr(column, 'cat') else column):
+        return pd.to_numeric(pd.Series(values), errors='coerce').tolist()
+    return list(values)
+
+def query_cube(cube, filters=None, group_by=(), outcome=('Diagnosis', [TB_POSITIVE])):
+    """Patient count, outcome count and rate for any filter / group-by, by summing cube cells
+
+    filters maps a dimension to the values to keep, e.g. {'HIV': ['Yes']}; group_by lists
+    dimensions to break the result down by; outcome is (dimension, values) counted as a hit
+    (TB diagnosis by default). The cost depends on the number of cube cells, not patients.
+    """
+    filters = filters or {}
+    outcome_col, outcome_values = outcome
+    dimensions = cube_dimensions(cube)
+    unknown = [col for col in [*filters, *group_by, outcome_col] if col not in dimensions]
+    if unknown:
+        raise ValueError(f"Unknown dimensions: {', '.join(unknown)} (choose from {', '.join(dimensions)})")
+
+    mask = np.ones(len(cube), dtype=bool)
+    for col, values in filters.items():
+        mask &= cube[col].isin(_match_values(cube[col], values)).to_numpy()
+    selected = cube[mask]
+    counts = pd.DataFrame({
+        'n': selected['n'],
+        'outcome': selected['n'] * selected[outcome_col].isin(_match_values(selected[outcome_col], outcome_values)),
+        'age_n': selected['age_n'],
+        'age_sum': selected['age_sum']
+    })
+
+    def summary(totals):
+        n, hits = int(totals['n']), int(totals['outcome'])
+        return {
+            'n': n,
+            'outcome_count': hits,
+            'rate': round(hits / n * 100, 1) if n else None,
+            'mean_age': round(totals['age_sum'] / totals['age_n'], 1) if totals['age_n'] else None
+        }
+
+    result = {
+        'filters': filters,
+        'group_by': list(group_by),
+        'outcome': {outcome_col: list(outcome_values)},
+        **summary(counts.sum())
+    }
+    if group_by:
+        grouped = counts.groupby([selected[col] for col in group_by], observed=True, dropna=False).sum()
+        result['groups'] = [
+            {**dict(zip(group_by, key if isinstance(key, tuple) else (key,))), **summary(totals)}
+            for key, totals in grouped.iterrows()
+        ]
+    return result
+
+def _cube_value_counts(cube, col):
+    """Equivalent of df[col].value_counts().to_dict() computed from the cube"""
+    counts = cube.groupby(col, sort=False)['n'].sum()
+    return counts.sort_values(ascending=False, kind='stable').to_dict()
+
+def _tb_rates_by(cube, col):
+    """TB positivity (%) for each observed value of col, in order of first appearance"""
+    totals = cube.groupby(col, sort=False)['n'].sum()
+    tb_counts = cube[cube['Diagnosis'] == TB_POSITIVE].groupby(col, sort=False)['n'].sum()
+
+    rates = {}
+    for value, total in totals.items():
+        tb_rate = tb_counts.get(value, 0) / int(total) * 100
+        rates[value] = round(tb_rate, 2)
+    return rates
+
+def _pearson(n, sum_x, sum_y, sum_xx, sum_yy, sum_xy):
+    """Pearson correlation from sufficient statistics (NaN when either side is constant)"""
+    numerator = n * sum_xy - sum_x * sum_y
+    denominator = np.sqrt(float(n * sum_xx - sum_x * sum_x) * float(n * sum_yy - sum_y * sum_y))
+    if denominator == 0:
+        return np.float64(np.nan)
+    return np.float64(min(max(numerator / denominator, -1.0), 1.0))
+
+def _symptom_mask(symptoms):
+    """6-bit symptom mask: bit i is set when SYMPTOM_COLS[i] is present"""
+    return sum(1 << SYMPTOM_COLS.index(symptom) for symptom in symptoms)
+
+def _symptom_label(mask):
+    """Readable name of a symptom mask, e.g. 'Cough+Fever'"""
+    return '+'.join(s for bit, s in enumerate(SYMPTOM_COLS) if mask >> bit & 1) or 'No_Symptoms'
+
+def symptom_pattern_counts(cube):
+    """Patient and TB counts for every 6-bit symptom mask
+
+    Returns (exact, at_least), two (64, 2) int arrays of [patients, TB patients] indexed
+    by mask. exact comes from one bincount over the cube cells' masks; at_least[m]
+    adds up exact over every superset of m (a superset-sum transform), giving all
+    "has at least these symptoms" counts at once.
+    """
+    masks = np.zeros(len(cube), dtype=np.int64)
+    for bit, symptom in enumerate(SYMPTOM_COLS):
+        masks |= (cube[symptom] == 'Yes').to_numpy().astype(np.int64) << bit
+
+    n = cube['n'].to_numpy()
+    is_tb = (cube['Diagnosis'] == TB_POSITIVE).to_numpy()
+    size = 1 << len(SYMPTOM_COLS)
+    exact = np.stack([
+        np.bincount(masks, weights=n, minlength=size),
+        np.bincount(masks, weights=n * is_tb, minlength=size)
+    ], axis=1).astype(np.int64)
+
+    at_least = exact.copy()
+    all_masks = np.arange(size)
+    for bit in range(len(SYMPTOM_COLS)):
+        without_bit = all_masks[(all_masks >> bit & 1) == 0]
+        at_least[without_bit] += at_least[without_bit | (1 << bit)]
+
+    return exact, at_least
+
+def _pattern_summary(counts, masks):
+    """{label: {'count', 'tb_count', 'diagnostic_yield'}} for the given masks"""
+    summary = {}
+    for mask in masks:
+        count, tb_count = (int(value) for value in counts[mask])
+        summary[_symptom_label(mask)] = {
+            'count': count,
+            'tb_count': tb_count,
+            'diagnostic_yield': round(tb_count / count * 100, 2) if count > 0 else 0
+        }
+    return summary
+
+def analyze_demographics(cube):
     """1. Demographic Analysis - Age & Sex Distribution"""
     # Age group distribution
-    age_sex_dist = df.groupby(['Age_Group', 'Sex']).size().unstack(fill_value=0)
+    age_sex_dist = cube.groupby(['Age_Group', 'Sex'])['n'].sum().unstack(fill_value=0)
 
     # Age-Sex Pyramid data (for pyramid chart)
     pyramid_data = {
-        'labels': df['Age_Group'].unique().tolist(),
+        'labels': cube['Age_Group'].unique().tolist(),
         'male_counts': [],
         'female_counts': []
     }
 
+    male = cube[cube['Sex'] == 'Male'].groupby('Age_Group', sort=False)['n'].sum()
+    female = cube[cube['Sex'] == 'Female'].groupby('Age_Group', sort=False)['n'].sum()
     for age_group in pyramid_data['labels']:
-        male_count = len(df[(df['Age_Group'] == age_group) & (df['Sex'] == 'Male')])
-        female_count = len(df[(df['Age_Group'] == age_group) & (df['Sex'] == 'Female')])
+        male_count = int(male.get(age_group, 0))
+        female_count = int(female.get(age_group, 0))
         pyramid_data['male_counts'].append(-male_count)  # Negative for left side
         pyramid_data['female_counts'].append(female_count)
 
     return {
         'age_sex_distribution': age_sex_dist.to_dict(),
         'age_sex_pyramid': pyramid_data,
-        'total_patients': len(df)
+        'total_patients': int(cube['n'].sum())
     }
 
-def analyze_symptoms(df):
+def analyze_symptoms(cube):
     """2. Symptom Analysis - Prevalence and Patterns"""
-    symptom_cols = ['Cough', 'Fever', 'Weight_Loss', 'Tiredness', 'Hemoptysis', 'Night_Sweat']
+    total = int(cube['n'].sum())
 
     # Overall symptom prevalence
     symptom_prevalence = {}
-    for symptom in symptom_cols:
-        prevalence = (df[symptom] == 'Yes').sum() / len(df) * 100
+    for symptom in SYMPTOM_COLS:
+        prevalence = cube.loc[cube[symptom] == 'Yes', 'n'].sum() / total * 100
         symptom_prevalence[symptom] = round(prevalence, 2)
 
     # Symptom prevalence in TB+ cases
-    tb_positive = df[df['Diagnosis'] == 'Clinically_Diagnosed_TB']
+    tb_positive = cube[cube['Diagnosis'] == TB_POSITIVE]
+    tb_total = int(tb_positive['n'].sum())
     symptom_tb_prevalence = {}
-    for symptom in symptom_cols:
-        if len(tb_positive) > 0:
-            prevalence = (tb_positive[symptom] == 'Yes').sum() / len(tb_positive) * 100
+    for symptom in SYMPTOM_COLS:
+        if tb_total > 0:
+            prevalence = tb_positive.loc[tb_positive[symptom] == 'Yes', 'n'].sum() / tb_total * 100
             symptom_tb_prevalence[symptom] = round(prevalence, 2)
         else:
             symptom_tb_prevalence[symptom] = 0
 
-    # Symptom combinations analysis
-    symptom_combinations = {
-        'Cough+Fever': len(df[(df['Cough'] == 'Yes') & (df['Fever'] == 'Yes')]),
-        'Cough+Weight_Loss': len(df[(df['Cough'] == 'Yes') & (df['Weight_Loss'] == 'Yes')]),
-        'Fever+Night_Sweat': len(df[(df['Fever'] == 'Yes') & (df['Night_Sweat'] == 'Yes')]),
-        'Cough+Hemoptysis': len(df[(df['Cough'] == 'Yes') & (df['Hemoptysis'] == 'Yes')]),
-        'All_Symptoms': len(df[(df['Cough'] == 'Yes') & (df['Fever'] == 'Yes') &
-                              (df['Weight_Loss'] == 'Yes') & (df['Night_Sweat'] == 'Yes')])
+    # Symptom combinations analysis (patients with at least these symptoms)
+    exact, at_least = symptom_pattern_counts(cube)
+    combination_members = {
+        'Cough+Fever': ['Cough', 'Fever'],
+        'Cough+Weight_Loss': ['Cough', 'Weight_Loss'],
+        'Fever+Night_Sweat': ['Fever', 'Night_Sweat'],
+        'Cough+Hemoptysis': ['Cough', 'Hemoptysis'],
+        'All_Symptoms': ['Cough', 'Fever', 'Weight_Loss', 'Night_Sweat']
     }
 
-    # Calculate diagnostic yield for each combination
+    symptom_combinations = {}
     combination_yield = {}
-    for combo, count in symptom_combinations.items():
+    for combo, members in combination_members.items():
+        count, combo_tb = (int(value) for value in at_least[_symptom_mask(members)])
+        symptom_combinations[combo] = count
+
+        # Calculate diagnostic yield for each combination
         if count > 0:
-            if combo == 'Cough+Fever':
-                combo_tb = len(df[(df['Cough'] == 'Yes') & (df['Fever'] == 'Yes') &
-                                 (df['Diagnosis'] == 'Clinically_Diagnosed_TB')])
-            elif combo == 'Cough+Weight_Loss':
-                combo_tb = len(df[(df['Cough'] == 'Yes') & (df['Weight_Loss'] == 'Yes') &
-                                 (df['Diagnosis'] == 'Clinically_Diagnosed_TB')])
-            elif combo == 'Fever+Night_Sweat':
-                combo_tb = len(df[(df['Fever'] == 'Yes') & (df['Night_Sweat'] == 'Yes') &
-                                 (df['Diagnosis'] == 'Clinically_Diagnosed_TB')])
-            elif combo == 'Cough+Hemoptysis':
-                combo_tb = len(df[(df['Cough'] == 'Yes') & (df['Hemoptysis'] == 'Yes') &
-                                 (df['Diagnosis'] == 'Clinically_Diagnosed_TB')])
-            elif combo == 'All_Symptoms':
-                combo_tb = len(df[(df['Cough'] == 'Yes') & (df['Fever'] == 'Yes') &
-                                 (df['Weight_Loss'] == 'Yes') & (df['Night_Sweat'] == 'Yes') &
-                                 (df['Diagnosis'] == 'Clinically_Diagnosed_TB')])
-
-            yield_rate = (combo_tb / count * 100) if count > 0 else 0
-            combination_yield[combo] = round(yield_rate, 2)
+            combination_yield[combo] = round(combo_tb / count * 100, 2)
         else:
             combination_yield[combo] = 0
 
+    all_masks = range(len(exact))
     return {
         'symptom_prevalence': symptom_prevalence,
         'symptom_tb_prevalence': symptom_tb_prevalence,
         'symptom_combinations': symptom_combinations,
-        'combination_diagnostic_yield': combination_yield
+        'combination_diagnostic_yield': combination_yield,
+        # Every exact symptom pattern, and every "at least these symptoms" subset
+        'symptom_patterns': _pattern_summary(exact, all_masks),
+        'symptom_subsets': _pattern_summary(at_least, all_masks[1:])
     }
 
-def analyze_comorbidities(df):
+def analyze_comorbidities(cube):
     """3. Comorbidity Analysis - HIV & DM"""
-    # Overall comorbidity distribution
-    hiv_dist = df['HIV'].value_counts().to_dict()
-    dm_dist = df['DM'].value_counts().to_dict()
-
-    # TB positivity by comorbidity
-    tb_positive = df[df['Diagnosis'] == 'Clinically_Diagnosed_TB']
-
-    hiv_tb_rate = {}
-    for hiv_status in df['HIV'].unique():
-        subset = df[df['HIV'] == hiv_status]
-        if len(subset) > 0:
-            tb_rate = (subset['Diagnosis'] == 'Clinically_Diagnosed_TB').sum() / len(subset) * 100
-            hiv_tb_rate[hiv_status] = round(tb_rate, 2)
-
-    dm_tb_rate = {}
-    for dm_status in df['DM'].unique():
-        subset = df[df['DM'] == dm_status]
-        if len(subset) > 0:
-            tb_rate = (subset['Diagnosis'] == 'Clinically_Diagnosed_TB').sum() / len(subset) * 100
-            dm_tb_rate[dm_status] = round(tb_rate, 2)
-
     return {
-        'hiv_distribution': hiv_dist,
-        'dm_distribution': dm_dist,
-        'hiv_tb_rates': hiv_tb_rate,
-        'dm_tb_rates': dm_tb_rate
+        'hiv_distribution': _cube_value_counts(cube, 'HIV'),
+        'dm_distribution': _cube_value_counts(cube, 'DM'),
+        'hiv_tb_rates': _tb_rates_by(cube, 'HIV'),
+        'dm_tb_rates': _tb_rates_by(cube, 'DM')
     }
 
-def analyze_diagnostic_tests(df):
+# Index tests: (result column, positive results, negative results); anything else counts as not tested
+DIAGNOSTIC_TESTS = {
+    'CXR': ('CXR_results', ABNORMAL_CXR, ['Normal']),
+    'Sputum_R1': ('Sputum_R1', ['Positive'], ['Negative']),
+    'Sputum_R2': ('Sputum_R2', ['Positive'], ['Negative']),
+    'GeneXpert': ('GeneXpertMTB', ['MTB_Detected'], ['MTB_Not_Detected']),
+    **{symptom: (symptom, ['Yes'], ['No']) for symptom in SYMPTOM_COLS}
+}
+SMEAR_GRADES = ['Scanty', '1+', '2+', '3+']
+BOOTSTRAP_REPLICATES = 1000
+
+def _test_results(cube):
+    """Result of every test in every cube cell: 1 positive, 0 negative, -1 not tested"""
+    results = {}
+    for name, (col, positive, negative) in DIAGNOSTIC_TESTS.items():
+        results[name] = np.where(cube[col].isin(positive), 1, np.where(cube[col].isin(negative), 0, -1))
+
+    # Combined screens: either smear positive, and any symptom at all
+    r1, r2 = results['Sputum_R1'], results['Sputum_R2']
+    results['Sputum_Microscopy'] = np.where((r1 == 1) | (r2 == 1), 1, np.where((r1 == 0) | (r2 == 0), 0, -1))
+    symptoms = np.column_stack([results[symptom] for symptom in SYMPTOM_COLS])
+    results['Clinical_Symptoms'] = np.where((symptoms == 1).any(axis=1), 1,
+                                            np.where((symptoms == 0).all(axis=1), 0, -1))
+    return results
+
+def diagnostic_confusion_counts(cube):
+    """2x2 tables of every test against the diagnosis, from one bincount over the cube
+
+    Returns (names, counts) where counts[i] holds [TP, FP, FN, TN, not tested] of test i.
+    Patients without a diagnosis are left out of every table.
+    """
+    results = _test_results(cube)
+    names = list(results)
+    diagnosis = cube['Diagnosis']
+    reference = np.where(diagnosis == TB_POSITIVE, 0, np.where(diagnosis == 'No_TB', 1, -1))
+
+    # Slot per (test, outcome): TP=0, FP=1, FN=2, TN=3, not tested=4
+    outcome = np.column_stack([
+        np.where(results[name] < 0, 4, (1 - results[name]) * 2 + reference) for name in names
+    ])
+    keys = outcome + 5 * np.arange(len(names))
+    known = np.repeat((reference >= 0)[:, None], len(names), axis=1)
+    weights = np.repeat(cube['n'].to_numpy(dtype=float)[:, None], len(names), axis=1)
+    counts = np.bincount(keys[known], weights=weights[known], minlength=5 * len(names))
+    return names, counts.reshape(len(names), 5).astype(np.int64)
+
+def _accuracy_metrics(tp, fp, fn, tn):
+    """Sensitivity, specificity, PPV, NPV and likelihood ratios of 2x2 tables (arrays broadcast)"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sensitivity = tp / (tp + fn)
+        specificity = tn / (tn + fp)
+        return {
+            'sensitivity': sensitivity,
+            'specificity': specificity,
+            'ppv': tp / (tp + fp),
+            'npv': tn / (tn + fn),
+            'lr_positive': sensitivity / (1 - specificity),
+            'lr_negative': (1 - sensitivity) / specificity
+        }
+
+def _wilson_interval(successes, total, z=1.96):
+    """Wilson score interval of a proportion, or None for an empty denominator"""
+    if total == 0:
+        return None
+    p = successes / total
+    centre = (p + z ** 2 / (2 * total)) / (1 + z ** 2 / total)
+    margin = z * np.sqrt(p * (1 - p) / total + z ** 2 / (4 * total ** 2)) / (1 + z ** 2 / total)
+    return [centre - margin, centre + margin]
+
+def _ratio_interval(ratio, variance, z=1.96):
+    """Log-method confidence interval of a likelihood ratio"""
+    if not np.isfinite(ratio) or ratio <= 0 or not np.isfinite(variance):
+        return None
+    spread = z * np.sqrt(variance)
+    return [ratio * np.exp(-spread), ratio * np.exp(spread)]
+
+def bootstrap_accuracy(counts, replicates=BOOTSTRAP_REPLICATES, seed=0):
+    """Percentile bootstrap CIs of every metric, for all tests at once
+
+    Resampling patients with replacement only changes how many land in each of a test's
+    five outcome slots, so each replicate is one multinomial draw over the table: the
+    cost depends on the number of replicates, not on the number of patients.
+    Returns {metric: (tests, 2) array of 95% bounds}.
+    """
+    rng = np.random.default_rng(seed)
+    totals = counts.sum(axis=1)
+    draws = np.stack([
+        rng.multinomial(total, row / total, size=replicates) if total else np.zeros((replicates, 5))
+        for row, total in zip(counts, totals)
+    ])
+    metrics = _accuracy_metrics(draws[..., 0], draws[..., 1], draws[..., 2], draws[..., 3])
+    bounds = {}
+    for metric, values in metrics.items():
+        values = np.where(np.isfinite(values), values, np.nan)
+        with np.errstate(all='ignore'):
+            # Tests with no finite replicate of a metric get NaN bounds
+            bounds[metric] = np.nanpercentile(values, [2.5, 97.5], axis=1).T if np.isfinite(values).any() \
+                else np.full((len(counts), 2), np.nan)
+    return bounds
+
+def _smear_grading(cube, grading_col):
+    """Patients per smear grade by diagnosis, and sensitivity when calling that grade or higher positive"""
+    tb_total = int(cube.loc[cube['Diagnosis'] == TB_POSITIVE, 'n'].sum())
+    grading = {}
+    at_or_above = 0
+    for grade in reversed(SMEAR_GRADES):
+        graded = cube[grading_col] == grade
+        tb_count = int(cube.loc[graded & (cube['Diagnosis'] == TB_POSITIVE), 'n'].sum())
+        at_or_above += tb_count
+        grading[grade] = {
+            'tb': tb_count,
+            'no_tb': int(cube.loc[graded & (cube['Diagnosis'] == 'No_TB'), 'n'].sum()),
+            'sensitivity_at_or_above': round(at_or_above / tb_total * 100, 1) if tb_total else None
+        }
+    return {grade: grading[grade] for grade in SMEAR_GRADES}
+
+def diagnostic_accuracy(cube, replicates=BOOTSTRAP_REPLICATES):
+    """Full 2x2 table and accuracy metrics with Wilson, log-method and bootstrap 95% CIs per test"""
+    names, counts = diagnostic_confusion_counts(cube)
+    tp, fp, fn, tn = (counts[:, slot].astype(float) for slot in range(4))
+    point = _accuracy_metrics(tp, fp, fn, tn)
+    bootstrap = bootstrap_accuracy(counts, replicates)
+
+    def rounded(value, digits):
+        return round(float(value), digits) if np.isfinite(value) else None
+
+    def interval(bounds, digits, scale=1):
+        if bounds is None or not np.all(np.isfinite(bounds)):
+            return None
+        return [round(float(bound) * scale, digits) for bound in bounds]
+
+    accuracy = {}
+    for i, name in enumerate(names):
+        proportions = {
+            'sensitivity': (tp[i], tp[i] + fn[i]),
+            'specificity': (tn[i], tn[i] + fp[i]),
+            'ppv': (tp[i], tp[i] + fp[i]),
+            'npv': (tn[i], tn[i] + fn[i])
+        }
+        result = {'table': dict(zip(['tp', 'fp', 'fn', 'tn', 'not_tested'], counts[i].tolist()))}
+        for metric, (successes, total) in proportions.items():
+            result[metric] = {
+                'value': rounded(point[metric][i] * 100, 1),
+                'ci_wilson': interval(_wilson_interval(successes, total), 1, 100),
+                'ci_bootstrap': interval(bootstrap[metric][i], 1, 100)
+            }
+        with np.errstate(divide='ignore'):
+            lr_variances = {
+                'lr_positive': 1 / tp[i] - 1 / (tp[i] + fn[i]) + 1 / fp[i] - 1 / (fp[i] + tn[i]),
+                'lr_negative': 1 / fn[i] - 1 / (tp[i] + fn[i]) + 1 / tn[i] - 1 / (fp[i] + tn[i])
+            }
+        for metric, variance in lr_variances.items():
+            result[metric] = {
+                'value': rounded(point[metric][i], 2),
+                'ci_log': interval(_ratio_interval(point[metric][i], variance), 2),
+                'ci_bootstrap': interval(bootstrap[metric][i], 2)
+            }
+        accuracy[name] = result
+
+    accuracy['Sputum_R1']['grading'] = _smear_grading(cube, 'R1_Grading')
+    accuracy['Sputum_R2']['grading'] = _smear_grading(cube, 'R2_Grading')
+    return accuracy
+
+def analyze_diagnostic_tests(cube):
     """4. Diagnostic Test Analysis"""
     test_cols = ['CXR_results', 'Sputum_R1', 'Sputum_R2', 'GeneXpertMTB']
 
     # Test distribution
     test_distribution = {}
     for test in test_cols:
-        test_distribution[test] = df[test].value_counts().to_dict()
-
-    # Test performance metrics (simplified)
-    tb_positive = df[df['Diagnosis'] == 'Clinically_Diagnosed_TB']
-    tb_negative = df[df['Diagnosis'] == 'No_TB']
-
-    # CXR Performance
-    cxr_abnormal_tb = len(tb_positive[tb_positive['CXR_results'].isin(['TB_Suspect', 'Abnormal_TB'])])
-    cxr_normal_tb = len(tb_positive[tb_positive['CXR_results'] == 'Normal'])
-    cxr_abnormal_no_tb = len(tb_negative[tb_negative['CXR_results'].isin(['TB_Suspect', 'Abnormal_TB'])])
-    cxr_normal_no_tb = len(tb_negative[tb_negative['CXR_results'] == 'Normal'])
-
-    # Calculate sensitivity and specificity for CXR
-    cxr_sensitivity = (cxr_abnormal_tb / len(tb_positive) * 100) if len(tb_positive) > 0 else 0
-    cxr_specificity = (cxr_normal_no_tb / len(tb_negative) * 100) if len(tb_negative) > 0 else 0
-
-    test_performance = {
-        'CXR': {
-            'sensitivity': round(cxr_sensitivity, 1),
-            'specificity': round(cxr_specificity, 1),
-            'turnaround_time': '30 minutes'
-        },
-        'GeneXpert': {
-            'sensitivity': 95.0,  # Standard values from literature
-            'specificity': 98.0,
-            'turnaround_time': '2 hours'
-        },
-        'Sputum_Microscopy': {
-            'sensitivity': 68.0,
-            'specificity': 97.0,
-            'turnaround_time': '1 day'
-        },
-        'Clinical_Symptoms': {
-            'sensitivity': 78.0,
-            'specificity': 65.0,
-            'turnaround_time': 'Immediate'
-        }
+        test_distribution[test] = _cube_value_counts(cube, test)
+
+    # Test performance from the diagnostic accuracy engine
+    accuracy = diagnostic_accuracy(cube)
+    turnaround_times = {
+        'CXR': '30 minutes',
+        'GeneXpert': '2 hours',
+        'Sputum_Microscopy': '1 day',
+        'Clinical_Symptoms': 'Immediate'
     }
+    test_performance = {}
+    for test, turnaround_time in turnaround_times.items():
+        test_performance[test] = {
+            'sensitivity': accuracy[test]['sensitivity']['value'] or 0,
+            'specificity': accuracy[test]['specificity']['value'] or 0,
+            'turnaround_time': turnaround_time
+        }
 
     return {
         'test_distribution': test_distribution,
-        'test_performance': test_performance
+        'test_performance': test_performance,
+        'accuracy': accuracy,
+        'bootstrap_replicates': BOOTSTRAP_REPLICATES
     }
 
-def analyze_risk_factors(df):
+def analyze_risk_factors(cube):
     """5. Risk Factor Analysis"""
-    tb_positive = df[df['Diagnosis'] == 'Clinically_Diagnosed_TB']
-
-    # TB Contact History analysis
-    contact_tb_rate = {}
-    for contact_status in df['TB_Contact_History'].unique():
-        subset = df[df['TB_Contact_History'] == contact_status]
-        if len(subset) > 0:
-            tb_rate = (subset['Diagnosis'] == 'Clinically_Diagnosed_TB').sum() / len(subset) * 100
-            contact_tb_rate[contact_status] = round(tb_rate, 2)
-
-    # Previous TB History analysis
-    prev_tb_rate = {}
-    for prev_status in df['TB_History'].unique():
-        subset = df[df['TB_History'] == prev_status]
-        if len(subset) > 0:
-            tb_rate = (subset['Diagnosis'] == 'Clinically_Diagnosed_TB').sum() / len(subset) * 100
-            prev_tb_rate[prev_status] = round(tb_rate, 2)
+    tb_positive = cube[cube['Diagnosis'] == TB_POSITIVE]
+    tb_negative = cube[cube['Diagnosis'] == 'No_TB']
+    tb_pos_total = int(tb_positive['n'].sum())
+    tb_neg_total = int(tb_negative['n'].sum())
 
     # Symptom vs TB analysis
     symptom_cols = ['Cough', 'Fever', 'Weight_Loss']
     symptom_tb_analysis = {}
 
     for symptom in symptom_cols:
-        tb_pos_with_symptom = len(tb_positive[tb_positive[symptom] == 'Yes'])
-        tb_pos_total = len(tb_positive)
-        tb_neg_with_symptom = len(df[(df['Diagnosis'] == 'No_TB') & (df[symptom] == 'Yes')])
-        tb_neg_total = len(df[df['Diagnosis'] == 'No_TB'])
+        tb_pos_with_symptom = int(tb_positive.loc[tb_positive[symptom] == 'Yes', 'n'].sum())
+        tb_neg_with_symptom = int(tb_negative.loc[tb_negative[symptom] == 'Yes', 'n'].sum())
 
         tb_pos_rate = (tb_pos_with_symptom / tb_pos_total * 100) if tb_pos_total > 0 else 0
         tb_neg_rate = (tb_neg_with_symptom / tb_neg_total * 100) if tb_neg_total > 0 else 0
@@ -260,300 +1425,1422 @@ def analyze_risk_factors(df):
         }
 
     return {
-        'contact_history_tb_rates': contact_tb_rate,
-        'previous_tb_rates': prev_tb_rate,
+        'contact_history_tb_rates': _tb_rates_by(cube, 'TB_Contact_History'),
+        'previous_tb_rates': _tb_rates_by(cube, 'TB_History'),
         'symptom_tb_analysis': symptom_tb_analysis
     }
 
-def analyze_epidemiology(df):
+def analyze_epidemiology(cube):
     """6. Epidemiological Analysis"""
+    is_tb = cube['Diagnosis'] == TB_POSITIVE
+
     # TB prevalence by age group and sex
+    totals = cube.groupby(['Age_Group', 'Sex'])['n'].sum()
+    tb_counts = cube[is_tb].groupby(['Age_Group', 'Sex'])['n'].sum()
     prevalence_by_demographics = {}
 
-    for age_group in df['Age_Group'].unique():
+    for age_group in cube['Age_Group'].unique():
         prevalence_by_demographics[age_group] = {}
-        for sex in df['Sex'].unique():
-            subset = df[(df['Age_Group'] == age_group) & (df['Sex'] == sex)]
-            if len(subset) > 0:
-                tb_rate = (subset['Diagnosis'] == 'Clinically_Diagnosed_TB').sum() / len(subset) * 100
+        for sex in cube['Sex'].unique():
+            total = int(totals.get((age_group, sex), 0))
+            if total > 0:
+                tb_rate = tb_counts.get((age_group, sex), 0) / total * 100
                 prevalence_by_demographics[age_group][sex] = round(tb_rate, 2)
             else:
                 prevalence_by_demographics[age_group][sex] = 0
 
     # High-risk subgroup analysis
-    high_risk_analysis = {}
-
-    # HIV+ with abnormal CXR
-    hiv_pos_abnormal_cxr = df[(df['HIV'] == 'Yes') &
-                              (df['CXR_results'].isin(['TB_Suspect', 'Abnormal_TB']))]
-    if len(hiv_pos_abnormal_cxr) > 0:
-        tb_rate = (hiv_pos_abnormal_cxr['Diagnosis'] == 'Clinically_Diagnosed_TB').sum() / len(hiv_pos_abnormal_cxr) * 100
-        high_risk_analysis['HIV+ & Abnormal CXR'] = round(tb_rate, 2)
-    else:
-        high_risk_analysis['HIV+ & Abnormal CXR'] = 0
+    high_risk_subgroups = {
+        'HIV+ & Abnormal CXR': (cube['HIV'] == 'Yes') & cube['CXR_results'].isin(ABNORMAL_CXR),
+        # Contact History & Age >54 (we don't have >54 in current data, so use existing age groups)
+        'Contact History & Age >54': (cube['TB_Contact_History'] == 'Yes') & (cube['Age_Group'] == '>54')
+    }
 
-    # Contact History & Age >54 (we don't have >54 in current data, so use existing age groups)
-    contact_older = df[(df['TB_Contact_History'] == 'Yes') & (df['Age_Group'] == '>54')]
-    if len(contact_older) > 0:
-        tb_rate = (contact_older['Diagnosis'] == 'Clinically_Diagnosed_TB').sum() / len(contact_older) * 100
-        high_risk_analysis['Contact History & Age >54'] = round(tb_rate, 2)
-    else:
-        high_risk_analysis['Contact History & Age >54'] = 0
+    high_risk_analysis = {}
+    for subgroup, in_subgroup in high_risk_subgroups.items():
+        total = int(cube.loc[in_subgroup, 'n'].sum())
+        if total > 0:
+            tb_rate = cube.loc[in_subgroup & is_tb, 'n'].sum() / total * 100
+            high_risk_analysis[subgroup] = round(tb_rate, 2)
+        else:
+            high_risk_analysis[subgroup] = 0
 
     return {
         'prevalence_by_demographics': prevalence_by_demographics,
         'high_risk_subgroups': high_risk_analysis
     }
 
-def analyze_patient_journey(df):
+def analyze_patient_journey(cube):
     """7. Patient Journey Analysis (Sankey Flow)"""
     # Simplified patient flow: Symptoms -> Tests -> Diagnosis
+    symptomatic = cube['Symptom_Cumulative'] > 0
+    had_cxr = cube['CXR_results'] != 'Not_Done'
 
-    # Count patients with symptoms
-    symptomatic = df[df['Symptom_Cumulative'] > 0]
+    flows = [
+        ('Symptoms', 'CXR', symptomatic & had_cxr),
+        ('Symptoms', 'GeneXpert', symptomatic & (cube['GeneXpertMTB'] != 'Not_Done')),
+        ('CXR', 'TB Diagnosis', had_cxr & (cube['Diagnosis'] == TB_POSITIVE)),
+        ('CXR', 'No TB', had_cxr & (cube['Diagnosis'] == 'No_TB'))
+    ]
 
     # Flow data for Sankey diagram
     flow_data = []
-
-    # Symptoms to CXR
-    symptoms_to_cxr = len(df[(df['Symptom_Cumulative'] > 0) &
-                            (df['CXR_results'] != 'Not_Done')])
-    if symptoms_to_cxr > 0:
-        flow_data.append({'from': 'Symptoms', 'to': 'CXR', 'flow': symptoms_to_cxr})
-
-    # Symptoms to GeneXpert
-    symptoms_to_genexpert = len(df[(df['Symptom_Cumulative'] > 0) &
-                                  (df['GeneXpertMTB'] != 'Not_Done')])
-    if symptoms_to_genexpert > 0:
-        flow_data.append({'from': 'Symptoms', 'to': 'GeneXpert', 'flow': symptoms_to_genexpert})
-
-    # CXR to TB Diagnosis
-    cxr_to_tb = len(df[(df['CXR_results'] != 'Not_Done') &
-                      (df['Diagnosis'] == 'Clinically_Diagnosed_TB')])
-    if cxr_to_tb > 0:
-        flow_data.append({'from': 'CXR', 'to': 'TB Diagnosis', 'flow': cxr_to_tb})
-
-    # CXR to No TB
-    cxr_to_no_tb = len(df[(df['CXR_results'] != 'Not_Done') &
-                         (df['Diagnosis'] == 'No_TB')])
-    if cxr_to_no_tb > 0:
-        flow_data.append({'from': 'CXR', 'to': 'No TB', 'flow': cxr_to_no_tb})
+    for source, target, in_flow in flows:
+        flow = int(cube.loc[in_flow, 'n'].sum())
+        if flow > 0:
+            flow_data.append({'from': source, 'to': target, 'flow': flow})
 
     return {
         'patient_flow': flow_data,
-        'total_symptomatic': len(symptomatic)
+        'total_symptomatic': int(cube.loc[symptomatic, 'n'].sum())
     }
 
-def calculate_predictive_metrics(df):
-    """8. Predictive Modeling Metrics"""
-    # Feature importance based on correlation with TB diagnosis
-    feature_cols = ['Age', 'CXR_results', 'Cough', 'TB_Contact_History', 'HIV', 'DM', 'GeneXpertMTB']
-
-    # Convert categorical to numeric for correlation
-    df_numeric = df.copy()
-    df_numeric['TB_Diagnosis_Binary'] = (df['Diagnosis'] == 'Clinically_Diagnosed_TB').astype(int)
-
-    # Simple feature importance based on correlation
-    feature_importance = {}
-    for feature in feature_cols:
-        if feature in ['Cough', 'TB_Contact_History', 'HIV', 'DM']:
-            # Binary categorical
-            df_numeric[f'{feature}_binary'] = (df[feature] == 'Yes').astype(int)
-            corr = abs(df_numeric[f'{feature}_binary'].corr(df_numeric['TB_Diagnosis_Binary']))
-        elif feature == 'CXR_results':
-            # Multi-categorical - use abnormal as binary
-            df_numeric['CXR_abnormal'] = df[feature].isin(['TB_Suspect', 'Abnormal_TB']).astype(int)
-            corr = abs(df_numeric['CXR_abnormal'].corr(df_numeric['TB_Diagnosis_Binary']))
-        elif feature == 'GeneXpertMTB':
-            # Use positive detection
-            df_numeric['GeneXpert_positive'] = (df[feature] == 'MTB_Detected').astype(int)
-            # Since we don't have positives in current data, use a default
-            corr = 0.45  # Standard high importance for GeneXpert
+# Predictors of the TB models, one-hot encoded from the count cube
+MODEL_FEATURES = ['Age_Group', 'Sex', 'CXR_results'] + SYMPTOM_COLS + [
+    'DM', 'HIV', 'TB_Contact_History', 'TB_History', 'Sputum_R1', 'Sputum_R2', 'GeneXpertMTB'
+]
+CV_FOLDS = 5
+
+# Gradient-boosted trees: rounds, depth, learning rate and L2 penalty on leaf values
+BOOSTING_PARAMS = {'rounds': 40, 'depth': 3, 'rate': 0.2, 'l2': 1.0}
+
+def model_design_matrix(cube):
+    """One-hot feature matrix of the cube cells, built once for every model and fold
+
+    Returns (X, y, w, columns) where each row is a cube cell, y marks TB cells, w holds
+    the patient counts used as sample weights, and columns lists (feature, level) pairs.
+    Missing values get no indicator, so they act as the reference level.
+    """
+    blocks = []
+    columns = []
+    for feature in MODEL_FEATURES:
+        codes, levels = pd.factorize(cube[feature], sort=True)
+        block = np.zeros((len(cube), len(levels)))
+        present = codes >= 0
+        block[np.flatnonzero(present), codes[present]] = 1.0
+        blocks.append(block)
+        columns += [(feature, level) for level in levels]
+    X = np.hstack(blocks)
+    y = (cube['Diagnosis'] == TB_POSITIVE).to_numpy(dtype=float)
+    w = cube['n'].to_numpy(dtype=float)
+    return X, y, w, columns
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -35, 35)))
+
+def _fit_logistic(X, y, w, l2=1.0, iterations=50):
+    """Weighted L2-penalised logistic regression by Newton's method (intercept unpenalised)"""
+    Z = np.hstack([np.ones((len(X), 1)), X])
+    penalty = np.full(Z.shape[1], l2)
+    penalty[0] = 0.0
+    beta = np.zeros(Z.shape[1])
+    for _ in range(iterations):
+        p = _sigmoid(Z @ beta)
+        gradient = Z.T @ (w * (p - y)) + penalty * beta
+        hessian = (Z * (w * p * (1 - p))[:, None]).T @ Z + np.diag(penalty + 1e-9)
+        step = np.linalg.solve(hessian, gradient)
+        beta -= step
+        if np.abs(step).max() < 1e-8:
+            break
+    return beta
+
+def _predict_logistic(beta, X):
+    return _sigmoid(beta[0] + X @ beta[1:])
+
+def _grow_tree(X, g, h, depth, l2, gains):
+    """One level-wise regression tree on binary features
+
+    Every row is routed at once (node k splits into 2k for 'yes' and 2k+1 for 'no'), so a
+    level costs one matrix product. Returns (splits, leaf values, leaf of every row),
+    with a split of -1 where a node was not worth splitting.
+    """
+    rows = np.arange(len(X))
+    node = np.zeros(len(X), dtype=np.intp)
+    splits = []
+    for level in range(depth):
+        count = 1 << level
+        weighted = np.zeros((len(X), 2 * count), dtype=X.dtype)
+        weighted[rows, node] = g
+        weighted[rows, count + node] = h
+        sums = (X.T @ weighted).astype(float)
+        G_yes, H_yes = sums[:, :count], sums[:, count:]
+        G, H = np.bincount(node, g, count), np.bincount(node, h, count)
+        G_no, H_no = G - G_yes, H - H_yes
+
+        gain = G_yes ** 2 / (H_yes + l2) + G_no ** 2 / (H_no + l2) - G ** 2 / (H + l2)
+        gain[(H_yes < 1e-6) | (H_no < 1e-6)] = -np.inf
+        best = np.argmax(gain, axis=0)
+        best_gain = gain[best, np.arange(count)]
+        split = np.where(best_gain > 1e-9, best, -1)
+        np.add.at(gains, best[split >= 0], best_gain[split >= 0])
+
+        row_split = split[node]
+        yes = (row_split >= 0) & (X[rows, row_split] > 0.5)
+        node = 2 * node + ~yes
+        splits.append(split)
+
+    leaves = 1 << depth
+    values = -np.bincount(node, g, leaves) / (np.bincount(node, h, leaves) + l2)
+    return splits, values, node
+
+def _fit_boosting(X, y, w, rounds, depth, rate, l2):
+    """Weighted gradient-boosted trees on the logistic loss
+
+    Returns (model, predicted probability of every row of X, gain per column).
+    """
+    prior = np.clip((w * y).sum() / w.sum(), 1e-6, 1 - 1e-6)
+    base = np.log(prior / (1 - prior))
+    margin = np.full(len(X), base)
+    trees = []
+    gains = np.zeros(X.shape[1])
+    for _ in range(rounds):
+        p = _sigmoid(margin)
+        splits, values, leaves = _grow_tree(X, w * (p - y), w * p * (1 - p), depth, l2, gains)
+        margin += rate * values[leaves]
+        trees.append((splits, values))
+    return {'base': base, 'rate': rate, 'trees': trees}, _sigmoid(margin), gains
+
+def _weighted_auc(score, y, w):
+    """ROC AUC of weighted cells (ties count half), or None without both classes"""
+    values, inverse = np.unique(score, return_inverse=True)
+    positive = np.bincount(inverse, weights=w * y, minlength=len(values))
+    negative = np.bincount(inverse, weights=w * (1 - y), minlength=len(values))
+    if positive.sum() == 0 or negative.sum() == 0:
+        return None
+    below = np.cumsum(negative) - negative
+    return float((positive * (below + 0.5 * negative)).sum() / (positive.sum() * negative.sum()))
+
+def _fold_counts(w, folds, seed=0):
+    """Randomly split every cell's patients over the folds (a multinomial draw per cell)"""
+    rng = np.random.default_rng(seed)
+    remaining = w.astype(np.int64)
+    counts = np.zeros((folds, len(w)))
+    for fold in range(folds - 1):
+        counts[fold] = rng.binomial(remaining, 1 / (folds - fold))
+        remaining = remaining - counts[fold].astype(np.int64)
+    counts[-1] = remaining
+    return counts
+
+def _grouped_importance(values, columns):
+    """Sum column-level importances per feature, normalised to sum to 1"""
+    totals = dict.fromkeys(MODEL_FEATURES, 0.0)
+    for value, (feature, _) in zip(values, columns):
+        totals[feature] += float(value)
+    grand_total = sum(totals.values())
+    return {feature: round(total / grand_total, 3) if grand_total else 0.0 for feature, total in totals.items()}
+
+def fit_tb_models(X, y, w, columns):
+    """Fit the logistic and boosted-tree TB models, with cross-validated AUC per model
+
+    Patients are split into CV_FOLDS folds within each cube cell; the folds are
+    evaluated in parallel threads (numpy releases the GIL in the heavy lifting).
+    """
+    X32 = X.astype(np.float32)
+
+    def fit(name, weights):
+        if name == 'Logistic Regression':
+            beta = _fit_logistic(X, y, weights)
+            return beta, _predict_logistic(beta, X), None
+        return _fit_boosting(X32, y, weights, **BOOSTING_PARAMS)
+
+    fold_weights = _fold_counts(w, CV_FOLDS)
+    names = ['Logistic Regression', 'Gradient Boosting']
+
+    def evaluate(task):
+        name, fold = task
+        _, predicted, _ = fit(name, w - fold_weights[fold])
+        return _weighted_auc(predicted, y, fold_weights[fold])
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    tasks = [(name, fold) for name in names for fold in range(CV_FOLDS)]
+    with ThreadPoolExecutor(max_workers=min(len(tasks), os.cpu_count() or 1)) as pool:
+        fold_aucs = list(pool.map(evaluate, tasks))
+
+    models = {}
+    for name in names:
+        model, _, gains = fit(name, w)
+        aucs = [auc for (task_name, _), auc in zip(tasks, fold_aucs) if task_name == name and auc is not None]
+        if name == 'Logistic Regression':
+            # Coefficient size times the spread of its indicator, so rare levels do not dominate
+            mean = (w[:, None] * X).sum(axis=0) / w.sum()
+            spread = np.sqrt((w[:, None] * (X - mean) ** 2).sum(axis=0) / w.sum())
+            importance = _grouped_importance(np.abs(model[1:]) * spread, columns)
         else:
-            # Numeric feature
-            corr = abs(df[feature].corr(df_numeric['TB_Diagnosis_Binary']))
+            importance = _grouped_importance(gains, columns)
+        models[name] = {
+            'model': model,
+            'cv_auc': round(float(np.mean(aucs)), 3) if aucs else None,
+            'cv_auc_folds': [round(auc, 3) for auc in aucs],
+            'importance': importance
+        }
+    return models
+
+def load_or_fit_tb_models(cube, use_cache=True):
+    """Fitted TB models for a cube, reused from MODEL_CACHE_DIR when data and code are unchanged
+
+    With use_cache=False the models are always fitted and nothing is stored. The cache is
+    trimmed to --cache-size-mb once per run, by write_results.
+    """
+    X, y, w, columns = model_design_matrix(cube)
+    if not use_cache:
+        return fit_tb_models(X, y, w, columns)
+
+    digest = hashlib.sha256()
+    for array in (X, y, w):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    digest.update(repr(columns).encode())
+    digest.update(_code_fingerprint(fit_tb_models).encode())
+    fingerprint = digest.hexdigest()
+
+    path = MODEL_CACHE_DIR / f"{fingerprint[:32]}.pkl"
+    if path.exists():
+        cached = pd.read_pickle(path)
+        if cached.get('fingerprint') == fingerprint:
+            os.utime(path)  # Mark as recently used
+            return cached['models']
+
+    models = fit_tb_models(X, y, w, columns)
+    MODEL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    artifact = {'fingerprint': fingerprint, 'columns': columns, 'models': models}
+    _write_atomic(path, lambda tmp: pd.to_pickle(artifact, tmp))
+    return models
+
+# Binary features of the association matrix: name -> (columns, values that count as present in any of them)
+ASSOCIATION_FEATURES = {
+    **{symptom: ([symptom], ['Yes']) for symptom in SYMPTOM_COLS},
+    'DM': (['DM'], ['Yes']),
+    'HIV': (['HIV'], ['Yes']),
+    'TB_Contact_History': (['TB_Contact_History'], ['Yes']),
+    'TB_History': (['TB_History'], ['Yes']),
+    'CXR_Abnormal': (['CXR_results'], ABNORMAL_CXR),
+    'Sputum_Positive': (['Sputum_R1', 'Sputum_R2'], ['Positive']),
+    'GeneXpert_Positive': (['GeneXpertMTB'], ['MTB_Detected']),
+    'TB_Diagnosis': (['Diagnosis'], [TB_POSITIVE])
+}
+
+# Test results the dashboard's symptom-test matrix correlates every symptom with
+ASSOCIATION_TESTS = ['CXR_Abnormal', 'Sputum_Positive', 'GeneXpert_Positive']
+
+# Predictive features whose TB correlation is read from the association matrix, with their indicator
+CORRELATION_INDICATORS = {
+    'CXR_results': 'CXR_Abnormal', 'Cough': 'Cough', 'TB_Contact_History': 'TB_Contact_History',
+    'HIV': 'HIV', 'DM': 'DM', 'GeneXpertMTB': 'GeneXpert_Positive'
+}
+
+def association_design_matrix(cube, features=ASSOCIATION_FEATURES):
+    """0/1 matrix with one row per cube cell and one column per feature, plus the cell weights
+
+    Each cell stands for its 'n' patients, so the matrix is as small as the cube however
+    many patients it covers, and the source rows are never copied.
+    """
+    design = np.zeros((len(cube), len(features)))
+    for j, (columns, values) in enumerate(features.values()):
+        present = np.zeros(len(cube), dtype=bool)
+        for col in columns:
+            present |= cube[col].isin(values).to_numpy(dtype=bool)
+        design[:, j] = present
+    return design, cube['n'].to_numpy(dtype=float)
+
+def _chi_square_p(chi_square):
+    """Upper-tail p-value of chi-square statistics with 1 degree of freedom"""
+    return np.frompyfunc(math.erfc, 1, 1)(np.sqrt(chi_square / 2)).astype(float)
+
+def association_matrix(cube, features=ASSOCIATION_FEATURES):
+    """Pairwise phi, odds ratios and chi-square of binary features, from one weighted matrix product
+
+    both = Xᵀ·diag(n)·X counts the patients with each pair of features (the diagonal holds
+    the feature counts), which fills in every 2x2 table at once. Phi is the Pearson
+    correlation of the 0/1 indicators and chi-square (1 df, no continuity correction) is
+    N·phi². Tables with an empty cell get 0.5 added to each cell for the odds ratio and its
+    95% CI. Features that are never or always present, and the diagonal odds ratios, are NaN.
+    Returns a dict of (features, features) arrays plus the feature counts and N.
+    """
+    design, weights = association_design_matrix(cube, features)
+    n = weights.sum()
+    both = design.T @ (design * weights[:, None])
+    count = np.diag(both).copy()
+
+    a = both
+    b = count[:, None] - both
+    c = count[None, :] - both
+    d = n - count[:, None] - count[None, :] + both
+    constant = (count == 0) | (count == n)
+    undefined = constant[:, None] | constant[None, :]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        spread = count * (n - count)
+        phi = np.clip((n * a - np.outer(count, count)) / np.sqrt(np.outer(spread, spread)), -1.0, 1.0)
+        chi_square = n * phi ** 2
+
+        correction = np.where((a == 0) | (b == 0) | (c == 0) | (d == 0), 0.5, 0.0)
+        a, b, c, d = a + correction, b + correction, c + correction, d + correction
+        log_odds = np.log(a * d / (b * c))
+        log_se = np.sqrt(1 / a + 1 / b + 1 / c + 1 / d)
+    log_odds[undefined] = np.nan
+    np.fill_diagonal(log_odds, np.nan)
+
+    return {
+        'features': list(features),
+        'count': count,
+        'n': n,
+        'phi': phi,
+        'chi_square': chi_square,
+        'p_value': _chi_square_p(chi_square),
+        'odds_ratio': np.exp(log_odds),
+        'ci_low': np.exp(log_odds - 1.96 * log_se),
+        'ci_high': np.exp(log_odds + 1.96 * log_se)
+    }
 
+def analyze_associations(cube):
+    """12. Association Matrix - symptoms, comorbidities, history, test results and diagnosis"""
+    stats = association_matrix(cube)
+    names = stats['features']
+    tb = names.index('TB_Diagnosis')
+    digits = {'phi': 3, 'odds_ratio': 3, 'ci_low': 3, 'ci_high': 3, 'chi_square': 2, 'p_value': 4}
+    # Nested lists of Python floats, so undefined (NaN) entries are written as null
+    rounded = {key: np.round(stats[key], places).tolist() for key, places in digits.items()}
+
+    return {
+        'features': names,
+        'feature_counts': dict(zip(names, stats['count'].astype(int).tolist())),
+        **{key: rounded[key] for key in ('phi', 'odds_ratio', 'chi_square', 'p_value')},
+        'symptom_test_phi': {
+            symptom: {test: rounded['phi'][names.index(symptom)][names.index(test)] for test in ASSOCIATION_TESTS}
+            for symptom in SYMPTOM_COLS
+        },
+        'tb_associations': {
+            feature: {key: rounded[key][i][tb] for key in digits}
+            for i, feature in enumerate(names) if i != tb
+        }
+    }
+
+def calculate_predictive_metrics(cube, use_cache=True):
+    """8. Predictive Modeling Metrics (use_cache=False refits the models instead of reusing cached ones)"""
+    # Single-feature correlation with TB diagnosis, from cube sums
+    is_tb = cube['Diagnosis'] == TB_POSITIVE
+
+    # Numeric feature (rows with missing Age are left out, as Series.corr does)
+    age_tb = cube[is_tb]
+    correlations = {'Age': abs(_pearson(
+        cube['age_n'].sum(), cube['age_sum'].sum(), age_tb['age_n'].sum(),
+        cube['age_sq_sum'].sum(), age_tb['age_n'].sum(), age_tb['age_sum'].sum()
+    ))}
+
+    # Binary indicators (CXR uses abnormal, GeneXpert a detected result): the TB row of the association matrix
+    stats = association_matrix(cube)
+    tb_phi = stats['phi'][stats['features'].index('TB_Diagnosis')]
+    for feature, indicator in CORRELATION_INDICATORS.items():
+        correlations[feature] = abs(tb_phi[stats['features'].index(indicator)])
+
+    feature_correlation = {}
+    for feature, corr in correlations.items():
         if pd.isna(corr):
             corr = 0.01
-        feature_importance[feature] = round(corr, 3)
-
-    # Model performance comparison (simulated realistic values)
-    model_performance = {
-        'Logistic Regression': 0.88,
-        'Decision Tree': 0.85,
-        'Random Forest': 0.92,
-        'XGBoost': 0.94
+        feature_correlation[feature] = round(float(corr), 3)
+
+    # Fitted models: cross-validated AUC and model-based importances
+    models = load_or_fit_tb_models(cube, use_cache)
+    model_performance = {name: fitted['cv_auc'] for name, fitted in models.items()}
+    model_details = {
+        name: {key: fitted[key] for key in ('cv_auc', 'cv_auc_folds', 'importance')}
+        for name, fitted in models.items()
     }
 
     return {
-        'feature_importance': feature_importance,
-        'model_performance': model_performance
+        'feature_importance': models['Gradient Boosting']['importance'],
+        'feature_correlation': feature_correlation,
+        'model_performance': model_performance,
+        'model_details': model_details
     }
 
-def generate_risk_stratification(df):
+# Mutually exclusive triage tiers, assigned by the first rule that matches (highest first):
+# Very High = HIV+ or previous TB, High = 3+ symptoms or TB contact, Medium = 1-2 symptoms or DM
+RISK_TIERS = ['Low', 'Medium', 'High', 'Very High']
+
+# Points of the numeric risk score (each symptom counts once)
+RISK_WEIGHTS = {
+    'symptom': 1,
+    'TB_Contact_History': 2,
+    'DM': 2,
+    'HIV': 4,
+    'TB_History': 3,
+    'Age_over_54': 1
+}
+
+def _yes(frame, col):
+    """Boolean array of a Yes/No column, encoded (bool) or raw ('Yes'); all False when absent"""
+    if col not in frame:
+        return np.zeros(len(frame), dtype=bool)
+    values = frame[col]
+    if values.dtype == bool:
+        return values.to_numpy()
+    return (values == 'Yes').to_numpy(dtype=bool, na_value=False)
+
+def score_patients(patients):
+    """Risk score and mutually exclusive risk tier of every patient, in one vectorized pass
+
+    Takes a DataFrame (raw or encoded columns, or count cube rows), a list of patient
+    dicts or a single dict. Symptom_Cumulative is used when present, otherwise the
+    symptom columns are counted; other missing columns count as 'No'. Returns a
+    DataFrame with risk_score and an ordered categorical risk_tier, aligned with the input.
+    """
+    if isinstance(patients, dict):
+        patients = pd.DataFrame([patients])
+    elif not isinstance(patients, pd.DataFrame):
+        patients = pd.DataFrame(list(patients))
+
+    has_symptom_cols = any(col in patients for col in SYMPTOM_COLS)
+    if 'Symptom_Cumulative' not in patients and not has_symptom_cols:
+        raise ValueError("Scoring needs Symptom_Cumulative or the individual symptom columns")
+
+    flagged = sum(_yes(patients, col) for col in SYMPTOM_COLS).astype(np.int16)
+    if 'Symptom_Cumulative' in patients:
+        counts = pd.to_numeric(patients['Symptom_Cumulative'], errors='coerce').astype('float64').to_numpy()
+        missing = np.isnan(counts)
+        symptoms = np.where(missing, flagged, np.nan_to_num(counts)).astype(np.int16)
+    else:
+        symptoms = flagged
+
+    contact = _yes(patients, 'TB_Contact_History')
+    history = _yes(patients, 'TB_History')
+    hiv = _yes(patients, 'HIV')
+    dm = _yes(patients, 'DM')
+    if 'Age' in patients:
+        older = (pd.to_numeric(patients['Age'], errors='coerce') > 54).to_numpy(dtype=bool, na_value=False)
+    else:
+        older = (patients['Age_Group'] == '>54').to_numpy(dtype=bool, na_value=False) if 'Age_Group' in patients \
+            else np.zeros(len(patients), dtype=bool)
+
+    score = (RISK_WEIGHTS['symptom'] * symptoms
+             + RISK_WEIGHTS['TB_Contact_History'] * contact
+             + RISK_WEIGHTS['DM'] * dm
+             + RISK_WEIGHTS['HIV'] * hiv
+             + RISK_WEIGHTS['TB_History'] * history
+             + RISK_WEIGHTS['Age_over_54'] * older).astype(np.int16)
+    tier = np.select(
+        [hiv | history, (symptoms >= 3) | contact, (symptoms >= 1) | dm],
+        [3, 2, 1], default=0
+    ).astype(np.int8)
+
+    return pd.DataFrame({
+        'risk_score': score,
+        'risk_tier': pd.Categorical.from_codes(tier, categories=RISK_TIERS, ordered=True)
+    }, index=patients.index)
+
+def score_file(filename, output, chunk_size=None):
+    """Score every record of a data file and write ID, risk_score and risk_tier to output
+
+    Output is CSV or Parquet by suffix. CSV and Parquet inputs are streamed in batches of
+    chunk_size rows when given, so files of millions of records never sit in memory whole.
+    """
+    output = Path(output)
+    if output.suffix.lower() not in CHUNKED_SUFFIXES:
+        raise ValueError(f"Scores are written as .csv or .parquet, got '{output}'")
+
+    if chunk_size and Path(filename).suffix.lower() in CHUNKED_SUFFIXES:
+        chunks = iter_data_chunks(filename, chunk_size)
+    else:
+        chunks = [load_data(filename)[0]]
+
+    writer = None
+    rows = 0
+    try:
+        for chunk in chunks:
+            scores = score_patients(chunk)
+            scores.insert(0, 'ID', chunk['ID'].to_numpy() if 'ID' in chunk else np.arange(rows, rows + len(chunk)))
+            if output.suffix.lower() == '.csv':
+                scores.to_csv(output, mode='w' if rows == 0 else 'a', header=rows == 0, index=False)
+            else:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                table = pa.Table.from_pandas(scores, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output, table.schema)
+                writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+def generate_risk_stratification(cube):
     """Generate risk stratification matrix"""
-    total_patients = len(df)
+    total_patients = int(cube['n'].sum())
+    symptoms = cube['Symptom_Cumulative']
 
     # Risk categories based on symptoms and risk factors
-    low_risk = df[(df['Symptom_Cumulative'] == 0) & (df['TB_Contact_History'] == 'No')]
-    medium_risk = df[(df['Symptom_Cumulative'].between(1, 2)) &
-                     (df['HIV'] == 'No') & (df['DM'] == 'No')]
-    high_risk = df[(df['Symptom_Cumulative'] >= 3) | (df['TB_Contact_History'] == 'Yes')]
-    very_high_risk = df[(df['HIV'] == 'Yes') | (df['TB_History'] == 'Yes')]
+    low_risk = (symptoms == 0) & (cube['TB_Contact_History'] == 'No')
+    medium_risk = symptoms.between(1, 2) & (cube['HIV'] == 'No') & (cube['DM'] == 'No')
+    high_risk = (symptoms >= 3) | (cube['TB_Contact_History'] == 'Yes')
+    very_high_risk = (cube['HIV'] == 'Yes') | (cube['TB_History'] == 'Yes')
+
+    def percentage(in_category):
+        return round(int(cube.loc[in_category, 'n'].sum()) / total_patients * 100, 1)
 
     risk_matrix = {
         'Low Risk': {
-            'percentage': round(len(low_risk) / total_patients * 100, 1),
+            'percentage': percentage(low_risk),
             'description': 'No symptoms, No contact'
         },
         'Medium Risk': {
-            'percentage': round(len(medium_risk) / total_patients * 100, 1),
+            'percentage': percentage(medium_risk),
             'description': '1-2 symptoms, No HIV/DM'
         },
         'High Risk': {
-            'percentage': round(len(high_risk) / total_patients * 100, 1),
+            'percentage': percentage(high_risk),
             'description': '3+ symptoms, TB contact'
         },
         'Very High Risk': {
-            'percentage': round(len(very_high_risk) / total_patients * 100, 1),
+            'percentage': percentage(very_high_risk),
             'description': 'HIV+, Previous TB'
         }
     }
 
-    return risk_matrix
-
-def main():
-    """Main analysis function"""
-    print("Starting TB Clinical Data Analysis...")
-    print("=" * 50)
-
-    # Get filename from user input
-    filename = get_data_filename()
-
-    # Load data
-    df, data_filename = load_data(filename)
-
-    # Perform all analyses
-    print("Performing demographic analysis...")
-    demographics = analyze_demographics(df)
+    # The buckets above overlap; the scored tiers put every patient in exactly one
+    scored = score_patients(cube)
+    codes = scored['risk_tier'].cat.codes.to_numpy()
+    counts = np.bincount(codes, weights=cube['n'], minlength=len(RISK_TIERS))
+    tb_counts = np.bincount(codes, weights=cube['n'] * (cube['Diagnosis'] == TB_POSITIVE),
+                            minlength=len(RISK_TIERS))
+    score_sums = np.bincount(codes, weights=cube['n'] * scored['risk_score'], minlength=len(RISK_TIERS))
+    tier_descriptions = ['None of the below', '1-2 symptoms or DM', '3+ symptoms or TB contact',
+                         'HIV+ or Previous TB']
+    risk_matrix['exclusive_tiers'] = {
+        tier: {
+            'count': int(count),
+            'percentage': round(count / total_patients * 100, 1),
+            'tb_rate': round(tb_count / count * 100, 1) if count else 0,
+            'mean_score': round(score_sum / count, 2) if count else 0,
+            'description': description
+        }
+        for tier, count, tb_count, score_sum, description
+        in zip(RISK_TIERS, counts, tb_counts, score_sums, tier_descriptions)
+    }
+    risk_matrix['score_weights'] = RISK_WEIGHTS
 
-    print("Analyzing symptoms...")
-    symptoms = analyze_symptoms(df)
+    return risk_matrix
 
-    print("Analyzing comorbidities...")
-    comorbidities = analyze_comorbidities(df)
+def _windowed_rates(numerator, denominator, window):
+    """Per-period, rolling and exponentially weighted rates (%) of two count series
 
-    print("Analyzing diagnostic tests...")
-    diagnostic_tests = analyze_diagnostic_tests(df)
+    The windows pool the counts (rolling sums, EWMA of numerator over EWMA of
+    denominator), so busy periods weigh more than quiet ones. Periods with nothing
+    to count get None.
+    """
+    def rate(num, den):
+        values = np.divide(num * 100.0, den, out=np.zeros(len(den)), where=den > 0).round(2)
+        return [float(value) if total > 0 else None for value, total in zip(values, den)]
 
-    print("Analyzing risk factors...")
-    risk_factors = analyze_risk_factors(df)
+    numerator = numerator.astype(float)
+    denominator = denominator.astype(float)
+    return {
+        'rate': rate(numerator.to_numpy(), denominator.to_numpy()),
+        'rolling': rate(numerator.rolling(window, min_periods=1).sum().to_numpy(),
+                        denominator.rolling(window, min_periods=1).sum().to_numpy()),
+        'ewma': rate(numerator.ewm(span=window).mean().to_numpy(),
+                     denominator.ewm(span=window).mean().to_numpy())
+    }
 
-    print("Performing epidemiological analysis...")
-    epidemiology = analyze_epidemiology(df)
+def analyze_trends(table, period='week', window=TREND_WINDOW):
+    """10. Screening Trends - TB yield, symptom prevalence and test positivity per week or month"""
+    dated = table[table['Period'].notna()]
+    trends = {
+        'period': period,
+        'window': window,
+        'undated_patients': int(table.loc[table['Period'].isna(), 'n'].sum()),
+        'periods': []
+    }
+    if dated.empty:
+        return trends
+
+    labels = _period_range(dated['Period'], period)
+    counts = [col for col in table.columns if col not in ['Period'] + TREND_STRATA]
+    totals = dated.groupby('Period')[counts].sum().reindex(labels, fill_value=0)
+    patients = totals['n']
+
+    trends['periods'] = labels
+    trends['patients'] = patients.tolist()
+    trends['tb_yield'] = _windowed_rates(totals['tb'], patients, window)
+    trends['any_symptom'] = _windowed_rates(totals['any_symptom'], patients, window)
+    trends['symptom_prevalence'] = {
+        symptom: _windowed_rates(totals[symptom], patients, window)['rate'] for symptom in SYMPTOM_COLS
+    }
 
-    print("Analyzing patient journey...")
-    patient_journey = analyze_patient_journey(df)
+    # Positivity among the patients who had the test in that period
+    trends['test_positivity'] = {}
+    for test, done, positive in [('CXR', 'cxr_done', 'cxr_abnormal'),
+                                 ('Sputum', 'sputum_done', 'sputum_positive'),
+                                 ('GeneXpert', 'xpert_done', 'xpert_detected')]:
+        trends['test_positivity'][test] = {
+            'tested': totals[done].tolist(),
+            **_windowed_rates(totals[positive], totals[done], window)
+        }
 
-    print("Calculating predictive metrics...")
-    predictive_metrics = calculate_predictive_metrics(df)
+    # TB yield within each stratum, in the documented order of its values
+    for col in TREND_STRATA:
+        by_value = dated.groupby(['Period', col])[['n', 'tb']].sum()
+        observed = by_value.index.get_level_values(col).unique()
+        levels = [value for value in CATEGORY_LEVELS[col] if value in observed]
+        levels += [value for value in observed if value not in levels]
+        trends[f'tb_yield_by_{col.lower()}'] = {}
+        for value in levels:
+            stratum = by_value.xs(value, level=col).reindex(labels, fill_value=0)
+            trends[f'tb_yield_by_{col.lower()}'][value] = _windowed_rates(stratum['tb'], stratum['n'], window)
+    return trends
+
+# Sections repeated for every site at each --hierarchy level
+SITE_SECTIONS = ['demographics', 'symptoms', 'comorbidities', 'risk_factors', 'epidemiology', 'risk_stratification']
+
+def _analyze_site(site_cube, labels, levels, sections):
+    """Process-pool task: labels, patient and TB counts and site sections of one site"""
+    site = {col: None if pd.isna(label) else label for col, label in zip(levels, labels)}
+    site['total_patients'] = int(site_cube['n'].sum())
+    site['tb_positive'] = int(site_cube.loc[site_cube['Diagnosis'] == TB_POSITIVE, 'n'].sum())
+    for key, _, analyze in ANALYSIS_SECTIONS:
+        if key in sections:
+            site[key] = analyze(site_cube)
+    return site
+
+def analyze_sites(cube, levels, sections=SITE_SECTIONS, workers=1):
+    """11. Site Roll-ups - the site sections for every site at each level of the hierarchy
+
+    levels lists the site columns of the leaf cube from the coarsest (e.g. Region) to the
+    finest (e.g. Facility). Each level holds one entry per site with its labels, patient
+    and TB counts and the results of every site section. The sections run directly on
+    each site cube; write_results caches the whole roll-up under one key. workers > 1
+    spreads the sites over a process pool.
+    """
+    sections = [key for key, _, _ in ANALYSIS_SECTIONS if key in sections]
+    tasks = [(levels[depth - 1], labels, site_cube)
+             for depth in range(1, len(levels) + 1)
+             for labels, site_cube in site_cubes(cube, levels[:depth])]
+
+    task_args = ([site_cube for _, _, site_cube in tasks], [labels for _, labels, _ in tasks],
+                 *([value] * len(tasks) for value in (levels, sections)))
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_analyze_site, *task_args, chunksize=max(len(tasks) // (4 * workers), 1)))
+    else:
+        results = list(map(_analyze_site, *task_args))
+
+    by_level = {level: [] for level in levels}
+    for (level, _, _), site in zip(tasks, results):
+        by_level[level].append(site)
+    return {'levels': list(levels), 'sections': sections, 'sites': by_level}
+
+# Result key, progress message and function of every analysis section, in output order
+ANALYSIS_SECTIONS = [
+    ('demographics', "Performing demographic analysis...", analyze_demographics),
+    ('symptoms', "Analyzing symptoms...", analyze_symptoms),
+    ('comorbidities', "Analyzing comorbidities...", analyze_comorbidities),
+    ('diagnostic_tests', "Analyzing diagnostic tests...", analyze_diagnostic_tests),
+    ('risk_factors', "Analyzing risk factors...", analyze_risk_factors),
+    ('epidemiology', "Performing epidemiological analysis...", analyze_epidemiology),
+    ('patient_journey', "Analyzing patient journey...", analyze_patient_journey),
+    ('predictive_metrics', "Calculating predictive metrics...", calculate_predictive_metrics),
+    ('associations', "Computing association matrix...", analyze_associations),
+    ('risk_stratification', "Generating risk stratification...", generate_risk_stratification)
+]
+
+# Stages timed in the metadata block; --profile and --trace-memory take one of these names
+PIPELINE_STAGES = ['load', 'validate', 'build_cube'] + [key for key, _, _ in ANALYSIS_SECTIONS] + [
+    'trends', 'sites', 'write_json', 'write_csv', 'render_charts', 'write_raw_csv'
+]
+
+def cube_fingerprint(cube):
+    """Content hash of a count cube, the data half of every section cache key"""
+    hashed = pd.util.hash_pandas_object(cube, index=False).to_numpy()
+    return hashlib.sha256(hashed.tobytes()).hexdigest()
+
+def _constant_text(value, module, seen):
+    """Text of a constant for the code fingerprint; functions of module stand for their own code"""
+    import inspect
+
+    if inspect.isfunction(value):
+        if value.__module__ != module:
+            return f"{value.__module__}.{value.__qualname__}"
+        return value.__name__ if value.__name__ in seen else _code_text(value, seen)
+    if isinstance(value, dict):
+        items = (f"{_constant_text(k, module, seen)}: {_constant_text(v, module, seen)}" for k, v in value.items())
+        return '{' + ', '.join(items) + '}'
+    if isinstance(value, (list, tuple)):
+        return '[' + ', '.join(_constant_text(item, module, seen) for item in value) + ']'
+    return repr(value)
+
+def _code_text(func, seen):
+    """Source of func plus the module-level helpers and constants it uses, each included once"""
+    import inspect
+
+    seen.add(func.__name__)
+    parts = [inspect.getsource(func)]
+
+    # Default arguments are bound at definition time, so their values are part of the code
+    for defaults in (func.__defaults__, func.__kwdefaults__):
+        if defaults:
+            parts.append(f"defaults = {_constant_text(defaults, func.__module__, seen)}")
+
+    names = set()
+    code_objects = [func.__code__]
+    while code_objects:
+        code = code_objects.pop()
+        names.update(code.co_names)
+        code_objects.extend(const for const in code.co_consts if inspect.iscode(const))
+
+    for name in sorted(names - seen):
+        value = func.__globals__.get(name)
+        if inspect.isfunction(value) and value.__module__ == func.__module__:
+            parts.append(_code_text(value, seen))
+        elif isinstance(value, (str, int, float, list, tuple, dict)):
+            seen.add(name)
+            parts.append(f"{name} = {_constant_text(value, func.__module__, seen)}")
+
+    return '\n'.join(parts)
+
+@lru_cache(maxsize=None)
+def _code_fingerprint(func):
+    """Hash of a function's source plus the helpers, constants and default arguments it uses
+
+    Computed once per function for the life of the process, since the code cannot change.
+    """
+    return hashlib.sha256(_code_text(func, set()).encode()).hexdigest()
+
+def _evict_lru(directory, limit_mb):
+    """Delete the least recently used files in directory until it fits in limit_mb"""
+    files = sorted(directory.glob('*.pkl'), key=lambda path: path.stat().st_mtime, reverse=True)
+    total = 0
+    for path in files:
+        total += path.stat().st_size
+        if total > limit_mb * 1e6:
+            path.unlink(missing_ok=True)
+
+def run_section(analyze, cube, fingerprint=None, **options):
+    """Run one analysis section, reusing its cached result when cube and code are unchanged
+
+    The cache key combines the cube fingerprint with a hash of the section's code (and
+    of the helpers and constants it uses). A fingerprint of None bypasses the cache.
+    options are passed on to analyze and are not part of the key, so they must not change
+    the result. The cache is trimmed to --cache-size-mb once per run, by write_results.
+    Returns (result, from_cache).
+    """
+    if fingerprint is None:
+        return analyze(cube, **options), False
+    return cached_result(analyze.__name__, f"{fingerprint}:{_code_fingerprint(analyze)}",
+                         lambda: analyze(cube, **options))
+
+def cached_result(name, key, compute):
+    """compute() through the section cache, stored as <name>-<hash of key>.pkl; returns (result, from_cache)"""
+    path = SECTION_CACHE_DIR / f"{name}-{hashlib.sha256(key.encode()).hexdigest()[:32]}.pkl"
+    if path.exists():
+        os.utime(path)  # Mark as recently used
+        return pd.read_pickle(path), True
+
+    result = compute()
+    SECTION_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    _write_atomic(path, lambda tmp: pd.to_pickle(result, tmp))
+    return result, False
+
+def clean_for_json(obj):
+    """Recursively convert numpy/pandas values to plain Python types, in a single pass"""
+    if isinstance(obj, dict):
+        return {str(k): clean_for_json(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [clean_for_json(item) for item in obj]
+    elif obj is None or isinstance(obj, (str, bool)):
+        return obj
+    elif isinstance(obj, np.ndarray):
+        return clean_for_json(obj.tolist())
+    elif isinstance(obj, np.integer):
+        return int(obj)
+    elif isinstance(obj, np.floating):
+        return float(obj)
+    elif isinstance(obj, np.bool_):
+        return bool(obj)
+    elif isinstance(obj, (datetime.datetime, datetime.date, pd.Timestamp)):
+        return obj.isoformat()
+    elif pd.isna(obj):
+        return None
+    else:
+        return obj
+
+def dumps_json(obj, compact=False):
+    """Serialize cleaned results to bytes, through orjson when it is installed"""
+    try:
+        import orjson
+    except ImportError:
+        orjson = None
+
+    if orjson is not None:
+        return orjson.dumps(obj, option=0 if compact else orjson.OPT_INDENT_2)
+    if compact:
+        return json.dumps(obj, separators=(',', ':')).encode()
+    return json.dumps(obj, indent=2).encode()
+
+def write_json(obj, path, compact=False, precompress=()):
+    """Write cleaned results to path plus precompressed .gz/.br siblings; returns the files written"""
+    return _write_json_bytes(dumps_json(obj, compact), path, precompress)
+
+def _write_json_bytes(data, path, precompress=()):
+    """Write serialized JSON and its requested precompressed siblings
+
+    Files are replaced atomically, so a server watching them never reads half a file.
+    """
+    path = Path(path)
+    _write_atomic(path, lambda tmp: tmp.write_bytes(data))
+    written = [str(path)]
+
+    if 'gzip' in precompress:
+        import gzip
+        _write_atomic(Path(f"{path}.gz"), lambda tmp: tmp.write_bytes(gzip.compress(data, compresslevel=9, mtime=0)))
+        written.append(f"{path}.gz")
+    if 'brotli' in precompress:
+        try:
+            import brotli
+        except ImportError:
+            print(f"⚠️  brotli is not installed; skipping {path}.br")
+        else:
+            _write_atomic(Path(f"{path}.br"), lambda tmp: tmp.write_bytes(brotli.compress(data)))
+            written.append(f"{path}.br")
+
+    return written
+
+def write_section_files(results, output_dir, compact=False, precompress=()):
+    """One content-addressed JSON file per section plus a small manifest pointing at them
+
+    Section files are named <section>.<hash>.json, so the dashboard can fetch them on
+    demand and browsers can keep unchanged sections cached across reruns. Files of
+    earlier runs that the new manifest no longer references are removed.
+    """
+    section_dir = Path(output_dir) / SECTION_DIR
+    section_dir.mkdir(exist_ok=True)
+    manifest = {'metadata': results['metadata'], 'sections': {}}
+    for key, section in results.items():
+        if key == 'metadata':
+            continue
+        data = dumps_json(section, compact)
+        digest = hashlib.sha256(data).hexdigest()
+        name = f"{key}.{digest[:16]}.json"
+        _write_json_bytes(data, section_dir / name, precompress)
+        manifest['sections'][key] = {'file': f"{SECTION_DIR}/{name}", 'sha256': digest, 'bytes': len(data)}
+
+    current = {Path(entry['file']).name for entry in manifest['sections'].values()}
+    for path in section_dir.glob('*.json*'):
+        if path.name.removesuffix('.gz').removesuffix('.br') not in current:
+            path.unlink()
+
+    written = write_json(manifest, Path(output_dir) / MANIFEST_FILE, compact=compact)
+    written.append(f"{section_dir} ({len(current)} section files)")
+    return written
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far in MB (None where resource is unavailable)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+def _cpu_seconds():
+    """CPU time of this process and of its finished worker processes"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+@contextmanager
+def timed_stage(timings, name, args=None, output_dir=Path('.')):
+    """Record wall time, CPU time and peak memory of one pipeline stage in timings[name]
+
+    When --profile or --trace-memory names this stage, a cProfile dump or tracemalloc
+    report of it is written to output_dir as well.
+    """
+    profiler = None
+    if args is not None and getattr(args, 'profile', None) == name:
+        import cProfile
+        profiler = cProfile.Profile()
+    trace = args is not None and getattr(args, 'trace_memory', None) == name
+    if trace:
+        import tracemalloc
+        tracemalloc.start()
+
+    rss_before = peak_rss_mb()
+    wall, cpu = time.perf_counter(), _cpu_seconds()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+        rss_after = peak_rss_mb()
+        timings[name] = {
+            'wall_seconds': round(time.perf_counter() - wall, 4),
+            'cpu_seconds': round(_cpu_seconds() - cpu, 4),
+            'peak_rss_mb': None if rss_after is None else round(rss_after, 1),
+            'rss_growth_mb': None if rss_after is None else round(rss_after - rss_before, 1)
+        }
 
-    print("Generating risk stratification...")
-    risk_stratification = generate_risk_stratification(df)
+        if profiler:
+            import pstats
+            path = Path(output_dir) / f"profile_{name}.prof"
+            profiler.dump_stats(path)
+            print(f"CPU profile of '{name}' saved to {path}; slowest calls:")
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+
+        if trace:
+            snapshot = tracemalloc.take_snapshot()
+            _, traced_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            timings[name]['traced_peak_mb'] = round(traced_peak / 1e6, 1)
+            path = Path(output_dir) / f"memory_{name}.txt"
+            top = snapshot.statistics('lineno')[:25]
+            path.write_text(f"Peak traced memory: {traced_peak / 1e6:.1f} MB\n"
+                            + "\n".join(str(stat) for stat in top) + "\n")
+            print(f"Memory trace of '{name}' saved to {path} (peak {traced_peak / 1e6:.1f} MB)")
+
+def print_timings(timings):
+    """Per-stage table of wall time, CPU time and peak memory"""
+    print(f"{'Stage':<28}{'Wall s':>10}{'CPU s':>10}{'Peak MB':>10}")
+    for name, stage in timings.items():
+        peak = '' if stage['peak_rss_mb'] is None else f"{stage['peak_rss_mb']:.1f}"
+        print(f"{name:<28}{stage['wall_seconds']:>10.3f}{stage['cpu_seconds']:>10.3f}{peak:>10}")
+
+def log_timings(timings, data_source, total_patients, destination):
+    """Append one structured JSON log line with the stage timings ('-' writes to stderr)"""
+    line = json.dumps({
+        'event': 'tb_analysis_timings',
+        'timestamp': pd.Timestamp.now().isoformat(),
+        'data_source': data_source,
+        'total_patients': total_patients,
+        'total_wall_seconds': round(sum(stage['wall_seconds'] for stage in timings.values()), 4),
+        'stages': timings
+    })
+    if destination == '-':
+        print(line, file=sys.stderr)
+    else:
+        with open(destination, 'a') as log:
+            log.write(line + "\n")
+
+def parse_args(argv=None):
+    """Command-line options; without data files the script asks for one interactively"""
+    parser = argparse.ArgumentParser(
+        description="TB clinical data analysis",
+        epilog="With several data files each one gets its own output folder under --output-dir, "
+               "and a combined roll-up of all of them is written to --output-dir itself."
+    )
+    parser.add_argument('data_files', nargs='*', metavar='data_file',
+                        help="Data files or glob patterns (.xlsx, .csv or .parquet); prompted for when omitted")
+    parser.add_argument('--output-dir', default='.',
+                        help="Folder for analysis_results.json and the CSV exports (default: current folder)")
+    parser.add_argument('--sections', type=lambda value: value.split(','), default=None,
+                        help="Comma-separated analysis sections to run (default: all of "
+                             + ', '.join(key for key, _, _ in ANALYSIS_SECTIONS) + ")")
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help="Stream CSV/Parquet files in batches of this many rows instead of loading them whole")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of processes building the count cube (default: 1)")
+    parser.add_argument('--incremental', action='store_true',
+                        help=f"Only aggregate records whose ID is new since the last run "
+                             f"(state in {STATE_FILE} next to the results)")
+    parser.add_argument('--verify-incremental', action='store_true',
+                        help="Like --incremental, then check the result against a full recompute")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Recompute every analysis section and refit the models instead of reusing cached results")
+    parser.add_argument('--cache-size-mb', type=float, default=SECTION_CACHE_MB,
+                        help=f"Size limit of the section and model caches, each (default: {SECTION_CACHE_MB} MB)")
+    parser.add_argument('--compact', action='store_true',
+                        help="Write analysis_results.json without indentation")
+    parser.add_argument('--precompress', action='append', choices=['gzip', 'brotli'], default=[],
+                        help="Also write a precompressed .gz/.br copy of the JSON (repeatable)")
+    parser.add_argument('--render-charts', action='store_true',
+                        help="Render the dashboard charts to charts/*.svg and write an offline report.html")
+    parser.add_argument('--png', action='store_true',
+                        help="With --render-charts, also write PNG files (needs cairosvg)")
+    parser.add_argument('--hierarchy', type=lambda value: value.split(','), default=[],
+                        help=f"Site columns from coarsest to finest, e.g. Region,Facility; repeats the "
+                             f"{', '.join(SITE_SECTIONS)} sections for every site at each level")
+    parser.add_argument('--keep-invalid', action='store_true',
+                        help=f"Report records that fail validation but keep them in the analysis "
+                             f"instead of moving them to {QUARANTINE_FILE}")
+    parser.add_argument('--trend-period', choices=list(TREND_PERIODS), default='week',
+                        help=f"Period of the screening trends when the data has a {DATE_COLUMN} column (default: week)")
+    parser.add_argument('--trend-window', type=int, default=TREND_WINDOW,
+                        help=f"Number of periods in the rolling and EWMA trend windows (default: {TREND_WINDOW})")
+    parser.add_argument('--score-output', metavar='FILE',
+                        help="Instead of analyzing, write every patient's risk score and tier to FILE (.csv or .parquet)")
+    parser.add_argument('--check-inputs', action='store_true',
+                        help="Only check that the data files can be read (building their patient stores "
+                             "when missing) and report their record counts")
+    stages = ', '.join(PIPELINE_STAGES)
+    parser.add_argument('--show-timings', action='store_true',
+                        help="Print wall time, CPU time and peak memory of every stage")
+    parser.add_argument('--log-timings', metavar='FILE',
+                        help="Append the stage timings as one JSON line to FILE ('-' for stderr)")
+    parser.add_argument('--profile', metavar='STAGE', choices=PIPELINE_STAGES,
+                        help=f"Save a cProfile dump of one stage as profile_STAGE.prof ({stages})")
+    parser.add_argument('--trace-memory', metavar='STAGE', choices=PIPELINE_STAGES,
+                        help="Trace the allocations of one stage with tracemalloc into memory_STAGE.txt")
+    args = parser.parse_args(argv)
+
+    args.incremental = args.incremental or args.verify_incremental
+    if args.incremental and args.chunk_size is not None:
+        parser.error("--incremental cannot be combined with --chunk-size")
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    if args.chunk_size is not None and args.chunk_size <= 0:
+        parser.error("--chunk-size must be positive")
+
+    if args.trend_window < 1:
+        parser.error("--trend-window must be at least 1")
+
+    unknown = [col for col in args.hierarchy if col not in OPTIONAL_COLUMNS]
+    if unknown or len(set(args.hierarchy)) != len(args.hierarchy):
+        parser.error(f"--hierarchy takes distinct site columns out of {', '.join(OPTIONAL_COLUMNS)}")
+
+    section_keys = [key for key, _, _ in ANALYSIS_SECTIONS]
+    if args.sections is None:
+        args.sections = section_keys
+    unknown = [key for key in args.sections if key not in section_keys]
+    if unknown:
+        parser.error(f"unknown sections: {', '.join(unknown)} (choose from {', '.join(section_keys)})")
+    return args
+
+def expand_data_files(patterns):
+    """Expand glob patterns into a sorted, de-duplicated list of data files"""
+    import glob
+
+    filenames = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                print(f"⚠️  No files match '{pattern}'")
+            filenames.extend(matches)
+        else:
+            filenames.append(pattern)
+    return list(dict.fromkeys(filenames))
+
+def build_file_cube(filename, output_dir, args, timings=None):
+    """Count cube of one data file, honouring --chunk-size, --workers and --incremental
+
+    Records failing validation are written to quarantine.csv and left out of the cube
+    (unless --keep-invalid). Returns (cube, trends, quality, df): trends is the per-period
+    trend table (None without screening dates), quality the validation summary and df
+    the loaded rows, or None when the file was streamed in chunks. Stage timings are
+    recorded in timings when given.
+    """
+    timings = {} if timings is None else timings
+    dimensions = CUBE_DIMENSIONS + args.hierarchy
+    chunked = args.chunk_size and Path(filename).suffix.lower() in CHUNKED_SUFFIXES
+    if args.chunk_size and not chunked:
+        print(f"⚠️  {filename} is not a CSV/Parquet file; loading it whole")
+
+    if chunked:
+        # Reading and aggregating are interleaved, so the load is part of build_cube here
+        print(f"Building count cube from {filename} in chunks of {args.chunk_size} rows...")
+        with timed_stage(timings, 'build_cube', args, output_dir):
+            cube, trends, quality = build_count_cube_chunked(
+                filename, args.chunk_size, raw_csv=output_dir / 'mockup_data.csv', workers=args.workers,
+                trend_period=args.trend_period, quarantine_file=output_dir / QUARANTINE_FILE,
+                keep_invalid=args.keep_invalid, dimensions=dimensions
+            )
+        print_quality(quality, output_dir / QUARANTINE_FILE, args.keep_invalid)
+        return cube, trends, quality, None
+
+    with timed_stage(timings, 'load', args, output_dir):
+        raw_df, _ = load_data(filename)
+    with timed_stage(timings, 'validate', args, output_dir):
+        valid, quarantine, quality = validate_data(raw_df)
+        write_quarantine(quarantine, output_dir / QUARANTINE_FILE)
+        df = raw_df if args.keep_invalid or valid.all() else raw_df[valid]
+    print_quality(quality, output_dir / QUARANTINE_FILE, args.keep_invalid)
+
+    with timed_stage(timings, 'build_cube', args, output_dir):
+        if args.incremental:
+            cube = build_count_cube_incremental(df, filename, args.workers,
+                                                state_file=output_dir / STATE_FILE.name, dimensions=dimensions)
+            if args.verify_incremental:
+                full_cube = build_count_cube(df, dimensions=dimensions)
+                if cube.equals(full_cube):
+                    print("✅ Incremental count cube matches a full recompute")
+                else:
+                    print("❌ Incremental count cube differs from a full recompute; using the full one")
+                    cube = full_cube
+        elif args.workers > 1:
+            print(f"Building count cube with {args.workers} worker processes...")
+            cube = build_count_cube_parallel(df, args.workers, dimensions)
+        else:
+            print("Building count cube...")
+            cube = build_count_cube(df, dimensions=dimensions)
 
-    def clean_for_json(obj):
-        """Recursively clean data structure for JSON serialization"""
-        if isinstance(obj, dict):
-            return {str(k): clean_for_json(v) for k, v in obj.items()}
-        elif isinstance(obj, list):
-            return [clean_for_json(item) for item in obj]
-        elif isinstance(obj, (np.integer, np.int64)):
-            return int(obj)
-        elif isinstance(obj, (np.floating, np.float64)):
-            return float(obj)
-        elif pd.isna(obj):
-            return None
-        elif isinstance(obj, (datetime.datetime, datetime.date, pd.Timestamp)):
-            return obj.isoformat()
+        # Per-period counts for the trend section, when the data has screening dates
+        if args.incremental:
+            trends = build_trend_table_incremental(df, filename, args.trend_period,
+                                                   state_file=output_dir / TREND_STATE_FILE.name)
         else:
-            return obj
+            trends = build_trend_table(df, args.trend_period)
+    return cube, trends, quality, raw_df
+
+def write_results(cube, data_source, output_dir, args, timings=None, trends=None, quality=None):
+    """Run the selected analysis sections on a cube and write the JSON and CSV outputs
+
+    A trend table adds the 'trends' section and a validation summary the 'data_quality'
+    section; a leaf cube with site levels (--hierarchy) adds the 'sites' section. The
+    metadata block carries the timings of every stage finished before the JSON is written.
+    """
+    timings = {} if timings is None else timings
+    leaf_cube = cube
+    cube = national_cube(leaf_cube)
+
+    # Perform all analyses, reusing cached sections whose data and code are unchanged
+    fingerprint = None if args.no_cache else cube_fingerprint(cube)
+    sections = {}
+    for key, message, analyze in ANALYSIS_SECTIONS:
+        if key not in args.sections:
+            continue
+        # --no-cache also refits the models instead of loading them from MODEL_CACHE_DIR
+        options = {'use_cache': False} if args.no_cache and key == 'predictive_metrics' else {}
+        with timed_stage(timings, key, args, output_dir):
+            sections[key], cached = run_section(analyze, cube, fingerprint, **options)
+        print(f"{message} (cached)" if cached else message)
+
+    if trends is not None:
+        print("Analyzing screening trends...")
+        with timed_stage(timings, 'trends', args, output_dir):
+            sections['trends'] = analyze_trends(trends, args.trend_period, args.trend_window)
+
+    if args.hierarchy:
+        site_sections = [key for key in SITE_SECTIONS if key in args.sections]
+        roll_up = lambda: analyze_sites(leaf_cube, args.hierarchy, site_sections, args.workers)
+        with timed_stage(timings, 'sites', args, output_dir):
+            if args.no_cache:
+                sections['sites'], cached = roll_up(), False
+            else:
+                # The whole roll-up is one cache entry: leaf cube, levels, sections and code
+                key = (f"{cube_fingerprint(leaf_cube)}:{args.hierarchy}:{site_sections}:"
+                       f"{_code_fingerprint(analyze_sites)}")
+                sections['sites'], cached = cached_result('analyze_sites', key, roll_up)
+        message = f"Rolling up sites by {' > '.join(args.hierarchy)}..."
+        print(f"{message} (cached)" if cached else message)
+
+    if quality is not None:
+        # The roll-up has no quarantine file of its own; the rejected rows are in each file's folder
+        quarantine_file = QUARANTINE_FILE if quality['quarantined'] and isinstance(data_source, str) else None
+        sections['data_quality'] = data_quality_section(quality, quarantine_file, args.keep_invalid)
 
     # Compile all results
     analysis_results = {
         'metadata': {
-            'total_patients': len(df),
+            'total_patients': int(cube['n'].sum()),
             'analysis_date': pd.Timestamp.now().isoformat(),
-            'data_source': data_filename
+            'data_source': data_source,
+            'timings': dict(timings)
         },
-        'demographics': demographics,
-        'symptoms': symptoms,
-        'comorbidities': comorbidities,
-        'diagnostic_tests': diagnostic_tests,
-        'risk_factors': risk_factors,
-        'epidemiology': epidemiology,
-        'patient_journey': patient_journey,
-        'predictive_metrics': predictive_metrics,
-        'risk_stratification': risk_stratification
+        **sections
     }
 
-    # Clean the results for JSON serialization
-    analysis_results = clean_for_json(analysis_results)
-
-    # Save to JSON with custom serializer
+    # Clean the results for JSON serialization and save them
     print("Saving analysis results to JSON...")
-
-    def json_serializer(obj):
-        """Custom JSON serializer for datetime and numpy objects"""
-        if isinstance(obj, (datetime.datetime, datetime.date)):
-            return obj.isoformat()
-        elif isinstance(obj, np.integer):
-            return int(obj)
-        elif isinstance(obj, np.floating):
-            return float(obj)
-        elif isinstance(obj, np.ndarray):
-            return obj.tolist()
-        elif pd.isna(obj):
-            return None
-        raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
-
-    with open('analysis_results.json', 'w') as f:
-        json.dump(analysis_results, f, indent=2, default=json_serializer)
+    with timed_stage(timings, 'write_json', args, output_dir):
+        analysis_results = clean_for_json(analysis_results)
+        generated = write_json(analysis_results, output_dir / 'analysis_results.json',
+                               compact=args.compact, precompress=args.precompress)
+        generated += write_section_files(analysis_results, output_dir,
+                                         compact=args.compact, precompress=args.precompress)
 
     # Save individual CSV files
     print("Generating CSV files...")
+    with timed_stage(timings, 'write_csv', args, output_dir):
+        generated += _write_section_csvs(sections, output_dir)
+
+    # Static chart snapshots and an offline report page
+    if args.render_charts:
+        print("Rendering charts...")
+        import render_charts
+        with timed_stage(timings, 'render_charts', args, output_dir):
+            generated += render_charts.render_all(analysis_results, output_dir, args.workers, args.png)
 
-    # Raw data CSV
-    df.to_csv('mockup_data.csv', index=False)
+    # The cube itself, for drill-down queries through cube_server.py
+    generated.append(str(save_count_cube(leaf_cube, output_dir)))
+
+    # Trim the section and model caches once per run rather than after every write
+    if not args.no_cache:
+        _evict_lru(SECTION_CACHE_DIR, args.cache_size_mb)
+        _evict_lru(MODEL_CACHE_DIR, args.cache_size_mb)
+    return generated
+
+def _write_section_csvs(sections, output_dir):
+    """Demographics, symptoms and test performance CSV exports of the sections that ran"""
+    generated = []
 
     # Demographics CSV
-    pd.DataFrame(demographics['age_sex_distribution']).to_csv('demographics.csv')
+    if 'demographics' in sections:
+        pd.DataFrame(sections['demographics']['age_sex_distribution']).to_csv(output_dir / 'demographics.csv')
+        generated.append(str(output_dir / 'demographics.csv'))
 
     # Symptoms CSV
-    symptoms_df = pd.DataFrame({
-        'Symptom': list(symptoms['symptom_prevalence'].keys()),
-        'Overall_Prevalence': list(symptoms['symptom_prevalence'].values()),
-        'TB_Positive_Prevalence': list(symptoms['symptom_tb_prevalence'].values())
-    })
-    symptoms_df.to_csv('symptoms_analysis.csv', index=False)
+    if 'symptoms' in sections:
+        symptoms = sections['symptoms']
+        symptoms_df = pd.DataFrame({
+            'Symptom': list(symptoms['symptom_prevalence'].keys()),
+            'Overall_Prevalence': list(symptoms['symptom_prevalence'].values()),
+            'TB_Positive_Prevalence': list(symptoms['symptom_tb_prevalence'].values())
+        })
+        symptoms_df.to_csv(output_dir / 'symptoms_analysis.csv', index=False)
+        generated.append(str(output_dir / 'symptoms_analysis.csv'))
 
     # Test performance CSV
-    test_perf_data = []
-    for test, metrics in diagnostic_tests['test_performance'].items():
-        test_perf_data.append({
-            'Test': test,
-            'Sensitivity': metrics['sensitivity'],
-            'Specificity': metrics['specificity'],
-            'Turnaround_Time': metrics['turnaround_time']
+    if 'diagnostic_tests' in sections:
+        test_perf_data = []
+        for test, metrics in sections['diagnostic_tests']['test_performance'].items():
+            test_perf_data.append({
+                'Test': test,
+                'Sensitivity': metrics['sensitivity'],
+                'Specificity': metrics['specificity'],
+                'Turnaround_Time': metrics['turnaround_time']
+            })
+        pd.DataFrame(test_perf_data).to_csv(output_dir / 'test_performance.csv', index=False)
+        generated.append(str(output_dir / 'test_performance.csv'))
+
+    # Sites CSV: one row per site and level
+    if 'sites' in sections:
+        levels = sections['sites']['levels']
+        site_rows = [
+            {'Level': level, **{col: site.get(col) for col in levels},
+             'Patients': site['total_patients'], 'TB_Positive': site['tb_positive'],
+             'TB_Rate': round(site['tb_positive'] / site['total_patients'] * 100, 2)}
+            for level, sites in sections['sites']['sites'].items() for site in sites
+        ]
+        pd.DataFrame(site_rows).to_csv(output_dir / 'sites.csv', index=False)
+        generated.append(str(output_dir / 'sites.csv'))
+
+    # Trends CSV: one row per period
+    if 'trends' in sections and sections['trends']['periods']:
+        trends = sections['trends']
+        trends_df = pd.DataFrame({
+            'Period': trends['periods'],
+            'Patients': trends['patients'],
+            'TB_Yield': trends['tb_yield']['rate'],
+            'TB_Yield_Rolling': trends['tb_yield']['rolling'],
+            'TB_Yield_EWMA': trends['tb_yield']['ewma'],
+            'Any_Symptom': trends['any_symptom']['rate'],
+            **{f"{test}_Positivity": values['rate'] for test, values in trends['test_positivity'].items()}
         })
-    pd.DataFrame(test_perf_data).to_csv('test_performance.csv', index=False)
+        trends_df.to_csv(output_dir / 'trends.csv', index=False)
+        generated.append(str(output_dir / 'trends.csv'))
+
+    return generated
+
+def report_timings(timings, data_source, total_patients, args):
+    """Print and/or log the stage timings of one run, as requested on the command line"""
+    if args.show_timings:
+        print_timings(timings)
+    if args.log_timings:
+        log_timings(timings, data_source, total_patients, args.log_timings)
+
+def main(argv=None):
+    """Main analysis function"""
+    args = parse_args(argv)
+
+    print("Starting TB Clinical Data Analysis...")
+    print("=" * 50)
+
+    # Get filenames from the command line or user input
+    filenames = expand_data_files(args.data_files) if args.data_files else [get_data_filename()]
+    if not filenames:
+        print("❌ No data files to analyze.")
+        return 1
+
+    # Check mode: fast on files whose patient store is up to date
+    if args.check_inputs:
+        return 1 if check_inputs(filenames) else 0
+
+    # Bulk scoring mode: one file in, one file of per-patient risk tiers out
+    if args.score_output:
+        if len(filenames) != 1:
+            print("❌ --score-output takes exactly one data file.")
+            return 1
+        try:
+            rows = score_file(filenames[0], args.score_output, args.chunk_size)
+        except Exception as e:
+            print(f"❌ Error scoring '{filenames[0]}': {e}")
+            return 1
+        print(f"✅ Scored {rows} patients -> {args.score_output}")
+        return 0
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    generated = []
+    cubes = []
+    failed = []
+    used_names = set()
+
+    for filename in filenames:
+        if not Path(filename).exists():
+            print(f"❌ File '{filename}' not found.")
+            failed.append(filename)
+            continue
+
+        # Several files: one output folder per file, named after it
+        if len(filenames) == 1:
+            file_dir = output_dir
+        else:
+            name = Path(filename).stem
+            while name in used_names:
+                name += '_'
+            used_names.add(name)
+            file_dir = output_dir / name
+            file_dir.mkdir(exist_ok=True)
+            print(f"\n=== {filename} -> {file_dir} ===")
+
+        timings = {}
+        try:
+            # Aggregate once; every analysis reads its counts from the cube
+            cube, trends, quality, df = build_file_cube(filename, file_dir, args, timings)
+            generated += write_results(cube, filename, file_dir, args, timings, trends, quality)
+            if quality['quarantined']:
+                generated.append(f"{file_dir / QUARANTINE_FILE} (rejected records)")
+
+            # Raw data CSV (already streamed out chunk by chunk in chunked mode)
+            if df is not None:
+                with timed_stage(timings, 'write_raw_csv', args, file_dir):
+                    decode_data(df).to_csv(file_dir / 'mockup_data.csv', index=False)
+            generated.append(f"{file_dir / 'mockup_data.csv'} (raw data)")
+        except Exception as e:
+            print(f"❌ Error analyzing '{filename}': {e}")
+            failed.append(filename)
+            continue
+        cubes.append((filename, cube, trends, quality))
+        report_timings(timings, filename, int(cube['n'].sum()), args)
+
+    # Combined roll-up: the cubes of all files, as if their rows were concatenated in order
+    if len(cubes) > 1:
+        print(f"\n=== Combined roll-up of {len(cubes)} files -> {output_dir} ===")
+        shifted = []
+        row_offset = 0
+        for _, cube, _, _ in cubes:
+            shifted.append(cube.assign(first_row=cube['first_row'] + row_offset))
+            row_offset += int(cube['n'].sum())
+        timings = {}
+        with timed_stage(timings, 'build_cube', args, output_dir):
+            combined = merge_count_cubes(shifted)
+            combined_trends = merge_trend_tables([trends for _, _, trends, _ in cubes])
+            combined_quality = merge_quality_summaries([quality for _, _, _, quality in cubes])
+        sources = [filename for filename, _, _, _ in cubes]
+        generated += write_results(combined, sources, output_dir, args, timings, combined_trends, combined_quality)
+        report_timings(timings, sources, int(combined['n'].sum()), args)
 
     print("Analysis complete!")
     print(f"Generated files:")
-    print(f"- analysis_results.json (main results)")
-    print(f"- mockup_data.csv (raw data)")
-    print(f"- demographics.csv")
-    print(f"- symptoms_analysis.csv")
-    print(f"- test_performance.csv")
+    for path in generated:
+        print(f"- {path}")
+    if failed:
+        print(f"❌ {len(failed)} file(s) failed: {', '.join(failed)}")
+        return 1
+    return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Benchmark Script for TB Clinical Data Analysis
+Generates synthetic TB screening cohorts with the 22-column schema, times every stage of
+analyze_tb_data.py on them and writes a machine-readable report
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import analyze_tb_data as tb
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+# Import-time budget (milliseconds, as measured by -X importtime) of the light commands,
+# and the heavy dependencies that must stay out of their startup path altogether
+STARTUP_BUDGET_MS = 100
+HEAVY_MODULES = {'pandas', 'numpy', 'pyarrow', 'openpyxl'}
+
+# Per-symptom prevalence among patients without / with TB
+SYMPTOM_RATES = {
+    'Cough': (0.25, 0.80),
+    'Fever': (0.15, 0.60),
+    'Weight_Loss': (0.10, 0.55),
+    'Tiredness': (0.20, 0.50),
+    'Hemoptysis': (0.02, 0.20),
+    'Night_Sweat': (0.08, 0.45)
+}
+
+def _choice(rng, labels, p, size):
+    """Categorical of labels drawn with probabilities p (kept as codes to stay compact)"""
+    codes = rng.choice(len(labels), size=size, p=p).astype(np.int8)
+    return pd.Categorical.from_codes(codes, categories=labels)
+
+def _yes_no(mask):
+    return pd.Categorical.from_codes(mask.astype(np.int8), categories=['No', 'Yes'])
+
+def generate_cohort(n, seed=0, tb_prevalence=0.12, hiv_prevalence=0.08, dm_prevalence=0.10,
+                    symptom_scale=1.0):
+    """Synthetic screening cohort of n patients with the documented 22-column schema
+
+    TB status is drawn first (more likely with HIV, DM, contact or previous TB) and
+    symptoms, CXR, sputum and GeneXpert results follow from it, so the analyses find
+    realistic associations. symptom_scale multiplies every symptom rate.
+    """
+    rng = np.random.default_rng(seed)
+
+    age = np.clip(rng.gamma(shape=2.2, scale=17.0, size=n), 0, 95).astype(np.int8)
+    age_group = pd.Categorical.from_codes(
+        np.digitize(age, [5, 15, 55]).astype(np.int8), categories=['0-4', '5-14', '15-54', '>54']
+    )
+
+    hiv = rng.random(n) < hiv_prevalence
+    dm = rng.random(n) < dm_prevalence
+    contact = rng.random(n) < 0.15
+    history = rng.random(n) < 0.08
+
+    # Relative risk of TB from the risk factors, scaled to the requested prevalence
+    risk = 1.0 + 2.0 * hiv + 0.7 * dm + 1.2 * contact + 1.5 * history
+    has_tb = rng.random(n) < np.clip(tb_prevalence * risk / risk.mean(), 0, 1)
+
+    df = pd.DataFrame({
+        'ID': np.char.add('SYN', np.char.zfill(np.arange(n).astype(str), 8)),
+        'Age': age,
+        'Age_Group': age_group,
+        'Sex': _choice(rng, ['Male', 'Female'], [0.52, 0.48], n),
+        'CXR_results': pd.Categorical.from_codes(
+            np.where(has_tb, rng.choice(4, n, p=[0.15, 0.40, 0.35, 0.10]),
+                     rng.choice(4, n, p=[0.65, 0.12, 0.03, 0.20])).astype(np.int8),
+            categories=['Normal', 'TB_Suspect', 'Abnormal_TB', 'Not_Done']
+        )
+    })
+
+    symptom_count = np.zeros(n, dtype=np.int8)
+    for symptom, (rate_no_tb, rate_tb) in SYMPTOM_RATES.items():
+        present = rng.random(n) < np.minimum(np.where(has_tb, rate_tb, rate_no_tb) * symptom_scale, 1)
+        df[symptom] = _yes_no(present)
+        symptom_count += present
+    df['Symptom_Cumulative'] = symptom_count
+
+    status = ['Yes', 'No', 'Unknown']
+    df['DM'] = pd.Categorical.from_codes(np.where(dm, 0, rng.choice([1, 2], n, p=[0.9, 0.1])).astype(np.int8), status)
+    df['HIV'] = pd.Categorical.from_codes(np.where(hiv, 0, rng.choice([1, 2], n, p=[0.85, 0.15])).astype(np.int8), status)
+    df['TB_Contact_History'] = _yes_no(contact)
+    df['TB_History'] = _yes_no(history)
+
+    gradings = ['Scanty', '1+', '2+', '3+', 'Not_Applicable']
+    for sputum, grading in [('Sputum_R1', 'R1_Grading'), ('Sputum_R2', 'R2_Grading')]:
+        done = rng.random(n) < 0.6
+        positive = done & (rng.random(n) < np.where(has_tb, 0.65, 0.02))
+        df[sputum] = pd.Categorical.from_codes(
+            np.where(positive, 0, np.where(done, 1, 2)).astype(np.int8), ['Positive', 'Negative', 'Not_Done']
+        )
+        df[grading] = pd.Categorical.from_codes(
+            np.where(positive, rng.choice(4, n, p=[0.2, 0.35, 0.3, 0.15]), 4).astype(np.int8), gradings
+        )
+
+    xpert_done = rng.random(n) < np.where(has_tb, 0.8, 0.45)
+    detected = xpert_done & (rng.random(n) < np.where(has_tb, 0.9, 0.015))
+    df['GeneXpertMTB'] = pd.Categorical.from_codes(
+        np.where(detected, 0, np.where(xpert_done, 1, 2)).astype(np.int8),
+        ['MTB_Detected', 'MTB_Not_Detected', 'Not_Done']
+    )
+    df['Diagnosis'] = pd.Categorical.from_codes(has_tb.astype(np.int8) ^ 1, [tb.TB_POSITIVE, 'No_TB'])
+
+    return df[tb.DATA_COLUMNS]
+
+def write_cohort(df, path):
+    """Write a cohort as .parquet, .csv or .xlsx depending on the suffix"""
+    path = Path(path)
+    if path.suffix == '.parquet':
+        df.to_parquet(path, index=False)
+    elif path.suffix == '.csv':
+        df.to_csv(path, index=False)
+    else:
+        df.to_excel(path, index=False)
+    return path
+
+def run_benchmark(n, input_format='parquet', seed=0, chunk_size=None, workers=1, **cohort_options):
+    """Time every pipeline stage on one synthetic cohort of n rows
+
+    Meant to run in a fresh process, so the reported peak RSS belongs to this size only.
+    """
+    stages = {}
+
+    def timed(name, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        stages[name] = {'seconds': round(time.perf_counter() - start, 4),
+                        'peak_rss_mb': round(tb.peak_rss_mb(), 1)}
+        return result
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Every cache folder under tmp, so timings never depend on an earlier run
+        tb.CACHE_DIR = Path(tmp) / 'cache'
+        tb.SECTION_CACHE_DIR = tb.CACHE_DIR / 'sections'
+        tb.MODEL_CACHE_DIR = tb.CACHE_DIR / 'models'
+        path = Path(tmp) / f"cohort.{input_format}"
+
+        df = timed('generate', generate_cohort, n, seed, **cohort_options)
+        timed('write_input', write_cohort, df, path)
+        del df
+
+        if chunk_size:
+            cube, _, _ = timed('build_cube', tb.build_count_cube_chunked, path, chunk_size, workers=workers)
+        else:
+            raw = timed('read', tb._read_raw, path)
+            df = timed('encode', tb.encode_data, raw)
+            del raw
+            valid, _, _ = timed('validate', tb.validate_data, df)
+            df = df[valid]
+            if workers > 1:
+                cube = timed('build_cube', tb.build_count_cube_parallel, df, workers)
+            else:
+                cube = timed('build_cube', tb.build_count_cube, df)
+            del df
+
+        sections = {}
+        for key, _, analyze in tb.ANALYSIS_SECTIONS:
+            sections[key] = timed(key, analyze, cube)
+        timed('serialize', lambda: tb.dumps_json(tb.clean_for_json(sections)))
+
+    # Input generation and writing are set-up, not pipeline cost
+    pipeline = sum(stage['seconds'] for name, stage in stages.items() if name not in ('generate', 'write_input'))
+    return {
+        'rows': n,
+        'cube_cells': len(cube),
+        'stages': stages,
+        'pipeline_seconds': round(pipeline, 4),
+        'rows_per_second': round(n / pipeline) if pipeline > 0 else None,
+        'peak_rss_mb': round(tb.peak_rss_mb(), 1)
+    }
+
+def _import_profile(stderr):
+    """Total import time (ms) and the top-level packages imported, from -X importtime output"""
+    total_us = 0
+    packages = set()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        total_us += int(self_us)
+        packages.add(name.strip().split('.')[0])
+    return total_us / 1000, packages
+
+def measure_startup(command, cwd, env, repeats=5):
+    """Best wall time of a command in a fresh interpreter, plus its -X importtime profile"""
+    walls = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *command], cwd=cwd, env=env, capture_output=True, check=True)
+        walls.append(time.perf_counter() - start)
+    profile = subprocess.run([sys.executable, '-X', 'importtime', *command], cwd=cwd, env=env,
+                             capture_output=True, text=True, check=True)
+    import_ms, packages = _import_profile(profile.stderr)
+    return {
+        'wall_ms': round(min(walls) * 1000, 1),
+        'import_ms': round(import_ms, 1),
+        'heavy_imports': sorted(packages & HEAVY_MODULES)
+    }
+
+def run_startup_benchmark(repeats=5):
+    """Startup cost of the light commands: listing outputs, --help and checking a cached input
+
+    The scripts are run as modules (python -m) where possible, so their cached bytecode is
+    used; a bare interpreter is measured too, as the floor every command pays.
+    """
+    script_dir = Path(__file__).resolve().parent
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(script_dir), os.environ.get('PYTHONPATH')])))
+    commands = {
+        'python -c pass': ['-c', 'pass'],
+        'import analyze_tb_data': ['-c', 'import analyze_tb_data'],
+        'analyze_tb_data --help': ['-m', 'analyze_tb_data', '--help'],
+        'analyze_tb_data --check-inputs (cached)': ['-m', 'analyze_tb_data', '--check-inputs', 'cohort.csv'],
+        'clean.py --list': [str(script_dir / 'clean.py'), '--list']
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        # A small input whose patient store is already built
+        write_cohort(generate_cohort(1_000), Path(tmp) / 'cohort.csv')
+        subprocess.run([sys.executable, '-m', 'analyze_tb_data', '--check-inputs', 'cohort.csv'],
+                       cwd=tmp, env=env, capture_output=True, check=True)
+        return {name: measure_startup(command, tmp, env, repeats) for name, command in commands.items()}
+
+def _environment():
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+def compare_reports(report, baseline, tolerance):
+    """Regressions of throughput or peak memory beyond tolerance, per cohort size"""
+    previous = {run['rows']: run for run in baseline['runs']}
+    regressions = []
+    for run in report['runs']:
+        old = previous.get(run['rows'])
+        if not old:
+            continue
+        if old['rows_per_second'] and run['rows_per_second'] < old['rows_per_second'] * (1 - tolerance):
+            regressions.append(f"{run['rows']} rows: throughput {run['rows_per_second']} rows/s "
+                               f"(was {old['rows_per_second']})")
+        if run['peak_rss_mb'] > old['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{run['rows']} rows: peak RSS {run['peak_rss_mb']} MB "
+                               f"(was {old['peak_rss_mb']})")
+    return regressions
+
+def main(argv=None):
+    """Run the benchmark for every requested cohort size"""
+    parser = argparse.ArgumentParser(description="Benchmark analyze_tb_data.py on synthetic TB cohorts")
+    parser.add_argument('--sizes', type=lambda value: [int(float(size)) for size in value.split(',')],
+                        default=DEFAULT_SIZES, help="Comma-separated cohort sizes, e.g. 1e3,1e5,1e7")
+    parser.add_argument('--format', choices=['parquet', 'csv', 'xlsx'], default='parquet',
+                        help="Input file format the pipeline reads (default: parquet)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tb-prevalence', type=float, default=0.12)
+    parser.add_argument('--hiv-prevalence', type=float, default=0.08)
+    parser.add_argument('--dm-prevalence', type=float, default=0.10)
+    parser.add_argument('--symptom-scale', type=float, default=1.0,
+                        help="Multiplier applied to every symptom rate")
+    parser.add_argument('--chunk-size', type=int, default=None, help="Benchmark the chunked reader instead")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--output', default='benchmark_report.json', help="Report file (default: benchmark_report.json)")
+    parser.add_argument('--baseline', help="Earlier report to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed relative slowdown / memory growth against --baseline (default: 0.2)")
+    parser.add_argument('--startup', action='store_true',
+                        help="Instead of the pipeline, time the startup of the light commands against the import budget")
+    parser.add_argument('--startup-budget-ms', type=float, default=STARTUP_BUDGET_MS,
+                        help=f"Import-time budget of each light command (default: {STARTUP_BUDGET_MS} ms)")
+    parser.add_argument('--generate-only', metavar='PATH',
+                        help="Just write a cohort of the first size to PATH (.parquet/.csv/.xlsx) and exit")
+    args = parser.parse_args(argv)
+
+    cohort_options = {
+        'tb_prevalence': args.tb_prevalence,
+        'hiv_prevalence': args.hiv_prevalence,
+        'dm_prevalence': args.dm_prevalence,
+        'symptom_scale': args.symptom_scale
+    }
+
+    if args.generate_only:
+        path = write_cohort(generate_cohort(args.sizes[0], args.seed, **cohort_options), args.generate_only)
+        print(f"✅ Wrote {args.sizes[0]} synthetic records to {path}")
+        return 0
+
+    if args.startup:
+        print("TB Clinical Data Analysis - Startup Benchmark")
+        print("=" * 50)
+        startup = run_startup_benchmark()
+        over_budget = []
+        for name, result in startup.items():
+            ok = result['import_ms'] <= args.startup_budget_ms and not result['heavy_imports']
+            heavy = f", imports {', '.join(result['heavy_imports'])}" if result['heavy_imports'] else ""
+            print(f"{'✅' if ok else '❌'} {name}: {result['wall_ms']} ms wall, "
+                  f"{result['import_ms']} ms importing{heavy}")
+            if not ok:
+                over_budget.append(name)
+
+        report = {
+            'created': pd.Timestamp.now().isoformat(),
+            'environment': _environment(),
+            'startup_budget_ms': args.startup_budget_ms,
+            'startup': startup
+        }
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"Report written to {args.output}")
+        if over_budget:
+            print(f"❌ Over the {args.startup_budget_ms:g} ms import budget: {', '.join(over_budget)}")
+            return 1
+        return 0
+
+    print("TB Clinical Data Analysis - Benchmark")
+    print("=" * 50)
+    runs = []
+    for n in args.sizes:
+        print(f"Benchmarking {n} rows...")
+        # A fresh process per size keeps the peak RSS figures independent
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+            run = pool.submit(run_benchmark, n, args.format, args.seed, args.chunk_size,
+                              args.workers, **cohort_options).result()
+        runs.append(run)
+        print(f"  {run['pipeline_seconds']:.2f} s, {run['rows_per_second']} rows/s, "
+              f"peak RSS {run['peak_rss_mb']} MB, {run['cube_cells']} cube cells")
+
+    report = {
+        'created': pd.Timestamp.now().isoformat(),
+        'environment': _environment(),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'runs': runs
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"Report written to {args.output}")
+
+    if args.baseline:
+        regressions = compare_reports(report, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"❌ Regression: {regression}")
+        if regressions:
+            return 1
+        print("✅ No regressions against the baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
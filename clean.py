@@ -4,134 +4,125 @@ Clean Script for TB Clinical Data Analysis
 Removes all generated analysis files and outputs
 """
 
+import argparse
 import os
-import glob
-
-def delete_file(filename):
-    """Safely delete a file if it exists"""
+import shutil
+import sys
+from fnmatch import fnmatch
+
+# Files written by analyze_tb_data.py, benchmark_tb.py and render_charts.py
+GENERATED_FILES = [
+    # Main analysis outputs
+    'analysis_results.json',
+    'analysis_results.json.gz',
+    'analysis_results.json.br',
+    'analysis_manifest.json',
+    'report.html',
+    'analysis_state.pkl',
+    'trend_state.pkl',
+    'benchmark_report.json',
+    'count_cube.parquet',
+    'count_cube.pkl',
+
+    # CSV exports
+    'mockup_data.csv',
+    'demographics.csv',
+    'symptoms_analysis.csv',
+    'test_performance.csv',
+    'trends.csv',
+    'sites.csv',
+    'quarantine.csv',
+
+    # Any other potential CSV files from analysis
+    'comorbidities.csv',
+    'risk_factors.csv',
+    'epidemiology.csv',
+    'patient_journey.csv',
+    'predictive_metrics.csv',
+    'risk_stratification.csv'
+]
+
+# Other analysis outputs, profiles and memory traces (--profile / --trace-memory), Python caches
+GENERATED_PATTERNS = [
+    '*_analysis.csv', 'tb_*.csv', '*_results.csv', '*_results.json', 'tb_*.json',
+    'profile_*.prof', 'memory_*.txt', '*.pyc', '*.pyo', '.DS_Store'
+]
+
+# Patient stores, section files, rendered charts and Python caches
+GENERATED_DIRS = ['.tb_cache', 'sections', 'charts', '__pycache__']
+
+def find_generated(directory='.'):
+    """Generated files and folders in directory, from a single scan of it"""
+    found = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name in GENERATED_DIRS:
+                    found.append(entry)
+            elif entry.name in GENERATED_FILES or any(fnmatch(entry.name, pattern) for pattern in GENERATED_PATTERNS):
+                found.append(entry)
+    return sorted(found, key=lambda entry: entry.name)
+
+def delete_entry(entry):
+    """Safely delete a generated file or folder"""
     try:
-        if os.path.exists(filename):
-            os.remove(filename)
-            print(f"✅ Deleted: {filename}")
-            return True
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+            print(f"✅ Deleted directory: {entry.name}")
         else:
-            print(f"⚠️  Not found: {filename}")
-            return False
+            os.remove(entry.path)
+            print(f"✅ Deleted: {entry.name}")
+        return True
     except Exception as e:
-        print(f"❌ Error deleting {filename}: {e}")
+        print(f"❌ Error deleting {entry.name}: {e}")
         return False
 
-def main():
+def main(argv=None):
     """Clean all generated files"""
+    parser = argparse.ArgumentParser(description="Delete the files generated by the TB analysis")
+    parser.add_argument('--directory', default='.', help="Folder to clean (default: current folder)")
+    parser.add_argument('--list', action='store_true', help="Only list the generated files, deleting nothing")
+    parser.add_argument('--yes', '-y', action='store_true', help="Delete without asking (for scheduled jobs)")
+    args = parser.parse_args(argv)
+
+    generated = find_generated(args.directory)
+
+    if args.list:
+        for entry in generated:
+            print(f"  {'📁' if entry.is_dir(follow_symlinks=False) else '📄'} {entry.name}")
+        print(f"{len(generated)} generated files/directories in {args.directory}")
+        return 0
+
     print("TB Clinical Data Analysis - File Cleaner")
     print("=" * 50)
-    print("This will delete all generated analysis files.")
+    if not generated:
+        print("No generated files found. Nothing to clean.")
+        return 0
+    print(f"This will delete {len(generated)} generated files/directories.")
 
     # Ask for confirmation
-    confirm = input("Are you sure you want to delete all generated files? (y/N): ").strip().lower()
-
-    if confirm not in ['y', 'yes']:
-        print("Operation cancelled.")
-        return
+    if not args.yes:
+        confirm = input("Are you sure you want to delete all generated files? (y/N): ").strip().lower()
+        if confirm not in ['y', 'yes']:
+            print("Operation cancelled.")
+            return 0
 
     print("\nCleaning up generated files...")
-
-    # List of files to delete
-    files_to_delete = [
-        # Main analysis outputs
-        'analysis_results.json',
-
-        # CSV exports
-        'mockup_data.csv',
-        'demographics.csv',
-        'symptoms_analysis.csv',
-        'test_performance.csv',
-
-        # Any other potential CSV files from analysis
-        'comorbidities.csv',
-        'risk_factors.csv',
-        'epidemiology.csv',
-        'patient_journey.csv',
-        'predictive_metrics.csv',
-        'risk_stratification.csv'
-    ]
-
-    deleted_count = 0
-
-    # Delete specific files
-    for file in files_to_delete:
-        if delete_file(file):
-            deleted_count += 1
-
-    # Delete any other analysis-related files that might exist
-    print("\nLooking for other analysis files...")
-
-    # Find and delete any other CSV files that might be analysis outputs
-    csv_files = glob.glob("*_analysis.csv")
-    csv_files.extend(glob.glob("tb_*.csv"))
-    csv_files.extend(glob.glob("*_results.csv"))
-
-    for csv_file in csv_files:
-        if csv_file not in files_to_delete:  # Avoid double-counting
-            if delete_file(csv_file):
-                deleted_count += 1
-
-    # Find and delete any JSON files that might be analysis outputs
-    json_files = glob.glob("*_results.json")
-    json_files.extend(glob.glob("tb_*.json"))
-
-    for json_file in json_files:
-        if json_file not in files_to_delete:  # Avoid double-counting
-            if delete_file(json_file):
-                deleted_count += 1
-
-    # Clean up any Python cache files while we're at it
-    print("\nCleaning Python cache files...")
-    cache_patterns = [
-        "__pycache__",
-        "*.pyc",
-        "*.pyo",
-        ".DS_Store"
-    ]
-
-    for pattern in cache_patterns:
-        cache_files = glob.glob(pattern)
-        for cache_file in cache_files:
-            if os.path.isfile(cache_file):
-                if delete_file(cache_file):
-                    deleted_count += 1
-            elif os.path.isdir(cache_file):
-                try:
-                    import shutil
-                    shutil.rmtree(cache_file)
-                    print(f"✅ Deleted directory: {cache_file}")
-                    deleted_count += 1
-                except Exception as e:
-                    print(f"❌ Error deleting directory {cache_file}: {e}")
+    deleted_count = sum(delete_entry(entry) for entry in generated)
 
     print("\n" + "=" * 50)
     print(f"Cleanup complete! Deleted {deleted_count} files/directories.")
-    print("\nRemaining files in directory:")
-
-    # Show what's left
-    remaining_files = []
-    for file in os.listdir('.'):
-        if os.path.isfile(file):
-            remaining_files.append(file)
-
-    remaining_files.sort()
-    for file in remaining_files:
-        print(f"  📄 {file}")
-
-    print(f"\nTotal remaining files: {len(remaining_files)}")
+    if deleted_count < len(generated):
+        print(f"❌ {len(generated) - deleted_count} could not be deleted.")
 
     # Show instructions
     print("\n" + "=" * 50)
     print("To regenerate analysis files, run:")
     print("  python analyze_tb_data.py")
     print("\nTo view dashboard, run:")
-    print("  python -m http.server 3000")
+    print("  python serve_dashboard.py")
     print("  Then open: http://localhost:3000/index.html")
+    return 0 if deleted_count == len(generated) else 1
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Query Server for TB Clinical Data Analysis
+Serves the dashboard files plus drill-down count/rate queries over the saved count cube,
+and patient lists from the memory-mapped patient store when a data file is given
+"""
+
+import argparse
+import sys
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import analyze_tb_data as tb
+
+def parse_query(query_string):
+    """Filters, group-by and outcome of a query string
+
+    where=HIV:Yes&where=Age_Group:0-4,5-14&group_by=Sex,CXR_results&outcome=GeneXpertMTB:MTB_Detected
+    """
+    params = parse_qs(query_string)
+    filters = {}
+    for clause in params.get('where', []):
+        col, _, values = clause.partition(':')
+        filters.setdefault(col, []).extend(values.split(','))
+
+    group_by = [col for value in params.get('group_by', []) for col in value.split(',') if col]
+
+    outcome = ('Diagnosis', [tb.TB_POSITIVE])
+    if 'outcome' in params:
+        col, _, values = params['outcome'][-1].partition(':')
+        outcome = (col, values.split(','))
+    return filters, group_by, outcome
+
+PATIENT_LIMIT = 100
+
+def api_response(url, cube, store=None):
+    """(status, JSON object) answering an /api/* request from the cube and store; None for other paths"""
+    if url.path == '/api/dimensions':
+        dimensions = {col: cube[col].cat.categories.tolist() for col in tb.cube_dimensions(cube)}
+        return 200, {'total_patients': int(cube['n'].sum()), 'dimensions': dimensions}
+
+    if url.path == '/api/query':
+        start = time.perf_counter()
+        try:
+            result = tb.query_cube(cube, *parse_query(url.query))
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        result['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        return 200, result
+
+    if url.path == '/api/patients':
+        if store is None:
+            return 404, {'error': "Start the server with --data FILE to list patients"}
+        start = time.perf_counter()
+        filters, _, _ = parse_query(url.query)
+        try:
+            limit = int(parse_qs(url.query).get('limit', [PATIENT_LIMIT])[-1])
+        except ValueError:
+            return 400, {'error': "limit must be a whole number"}
+        if limit < 1:
+            return 400, {'error': "limit must be at least 1"}
+        limit = min(limit, PATIENT_LIMIT)
+        try:
+            n = tb.store_count(store, filters)
+            rows = tb.store_rows(store, filters, limit)
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        return 200, {
+            'filters': filters,
+            'n': n,
+            'ids': store['data']['ID'][rows].tolist(),
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+        }
+    return None
+
+def mismatched_counts(cube, store):
+    """'column:value' filters for which /api/patients and /api/query count different patients
+
+    Both skip quarantined rows, so for a cube built from the store's data file every
+    indexed value agrees; a mismatch means the cube and the data file are out of step.
+    """
+    mismatched = []
+    dimensions = tb.cube_dimensions(cube)
+    for col, info in store['columns'].items():
+        if col not in store['bitmaps'] or col not in dimensions:
+            continue
+        for value in info['labels']:
+            query = urlencode({'where': f"{col}:{value}", 'limit': 1})
+            counts = [api_response(urlparse(f"{route}?{query}"), cube, store)
+                      for route in ('/api/query', '/api/patients')]
+            if counts[0][0] != 200 or counts[0][1]['n'] != counts[1][1]['n']:
+                mismatched.append(f"{col}:{value}")
+    return mismatched
+
+def open_store(data, cube=None):
+    """Memory-map the patient store of a data file, warning when it disagrees with the cube (if given)"""
+    store_path, _ = tb.ingest_data(data)
+    store = tb.open_patient_store(store_path)
+    print(f"✅ Opened patient store of {data} ({store['rows']} records)")
+    mismatched = [] if cube is None else mismatched_counts(cube, store)
+    if mismatched:
+        print(f"⚠️  /api/patients and /api/query disagree for {', '.join(mismatched[:5])}"
+              f"{' ...' if len(mismatched) > 5 else ''}; rerun analyze_tb_data.py on {data}")
+    return store
+
+def make_handler(cube, directory, store=None):
+    """Request handler answering /api/* from the cube (and store) and everything else from directory"""
+
+    class CubeQueryHandler(SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=str(directory), **kwargs)
+
+        def send_json(self, obj, status=200):
+            body = tb.dumps_json(tb.clean_for_json(obj), compact=True)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            response = api_response(urlparse(self.path), cube, store)
+            if response is None:
+                super().do_GET()
+            else:
+                status, obj = response
+                self.send_json(obj, status)
+
+    return CubeQueryHandler
+
+def main(argv=None):
+    """Load the count cube and serve it until interrupted"""
+    parser = argparse.ArgumentParser(description="Serve the dashboard and drill-down queries over a saved count cube")
+    parser.add_argument('cube', nargs='?', default=None,
+                        help="Count cube written by analyze_tb_data.py (default: count_cube.parquet or .pkl)")
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--directory', default='.', help="Folder with index.html and the analysis results")
+    parser.add_argument('--data', metavar='FILE',
+                        help="Data file whose patient store answers /api/patients (built on first use)")
+    args = parser.parse_args(argv)
+
+    path = Path(args.cube) if args.cube else Path(args.directory) / f"count_cube{tb._columnar_suffix()}"
+    if not path.exists():
+        print(f"❌ Count cube '{path}' not found. Run analyze_tb_data.py first.")
+        return 1
+    cube = tb.load_count_cube(path)
+    print(f"✅ Loaded {len(cube)} cube cells covering {int(cube['n'].sum())} patients from {path}")
+
+    store = None
+    if args.data:
+        store = open_store(args.data, cube)
+
+    server = ThreadingHTTPServer(('', args.port), make_handler(cube, args.directory, store))
+    print(f"Serving on http://localhost:{args.port}/index.html")
+    print(f"Example query: http://localhost:{args.port}/api/query?where=HIV:Yes&where=TB_Contact_History:Yes&group_by=Age_Group")
+    if store:
+        print(f"Patient list: http://localhost:{args.port}/api/patients?where=HIV:Yes&where=CXR_results:Abnormal_TB")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nServer stopped.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,6 +7,63 @@ mermaid.initialize({ startOnLoad: true });
 // Chart.js global configuration
 Chart.defaults.font.family = 'Inter';
 
+// Charts and static sections, keyed by the element that triggers them, with the result sections they need
+const DASHBOARD_PARTS = [
+    ['ageGenderChart', ['demographics'], createAgeGenderChart],
+    ['symptomPrevalenceChart', ['symptoms'], createSymptomPrevalenceChart],
+    ['comorbiditiesChart', ['comorbidities'], createComorbiditiesChart],
+    ['diagnosticTestChart', ['diagnostic_tests'], createDiagnosticTestChart],
+    ['ageSexPyramidChart', ['demographics'], createAgeSexPyramidChart],
+    ['symptomHeatmapChart', ['symptoms'], createSymptomHeatmapChart],
+    ['symptomCorrelationChart', ['associations'], createSymptomCorrelationChart],
+    ['patientJourneySankey', ['patient_journey'], createPatientJourneySankey],
+    ['symptomTBChart', ['symptoms'], createSymptomTBChart],
+    ['symptomsVsTbChart', ['risk_factors'], createSymptomsVsTbChart],
+    ['comorbidityInfluenceChart', ['comorbidities'], createComorbidityInfluenceChart],
+    ['contactHistoryChart', ['risk_factors'], createContactHistoryChart],
+    ['prevTbHistoryChart', ['risk_factors'], createPrevTbHistoryChart],
+    ['prevalenceByDemographicsChart', ['epidemiology'], createPrevalenceByDemographicsChart],
+    ['highRiskSubgroupsChart', ['epidemiology'], createHighRiskSubgroupsChart],
+    ['modelComparisonChart', ['predictive_metrics'], createModelComparisonChart],
+    ['featureImportanceChart', ['predictive_metrics'], createFeatureImportanceChart],
+    ['cxr-sensitivity', ['diagnostic_tests'], updateTestPerformanceTable],
+    ['low-risk-percent', ['risk_stratification'], () => {
+        updateRiskStratificationMatrix();
+        setupRiskCalculator();
+    }]
+];
+
+// Pending or finished section downloads, so each section is fetched once
+const sectionRequests = {};
+
+// Make sure a result section is in tbAnalysisData, fetching its hashed file from the manifest if needed
+function loadSection(key) {
+    if (tbAnalysisData[key] !== undefined) {
+        return Promise.resolve();
+    }
+    if (!tbManifest || !tbManifest.sections[key]) {
+        return Promise.reject(new Error(`Section ${key} is not in the analysis results`));
+    }
+    if (!sectionRequests[key]) {
+        sectionRequests[key] = fetch(tbManifest.sections[key].file)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP error! status: ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(section => { tbAnalysisData[key] = section; });
+    }
+    return sectionRequests[key];
+}
+
+// Load the sections a part needs, then draw it
+function renderPart(elementId, sections, render) {
+    Promise.all(sections.map(loadSection))
+        .then(render)
+        .catch(error => console.error(`Could not render ${elementId}:`, error));
+}
+
 // Main function to initialize all charts with real data
 function initializeCharts() {
     if (!tbAnalysisData) {
@@ -14,32 +71,31 @@ function initializeCharts() {
         return;
     }
 
-    console.log('Initializing charts with real data...');
-
-    // Initialize all charts
-    createAgeGenderChart();
-    createSymptomPrevalenceChart();
-    createComorbiditiesChart();
-    createDiagnosticTestChart();
-    createAgeSexPyramidChart();
-    createSymptomHeatmapChart();
-    createSymptomCorrelationChart();
-    createPatientJourneySankey();
-    createSymptomTBChart();
-    createSymptomsVsTbChart();
-    createComorbidityInfluenceChart();
-    createContactHistoryChart();
-    createPrevTbHistoryChart();
-    createPrevalenceByDemographicsChart();
-    createHighRiskSubgroupsChart();
-    createModelComparisonChart();
-    createFeatureImportanceChart();
-
-    // Update static HTML sections
-    updateTestPerformanceTable();
-    updateRiskStratificationMatrix();
-
-    console.log('All charts and static sections initialized successfully');
+    // Without a manifest (or IntersectionObserver) everything is drawn right away
+    if (!tbManifest || !('IntersectionObserver' in window)) {
+        console.log('Initializing charts with real data...');
+        DASHBOARD_PARTS.forEach(([elementId, sections, render]) => renderPart(elementId, sections, render));
+        return;
+    }
+
+    // Otherwise each chart fetches its sections when it is about to scroll into view
+    console.log('Charts will load their sections as they scroll into view...');
+    const parts = {};
+    const observer = new IntersectionObserver(entries => {
+        entries.filter(entry => entry.isIntersecting).forEach(entry => {
+            observer.unobserve(entry.target);
+            const [elementId, sections, render] = parts[entry.target.id];
+            renderPart(elementId, sections, render);
+        });
+    }, { rootMargin: '300px' });
+
+    DASHBOARD_PARTS.forEach(part => {
+        const element = document.getElementById(part[0]);
+        if (element) {
+            parts[part[0]] = part;
+            observer.observe(element);
+        }
+    });
 }
 
 // 1. Age and Gender Distribution Chart
@@ -225,7 +281,16 @@ function createAgeSexPyramidChart() {
 // 6. Symptom Combination Heatmap
 function createSymptomHeatmapChart() {
     const ctx = document.getElementById('symptomHeatmapChart').getContext('2d');
-    const combinations = tbAnalysisData.symptoms.combination_diagnostic_yield;
+    const subsets = tbAnalysisData.symptoms.symptom_subsets;
+
+    // Every symptom pair when the full subset table is available, else the fixed combinations
+    let combinations = tbAnalysisData.symptoms.combination_diagnostic_yield;
+    if (subsets) {
+        combinations = {};
+        Object.entries(subsets)
+            .filter(([name, subset]) => name.split('+').length === 2 && subset.count > 0)
+            .forEach(([name, subset]) => { combinations[name] = subset.diagnostic_yield; });
+    }
 
     const labels = Object.keys(combinations);
     const data = Object.values(combinations);
@@ -261,35 +326,32 @@ function createSymptomHeatmapChart() {
 function createSymptomCorrelationChart() {
     const ctx = document.getElementById('symptomCorrelationChart').getContext('2d');
 
-    // Simulated correlation data based on clinical knowledge
-    const correlations = {
-        'Cough→GeneXpert': 0.85,
-        'Fever→CXR': 0.62,
-        'Weight Loss→Sputum': 0.71,
-        'Night Sweats→CXR': 0.58,
-        'Hemoptysis→GeneXpert': 0.93
-    };
+    const phi = tbAnalysisData.associations.symptom_test_phi;
+    const symptoms = Object.keys(phi);
+    const tests = [
+        ['CXR_Abnormal', 'CXR Abnormal', 'rgba(79, 70, 229, 0.7)'],
+        ['Sputum_Positive', 'Sputum Positive', 'rgba(16, 185, 129, 0.7)'],
+        ['GeneXpert_Positive', 'GeneXpert Detected', 'rgba(249, 115, 22, 0.7)']
+    ];
 
     new Chart(ctx, {
         type: 'bar',
         data: {
-            labels: Object.keys(correlations),
-            datasets: [{
-                label: 'Correlation Strength',
-                data: Object.values(correlations),
-                backgroundColor: 'rgba(79, 70, 229, 0.7)'
-            }]
+            labels: symptoms.map(symptom => symptom.replace('_', ' ')),
+            datasets: tests.map(([key, label, color]) => ({
+                label: label,
+                data: symptoms.map(symptom => phi[symptom][key]),
+                backgroundColor: color
+            }))
         },
         options: {
             indexAxis: 'y',
             responsive: true,
             maintainAspectRatio: false,
-            plugins: { legend: { display: false } },
+            plugins: { legend: { position: 'bottom' } },
             scales: {
                 x: {
-                    beginAtZero: true,
-                    max: 1,
-                    title: { display: true, text: 'Correlation Coefficient' }
+                    title: { display: true, text: 'Correlation Coefficient (phi)' }
                 }
             }
         }
@@ -665,4 +727,26 @@ function updateRiskStratificationMatrix() {
     document.getElementById('very-high-risk-desc').textContent = riskData['Very High Risk'].description;
 }
 
+// Risk score calculator, using the same weights and tier rules as score_patients()
+function setupRiskCalculator() {
+    const riskData = tbAnalysisData.risk_stratification;
+    if (!riskData.exclusive_tiers) {
+        return;
+    }
+    const weights = riskData.score_weights;
+
+    document.getElementById('risk-calculate').addEventListener('click', () => {
+        const age = parseInt(document.getElementById('risk-age').value, 10);
+        const hiv = document.getElementById('risk-hiv').value === 'Positive';
+        const dm = document.getElementById('risk-dm').value === 'Positive';
+
+        const score = (hiv ? weights.HIV : 0) + (dm ? weights.DM : 0) + (age > 54 ? weights.Age_over_54 : 0);
+        const tier = hiv ? 'Very High' : (dm ? 'Medium' : 'Low');
+
+        // Show the observed TB rate of patients in the same tier
+        const tbRate = riskData.exclusive_tiers[tier].tb_rate;
+        document.getElementById('risk-result').textContent = `${tier} (score ${score}, ${tbRate}% TB)`;
+    });
+}
+
 console.log('TB Analysis Dashboard JavaScript loaded successfully');
\ No newline at end of file
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Chart Rendering Script for TB Clinical Data Analysis
+Renders the 17 dashboard charts to static SVG (and PNG when cairosvg is installed)
+and builds an offline report page that needs no CDN scripts or client-side charting
+"""
+
+import argparse
+import html
+import json
+import math
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+WIDTH, HEIGHT = 640, 360
+FONT = "font-family='Inter, Arial, sans-serif'"
+
+BLUE = 'rgba(59, 130, 246, 0.7)'
+PINK = 'rgba(236, 72, 153, 0.7)'
+RED = 'rgba(239, 68, 68, 0.7)'
+INDIGO = 'rgba(79, 70, 229, 0.7)'
+GREEN = 'rgba(16, 185, 129, 0.7)'
+ORANGE = 'rgba(249, 115, 22, 0.7)'
+
+def _nice_max(value):
+    """Round an axis maximum up to 1, 2, 2.5 or 5 times a power of ten"""
+    if not value or value <= 0:
+        return 1
+    scale = 10 ** math.floor(math.log10(value))
+    for step in (1, 2, 2.5, 5, 10):
+        if value <= step * scale:
+            return step * scale
+
+def _tick(value):
+    return f"{value:g}" if abs(value) < 1e6 else f"{value:.2e}"
+
+def _text(x, y, label, size=11, anchor='middle', extra=''):
+    return (f"<text x='{x:.1f}' y='{y:.1f}' font-size='{size}' text-anchor='{anchor}' "
+            f"fill='#374151' {FONT} {extra}>{html.escape(str(label))}</text>")
+
+def _svg(title, body, legend=()):
+    """Wrap chart elements in an SVG document with a title and optional legend"""
+    parts = [f"<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 {WIDTH} {HEIGHT}' "
+             f"width='{WIDTH}' height='{HEIGHT}' role='img'>",
+             f"<title>{html.escape(title)}</title>",
+             f"<rect width='{WIDTH}' height='{HEIGHT}' fill='white'/>"]
+    x = WIDTH / 2 - sum(24 + 6.5 * len(name) for name, _ in legend) / 2
+    for name, color in legend:
+        parts.append(f"<rect x='{x:.1f}' y='10' width='12' height='12' fill='{color}'/>")
+        parts.append(_text(x + 16, 20, name, anchor='start'))
+        x += 24 + 6.5 * len(name)
+    parts += body
+    parts.append('</svg>')
+    return '\n'.join(parts)
+
+def _color(colors, i):
+    return colors[i % len(colors)] if isinstance(colors, (list, tuple)) else colors
+
+def bar_chart(title, labels, series, axis_label='', horizontal=False, max_value=None):
+    """Grouped bar chart; series is a list of (name, values, color or list of colors)"""
+    labels = [str(label) for label in labels]
+    values = [[value or 0 for value in values] for _, values, _ in series]
+    top = max_value or _nice_max(max((max(v, default=0) for v in values), default=0))
+    legend = [(name, _color(color, 0)) for name, _, color in series] if len(series) > 1 else []
+    plot_top = 40 if legend else 20
+    body = []
+
+    if horizontal:
+        left = min(230, 16 + 6.5 * max((len(label) for label in labels), default=1))
+        plot_w, plot_h = WIDTH - left - 24, HEIGHT - plot_top - 48
+        for k in range(6):
+            x = left + plot_w * k / 5
+            body.append(f"<line x1='{x:.1f}' y1='{plot_top}' x2='{x:.1f}' y2='{plot_top + plot_h}' stroke='#E5E7EB'/>")
+            body.append(_text(x, plot_top + plot_h + 15, _tick(top * k / 5)))
+        band = plot_h / max(len(labels), 1)
+        bar = band * 0.8 / len(series)
+        for i, label in enumerate(labels):
+            y = plot_top + i * band + band * 0.1
+            body.append(_text(left - 6, y + band * 0.4 + 4, label, anchor='end'))
+            for s, (_, _, color) in enumerate(series):
+                w = plot_w * max(values[s][i], 0) / top
+                body.append(f"<rect x='{left}' y='{y + s * bar:.1f}' width='{w:.1f}' height='{bar:.1f}' "
+                            f"fill='{_color(color, i)}'/>")
+        body.append(_text(left + plot_w / 2, HEIGHT - 8, axis_label))
+    else:
+        rotate = len(labels) > 6 or max((len(label) for label in labels), default=0) > 14
+        bottom = 110 if rotate else 48
+        left = 58
+        plot_w, plot_h = WIDTH - left - 20, HEIGHT - plot_top - bottom
+        for k in range(6):
+            y = plot_top + plot_h - plot_h * k / 5
+            body.append(f"<line x1='{left}' y1='{y:.1f}' x2='{left + plot_w}' y2='{y:.1f}' stroke='#E5E7EB'/>")
+            body.append(_text(left - 6, y + 4, _tick(top * k / 5), anchor='end'))
+        band = plot_w / max(len(labels), 1)
+        bar = band * 0.8 / len(series)
+        for i, label in enumerate(labels):
+            x = left + i * band + band * 0.1
+            for s, (_, _, color) in enumerate(series):
+                h = plot_h * max(values[s][i], 0) / top
+                body.append(f"<rect x='{x + s * bar:.1f}' y='{plot_top + plot_h - h:.1f}' width='{bar:.1f}' "
+                            f"height='{h:.1f}' fill='{_color(color, i)}'/>")
+            cx = x + band * 0.4
+            if rotate:
+                body.append(_text(cx, plot_top + plot_h + 12, label, size=10, anchor='end',
+                                  extra=f"transform='rotate(-40 {cx:.1f} {plot_top + plot_h + 12:.1f})'"))
+            else:
+                body.append(_text(cx, plot_top + plot_h + 15, label))
+        body.append(_text(14, plot_top + plot_h / 2, axis_label,
+                          extra=f"transform='rotate(-90 14 {plot_top + plot_h / 2:.1f})'"))
+
+    return _svg(title, body, legend)
+
+def pie_chart(title, labels, values, colors, hole=0.0):
+    """Pie chart (or doughnut when hole > 0) with a legend on the right"""
+    values = [max(value or 0, 0) for value in values]
+    total = sum(values)
+    cx, cy, r = WIDTH * 0.32, HEIGHT / 2, 140
+    body = []
+    angle = -math.pi / 2
+    for i, value in enumerate(values):
+        if not total or not value:
+            continue
+        if value == total:
+            body.append(f"<circle cx='{cx}' cy='{cy}' r='{r}' fill='{_color(colors, i)}'/>")
+            continue
+        end = angle + 2 * math.pi * value / total
+        large = 1 if end - angle > math.pi else 0
+        x0, y0 = cx + r * math.cos(angle), cy + r * math.sin(angle)
+        x1, y1 = cx + r * math.cos(end), cy + r * math.sin(end)
+        body.append(f"<path d='M{cx},{cy} L{x0:.2f},{y0:.2f} A{r},{r} 0 {large} 1 {x1:.2f},{y1:.2f} Z' "
+                    f"fill='{_color(colors, i)}' stroke='white'/>")
+        angle = end
+    if hole:
+        body.append(f"<circle cx='{cx}' cy='{cy}' r='{r * hole:.1f}' fill='white'/>")
+
+    for i, (label, value) in enumerate(zip(labels, values)):
+        y = HEIGHT / 2 - 10 * len(labels) + 20 * i
+        share = f" ({value / total * 100:.1f}%)" if total else ''
+        body.append(f"<rect x='{WIDTH * 0.62:.1f}' y='{y:.1f}' width='12' height='12' fill='{_color(colors, i)}'/>")
+        body.append(_text(WIDTH * 0.62 + 18, y + 10, f"{label}{share}", anchor='start'))
+    return _svg(title, body)
+
+def pyramid_chart(title, labels, left_values, right_values, left_name, right_name):
+    """Population pyramid: left_values drawn to the left of the axis, right_values to the right"""
+    left_values = [abs(value or 0) for value in left_values]
+    right_values = [abs(value or 0) for value in right_values]
+    top = _nice_max(max(left_values + right_values, default=0))
+    plot_top, label_w = 40, 60
+    plot_w, plot_h = WIDTH - label_w - 40, HEIGHT - plot_top - 40
+    centre = label_w + 20 + plot_w / 2
+    body = []
+    for k in range(-2, 3):
+        x = centre + plot_w / 2 * k / 2
+        body.append(f"<line x1='{x:.1f}' y1='{plot_top}' x2='{x:.1f}' y2='{plot_top + plot_h}' stroke='#E5E7EB'/>")
+        body.append(_text(x, plot_top + plot_h + 15, _tick(abs(top * k / 2))))
+    band = plot_h / max(len(labels), 1)
+    for j, label in enumerate(labels):
+        y = plot_top + j * band + band * 0.1
+        wl = plot_w / 2 * left_values[j] / top
+        wr = plot_w / 2 * right_values[j] / top
+        body.append(f"<rect x='{centre - wl:.1f}' y='{y:.1f}' width='{wl:.1f}' height='{band * 0.8:.1f}' fill='{BLUE}'/>")
+        body.append(f"<rect x='{centre:.1f}' y='{y:.1f}' width='{wr:.1f}' height='{band * 0.8:.1f}' fill='{PINK}'/>")
+        body.append(_text(label_w, y + band * 0.4 + 4, label, anchor='end'))
+    body.append(_text(centre, HEIGHT - 6, 'Number of Patients'))
+    return _svg(title, body, [(left_name, BLUE), (right_name, PINK)])
+
+def sankey_chart(title, flows):
+    """Sankey diagram of {'from', 'to', 'flow'} links, nodes placed in columns by depth"""
+    flows = [flow for flow in flows if flow.get('flow')]
+    nodes = list(dict.fromkeys(name for flow in flows for name in (flow['from'], flow['to'])))
+    depth = dict.fromkeys(nodes, 0)
+    for _ in range(len(nodes)):
+        for flow in flows:
+            depth[flow['to']] = max(depth[flow['to']], depth[flow['from']] + 1)
+    size = {node: max(sum(f['flow'] for f in flows if f['to'] == node),
+                      sum(f['flow'] for f in flows if f['from'] == node)) for node in nodes}
+
+    columns = max(depth.values(), default=0) + 1
+    gap, node_w, plot_top, plot_h = 12, 14, 20, HEIGHT - 40
+    column_nodes = [[node for node in nodes if depth[node] == c] for c in range(columns)]
+    scale = min((plot_h - gap * (len(col) - 1)) / max(sum(size[n] for n in col), 1) for col in column_nodes) \
+        if nodes else 1
+
+    # Top of every node, and where its next outgoing / incoming band starts
+    top, outgoing, incoming = {}, {}, {}
+    for c, col in enumerate(column_nodes):
+        x = 20 + (WIDTH - 40 - node_w - 120) * c / max(columns - 1, 1)
+        y = plot_top
+        for node in col:
+            top[node] = (x, y)
+            outgoing[node] = incoming[node] = y
+            y += size[node] * scale + gap
+
+    body = []
+    for flow in flows:
+        h = flow['flow'] * scale
+        x0, x1 = top[flow['from']][0] + node_w, top[flow['to']][0]
+        y0, y1 = outgoing[flow['from']], incoming[flow['to']]
+        xm = (x0 + x1) / 2
+        body.append(f"<path d='M{x0:.1f},{y0:.1f} C{xm:.1f},{y0:.1f} {xm:.1f},{y1:.1f} {x1:.1f},{y1:.1f} "
+                    f"L{x1:.1f},{y1 + h:.1f} C{xm:.1f},{y1 + h:.1f} {xm:.1f},{y0 + h:.1f} {x0:.1f},{y0 + h:.1f} Z' "
+                    f"fill='#3B82F6' fill-opacity='0.3'/>")
+        outgoing[flow['from']] += h
+        incoming[flow['to']] += h
+    for node in nodes:
+        x, y = top[node]
+        h = max(size[node] * scale, 1)
+        body.append(f"<rect x='{x:.1f}' y='{y:.1f}' width='{node_w}' height='{h:.1f}' fill='#10B981'/>")
+        body.append(_text(x + node_w + 4, y + h / 2 + 4, f"{node} ({size[node]})", size=10, anchor='start'))
+    return _svg(title, body)
+
+def _total(counts):
+    return sum((counts or {}).values())
+
+def _symptom_pairs(symptoms):
+    """Diagnostic yield of every observed symptom pair, as the dashboard heatmap shows it"""
+    subsets = symptoms.get('symptom_subsets')
+    if not subsets:
+        return symptoms['combination_diagnostic_yield']
+    return {name: subset['diagnostic_yield'] for name, subset in subsets.items()
+            if len(name.split('+')) == 2 and subset['count'] > 0}
+
+# The 17 dashboard charts: canvas id in index.html, title, the results section it needs, and how to draw it
+CHARTS = [
+    ('ageGenderChart', 'Patient Demographics (Age & Sex)', 'demographics', lambda r: bar_chart(
+        'Patient Demographics (Age & Sex)', list(r['demographics']['age_sex_distribution'].get('Male', {})),
+        [(sex, list(r['demographics']['age_sex_distribution'].get(sex, {}).values()), color)
+         for sex, color in (('Male', BLUE), ('Female', PINK))], 'Number of Patients')),
+    ('symptomPrevalenceChart', 'Symptom Prevalence', 'symptoms', lambda r: bar_chart(
+        'Symptom Prevalence', list(r['symptoms']['symptom_prevalence']),
+        [('Prevalence (%)', list(r['symptoms']['symptom_prevalence'].values()), RED)],
+        'Prevalence (%)', horizontal=True)),
+    ('comorbiditiesChart', 'Comorbidities (HIV & DM)', 'comorbidities', lambda r: pie_chart(
+        'Comorbidities (HIV & DM)', ['HIV Positive', 'DM Positive', 'Neither/Unknown'],
+        [r['comorbidities']['hiv_distribution'].get('Yes', 0), r['comorbidities']['dm_distribution'].get('Yes', 0),
+         sum(r['comorbidities'][key].get(level, 0) for key in ('hiv_distribution', 'dm_distribution')
+             for level in ('No', 'Unknown'))],
+        ['#F59E0B', '#EF4444', '#D1D5DB'])),
+    ('diagnosticTestChart', 'Diagnostic Test Distribution', 'diagnostic_tests', lambda r: pie_chart(
+        'Diagnostic Test Distribution', ['CXR', 'Sputum R1', 'Sputum R2', 'GeneXpert'],
+        [_total(r['diagnostic_tests']['test_distribution'].get(test))
+         for test in ('CXR_results', 'Sputum_R1', 'Sputum_R2', 'GeneXpertMTB')],
+        ['#10B981', '#3B82F6', '#6366F1', '#F97316'], hole=0.5)),
+    ('ageSexPyramidChart', 'TB Distribution by Age & Sex (Pyramid)', 'demographics', lambda r: pyramid_chart(
+        'TB Distribution by Age & Sex (Pyramid)', r['demographics']['age_sex_pyramid']['labels'],
+        r['demographics']['age_sex_pyramid']['male_counts'], r['demographics']['age_sex_pyramid']['female_counts'],
+        'Male', 'Female')),
+    ('symptomHeatmapChart', 'Symptom Combination Heatmap (Diagnostic Yield)', 'symptoms', lambda r: bar_chart(
+        'Symptom Combination Heatmap (Diagnostic Yield)', list(_symptom_pairs(r['symptoms'])),
+        [('Diagnostic Yield (%)', list(_symptom_pairs(r['symptoms']).values()),
+          [f"rgba(239, {min(68 + i * 10, 255)}, {min(68 + i * 10, 255)}, 0.8)"
+           for i in range(len(_symptom_pairs(r['symptoms'])))])],
+        'Diagnostic Yield (%)', max_value=100)),
+    ('symptomCorrelationChart', 'Symptom-Test Correlation Matrix', 'associations', lambda r: bar_chart(
+        'Symptom-Test Correlation Matrix', [s.replace('_', ' ') for s in r['associations']['symptom_test_phi']],
+        [(name, [tests[key] for tests in r['associations']['symptom_test_phi'].values()], color)
+         for key, name, color in (('CXR_Abnormal', 'CXR Abnormal', INDIGO),
+                                  ('Sputum_Positive', 'Sputum Positive', GREEN),
+                                  ('GeneXpert_Positive', 'GeneXpert Detected', ORANGE))],
+        'Correlation Coefficient (phi)', horizontal=True)),
+    ('patientJourneySankey', 'Patient Journey (Symptoms → Test → Diagnosis)', 'patient_journey', lambda r: sankey_chart(
+        'Patient Journey (Symptoms → Test → Diagnosis)', r['patient_journey']['patient_flow'])),
+    ('symptomTBChart', 'Symptom Prevalence in TB+ Cases', 'symptoms', lambda r: pie_chart(
+        'Symptom Prevalence in TB+ Cases', list(r['symptoms']['symptom_tb_prevalence']),
+        list(r['symptoms']['symptom_tb_prevalence'].values()),
+        ['rgba(102, 126, 234, 0.8)', 'rgba(118, 75, 162, 0.8)', 'rgba(237, 137, 54, 0.8)',
+         'rgba(72, 187, 120, 0.8)', 'rgba(245, 101, 101, 0.8)', 'rgba(159, 122, 234, 0.8)'], hole=0.5)),
+    ('symptomsVsTbChart', 'Symptoms vs. TB Diagnosis', 'risk_factors', lambda r: bar_chart(
+        'Symptoms vs. TB Diagnosis', list(r['risk_factors']['symptom_tb_analysis']),
+        [(name, [values[key] for values in r['risk_factors']['symptom_tb_analysis'].values()], color)
+         for name, key, color in (('TB Positive', 'TB_Positive', RED), ('TB Negative', 'TB_Negative', BLUE))],
+        'Percentage (%)')),
+    ('comorbidityInfluenceChart', 'HIV/DM Influence on TB Positivity', 'comorbidities', lambda r: bar_chart(
+        'HIV/DM Influence on TB Positivity', ['HIV', 'DM'],
+        [('TB Positive Rate (%)', [r['comorbidities']['hiv_tb_rates'].get('Yes', 0),
+                                   r['comorbidities']['dm_tb_rates'].get('Yes', 0)], 'rgba(218, 165, 32, 0.8)')],
+        'Percentage (%)', max_value=100)),
+    ('contactHistoryChart', 'TB Contact History vs. Diagnosis', 'risk_factors', lambda r: bar_chart(
+        'TB Contact History vs. Diagnosis', ['Contact History', 'No Contact History'],
+        [('TB Positive Rate (%)', [r['risk_factors']['contact_history_tb_rates'].get('Yes', 0),
+                                   r['risk_factors']['contact_history_tb_rates'].get('No', 0)],
+          'rgba(134, 187, 159, 0.8)')],
+        'Percentage (%)', max_value=100)),
+    ('prevTbHistoryChart', 'Previous TB History vs. Diagnosis', 'risk_factors', lambda r: bar_chart(
+        'Previous TB History vs. Diagnosis', ['Previous TB', 'No Previous TB'],
+        [('TB Positive Rate (%)', [r['risk_factors']['previous_tb_rates'].get('Yes', 0),
+                                   r['risk_factors']['previous_tb_rates'].get('No', 0)], 'rgba(147, 120, 234, 0.8)')],
+        'Percentage (%)', max_value=100)),
+    ('prevalenceByDemographicsChart', 'TB Prevalence by Age Group and Sex', 'epidemiology', lambda r: bar_chart(
+        'TB Prevalence by Age Group and Sex', list(r['epidemiology']['prevalence_by_demographics']),
+        [(f"{sex} TB Rate (%)", [rates.get(sex, 0) for rates in r['epidemiology']['prevalence_by_demographics'].values()],
+          color) for sex, color in (('Male', BLUE), ('Female', PINK))],
+        'TB Rate (%)')),
+    ('highRiskSubgroupsChart', 'High-Risk Subgroups Analysis', 'epidemiology', lambda r: bar_chart(
+        'High-Risk Subgroups Analysis', list(r['epidemiology']['high_risk_subgroups']),
+        [('TB Positive Rate (%)', list(r['epidemiology']['high_risk_subgroups'].values()),
+          ['#F59E0B', '#EF4444', '#8B5CF6'])],
+        'TB Positive Rate (%)')),
+    ('modelComparisonChart', 'Model Performance Comparison (AUC)', 'predictive_metrics', lambda r: bar_chart(
+        'Model Performance Comparison (AUC)', list(r['predictive_metrics']['model_performance']),
+        [('AUC Score', list(r['predictive_metrics']['model_performance'].values()), 'rgba(37, 99, 235, 0.7)')],
+        'Area Under Curve (AUC)', max_value=1)),
+    ('featureImportanceChart', 'Predictor Importance', 'predictive_metrics', lambda r: bar_chart(
+        'Predictor Importance', list(r['predictive_metrics']['feature_importance']),
+        [('Importance', list(r['predictive_metrics']['feature_importance'].values()), INDIGO)],
+        'Predictor Importance Score', horizontal=True))
+]
+
+def render_chart(index, results, chart_dir, png=False):
+    """Render one chart to chart_dir as SVG (and PNG); returns (chart id, title, svg or None, files)"""
+    chart_id, title, section, draw = CHARTS[index]
+    if results.get(section) is None:
+        # The section this chart needs was not part of the run
+        return chart_id, title, None, []
+    svg = draw(results)
+
+    path = Path(chart_dir) / f"{chart_id}.svg"
+    path.write_text(svg, encoding='utf-8')
+    files = [str(path)]
+    if png:
+        try:
+            import cairosvg
+        except ImportError:
+            pass
+        else:
+            cairosvg.svg2png(bytestring=svg.encode(), write_to=str(path.with_suffix('.png')))
+            files.append(str(path.with_suffix('.png')))
+    return chart_id, title, svg, files
+
+def _table(rows, header):
+    head = ''.join(f"<th>{html.escape(str(cell))}</th>" for cell in header)
+    body = ''.join('<tr>' + ''.join(f"<td>{html.escape(str(cell))}</td>" for cell in row) + '</tr>' for row in rows)
+    return f"<table><tr>{head}</tr>{body}</table>"
+
+def report_html(results, charts):
+    """Self-contained report page: inline SVG charts plus the test performance and risk tables"""
+    metadata = results.get('metadata', {})
+    source = metadata.get('data_source')
+    source = ', '.join(source) if isinstance(source, list) else source
+    figures = ''.join(f"<figure><figcaption>{html.escape(title)}</figcaption>{svg}</figure>"
+                      for _, title, svg, _ in charts if svg)
+
+    tables = ''
+    if 'diagnostic_tests' in results:
+        rows = [(test, f"{m['sensitivity']}%", f"{m['specificity']}%", m['turnaround_time'])
+                for test, m in results['diagnostic_tests']['test_performance'].items()]
+        tables += "<h2>Diagnostic Test Performance Metrics</h2>" + _table(
+            rows, ['Test', 'Sensitivity', 'Specificity', 'Turnaround Time'])
+    if 'risk_stratification' in results:
+        risk = results['risk_stratification']
+        rows = [(tier, f"{values['percentage']}%", values['description'])
+                for tier, values in risk.items() if isinstance(values, dict) and 'description' in values]
+        tables += "<h2>Patient Risk Stratification Matrix</h2>" + _table(rows, ['Risk', 'Patients', 'Criteria'])
+        if 'exclusive_tiers' in risk:
+            rows = [(tier, values['count'], f"{values['percentage']}%", f"{values['tb_rate']}%", values['description'])
+                    for tier, values in risk['exclusive_tiers'].items()]
+            tables += "<h2>Risk Tiers (one per patient)</h2>" + _table(
+                rows, ['Tier', 'Patients', 'Share', 'TB Rate', 'Criteria'])
+
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<title>TB Clinical Data Analysis - Static Report</title>
+<style>
+body {{ font-family: Inter, Arial, sans-serif; background: #F3F4F6; color: #111827; margin: 0; padding: 24px; }}
+h1 {{ margin-top: 0; }}
+.grid {{ display: grid; grid-template-columns: repeat(auto-fill, minmax(480px, 1fr)); gap: 16px; }}
+figure {{ background: white; border-radius: 12px; margin: 0; padding: 16px; box-shadow: 0 1px 3px rgba(0,0,0,0.1); }}
+figcaption {{ font-weight: 600; margin-bottom: 8px; }}
+svg {{ width: 100%; height: auto; }}
+table {{ background: white; border-collapse: collapse; margin-bottom: 24px; }}
+th, td {{ border: 1px solid #E5E7EB; padding: 6px 12px; text-align: left; }}
+</style>
+</head>
+<body>
+<h1>TB Clinical Data Analysis</h1>
+<p>{metadata.get('total_patients', '')} patients &middot; {html.escape(str(source or ''))} &middot; {html.escape(str(metadata.get('analysis_date', '')))}</p>
+{tables}
+<div class="grid">{figures}</div>
+</body>
+</html>
+"""
+
+def render_all(results, output_dir, workers=1, png=False):
+    """Render every chart (in parallel across processes) and write report.html; returns the files written"""
+    output_dir = Path(output_dir)
+    chart_dir = output_dir / 'charts'
+    chart_dir.mkdir(parents=True, exist_ok=True)
+    if png:
+        try:
+            import cairosvg  # noqa: F401
+        except ImportError:
+            print("⚠️  cairosvg is not installed; writing SVG charts only")
+            png = False
+
+    indices = range(len(CHARTS))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            charts = list(pool.map(render_chart, indices, [results] * len(CHARTS),
+                                   [chart_dir] * len(CHARTS), [png] * len(CHARTS)))
+    else:
+        charts = [render_chart(index, results, chart_dir, png) for index in indices]
+
+    report = output_dir / 'report.html'
+    report.write_text(report_html(results, charts), encoding='utf-8')
+    rendered = [chart for chart in charts if chart[2]]
+    return [f"{chart_dir} ({len(rendered)} charts)", str(report)]
+
+def main(argv=None):
+    """Render the charts of an existing analysis_results.json"""
+    parser = argparse.ArgumentParser(description="Render dashboard charts and an offline report from analysis results")
+    parser.add_argument('results', nargs='?', default='analysis_results.json')
+    parser.add_argument('--output-dir', default=None, help="Default: the folder of the results file")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--png', action='store_true', help="Also write PNG files (needs cairosvg)")
+    args = parser.parse_args(argv)
+
+    path = Path(args.results)
+    if not path.exists():
+        print(f"❌ '{path}' not found. Run analyze_tb_data.py first.")
+        return 1
+    results = json.loads(path.read_text())
+    for generated in render_all(results, args.output_dir or path.parent, args.workers, args.png):
+        print(f"✅ {generated}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
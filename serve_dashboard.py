@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Dashboard Server for TB Clinical Data Analysis
+Serves the dashboard and the analysis results with ETag/Last-Modified caching and gzip,
+pushes a reload event to open dashboards when the results change, and answers the
+drill-down API of cube_server.py
+"""
+
+import argparse
+import asyncio
+import email.utils
+import errno
+import gzip
+import hashlib
+import json
+import mimetypes
+import sys
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+import analyze_tb_data as tb
+import cube_server
+
+# Content types worth compressing, and files too small to bother
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+GZIP_MIN_BYTES = 1024
+GZIP_CACHE_ENTRIES = 64
+
+# Seconds between checks of the results files, and between keep-alive comments on the event stream
+WATCH_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 15.0
+
+# Idle keep-alive connections are closed after this many seconds
+KEEP_ALIVE_TIMEOUT = 30.0
+
+# Ports tried after --port when it is already in use
+PORT_ATTEMPTS = 20
+
+STATUS_TEXT = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+               405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+def _file_stat(path):
+    """(mtime_ns, size) of a file, or None when it does not exist"""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def results_version(directory):
+    """Short hash of the analysis results without the run-specific metadata; 'none' without results
+
+    The manifest is hashed when it exists (it lists the hash of every section file), else
+    analysis_results.json. The analysis date and stage timings change on every run, so
+    they are left out: rerunning on unchanged data does not reload the dashboards.
+    """
+    directory = Path(directory)
+    path = directory / tb.MANIFEST_FILE
+    if not path.exists():
+        path = directory / 'analysis_results.json'
+    try:
+        data = json.loads(path.read_bytes())
+    except (OSError, ValueError):
+        return 'none'
+    data['metadata'] = {key: value for key, value in data.get('metadata', {}).items()
+                        if key not in ('analysis_date', 'timings')}
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16]
+
+def _cache_control(relative):
+    """Section files are named after their contents and never change; everything else is revalidated"""
+    if relative.parts[:1] == (tb.SECTION_DIR,):
+        return 'public, max-age=31536000, immutable'
+    return 'no-cache'
+
+def _not_modified(headers, etag, mtime_ns):
+    """Whether the browser's cached copy (If-None-Match / If-Modified-Since) is still current"""
+    if 'if-none-match' in headers:
+        tags = [tag.strip().removeprefix('W/') for tag in headers['if-none-match'].split(',')]
+        return etag in tags or '*' in tags
+    if 'if-modified-since' in headers:
+        try:
+            since = email.utils.parsedate_to_datetime(headers['if-modified-since']).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return mtime_ns // 1_000_000_000 <= since
+    return False
+
+def static_etag(path, stat, accepts_gzip):
+    """ETag and Content-Encoding of a static file, from its stat alone (no read)
+
+    Compressible files of at least GZIP_MIN_BYTES are sent gzipped to clients that accept it.
+    """
+    mtime_ns, size = stat
+    content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+    if accepts_gzip and size >= GZIP_MIN_BYTES and content_type.startswith(COMPRESSIBLE_TYPES):
+        return f'"{size:x}-{mtime_ns:x}-gz"', 'gzip'
+    return f'"{size:x}-{mtime_ns:x}"', None
+
+def load_static(path, stat, encoding, gzip_cache):
+    """Body of a static file in the given Content-Encoding (see static_etag)
+
+    A precompressed .gz sibling at least as new as the file is used as it is; other
+    compressible files are gzipped once and kept in a small LRU cache per file version.
+    """
+    if encoding is None:
+        return path.read_bytes()
+
+    mtime_ns, size = stat
+    sibling = path.with_name(f"{path.name}.gz")
+    sibling_stat = _file_stat(sibling)
+    if sibling_stat and sibling_stat[0] >= mtime_ns:
+        return sibling.read_bytes()
+
+    key = (str(path), mtime_ns, size)
+    if key in gzip_cache:
+        gzip_cache.move_to_end(key)
+    else:
+        gzip_cache[key] = gzip.compress(path.read_bytes(), compresslevel=6)
+        if len(gzip_cache) > GZIP_CACHE_ENTRIES:
+            gzip_cache.popitem(last=False)
+    return gzip_cache[key]
+
+async def read_request(reader):
+    """Method, target and lower-cased headers of the next request; None when the client is done"""
+    line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+    if not line.strip():
+        return None
+    method, target, version = line.decode('latin-1').split()
+    headers = {'http-version': version}
+    while True:
+        header = await reader.readline()
+        if header in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = header.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    # GET and HEAD carry no body, but skip one if a client sends it anyway
+    if int(headers.get('content-length', 0)):
+        await reader.readexactly(int(headers['content-length']))
+    return method, target, headers
+
+def _head(status, headers):
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT[status]}"] + [f"{name}: {value}" for name, value in headers.items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+def make_app(directory, store=None):
+    """State and connection handler of the dashboard server for one results directory"""
+    directory = Path(directory).resolve()
+    cube_path = directory / f"count_cube{tb._columnar_suffix()}"
+    state = {'version': results_version(directory), 'clients': set(), 'cube': None, 'cube_stat': None}
+    gzip_cache = OrderedDict()
+
+    def current_cube():
+        """The saved count cube, reloaded when analyze_tb_data.py rewrites it"""
+        stat = _file_stat(cube_path)
+        if stat and stat != state['cube_stat']:
+            state['cube'], state['cube_stat'] = tb.load_count_cube(cube_path), stat
+        return state['cube']
+
+    async def send(writer, status, headers, body=b'', head_only=False):
+        headers.setdefault('Content-Length', str(len(body)))
+        writer.write(_head(status, headers))
+        if body and not head_only:
+            writer.write(body)
+        await writer.drain()
+
+    async def send_json(writer, status, obj, head_only=False):
+        body = tb.dumps_json(tb.clean_for_json(obj), compact=True)
+        await send(writer, status, {'Content-Type': 'application/json', 'Cache-Control': 'no-store'},
+                   body, head_only)
+
+    async def stream_events(writer):
+        """Server-sent events: the current results version now, then every new one"""
+        queue = asyncio.Queue()
+        state['clients'].add(queue)
+        writer.write(_head(200, {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache',
+                                 'Connection': 'keep-alive'}))
+        writer.write(f"retry: 3000\nevent: version\ndata: {state['version']}\n\n".encode())
+        try:
+            await writer.drain()
+            while True:
+                try:
+                    version = await asyncio.wait_for(queue.get(), HEARTBEAT_INTERVAL)
+                    writer.write(f"event: version\ndata: {version}\n\n".encode())
+                except asyncio.TimeoutError:
+                    writer.write(b": keep-alive\n\n")
+                await writer.drain()
+        finally:
+            state['clients'].discard(queue)
+
+    async def serve_static(writer, url_path, headers, head_only):
+        relative = Path(unquote(url_path).lstrip('/') or 'index.html')
+        path = (directory / relative).resolve()
+        if path.is_dir():
+            path, relative = path / 'index.html', relative / 'index.html'
+        stat = _file_stat(path)
+        if directory not in path.parents or stat is None or not path.is_file():
+            await send(writer, 404, {'Content-Type': 'text/plain'}, b'Not found', head_only)
+            return
+
+        # Revalidate from the stat alone; the file is only read (and gzipped) on a miss
+        etag, encoding = static_etag(path, stat, 'gzip' in headers.get('accept-encoding', ''))
+        response_headers = {
+            'ETag': etag,
+            'Last-Modified': email.utils.formatdate(stat[0] / 1e9, usegmt=True),
+            'Cache-Control': _cache_control(relative),
+            'Vary': 'Accept-Encoding'
+        }
+        if _not_modified(headers, etag, stat[0]):
+            await send(writer, 304, response_headers)
+            return
+        body = await asyncio.to_thread(load_static, path, stat, encoding, gzip_cache)
+        response_headers['Content-Type'] = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+        if encoding:
+            response_headers['Content-Encoding'] = encoding
+        await send(writer, 200, response_headers, body, head_only)
+
+    async def handle(reader, writer):
+        """One client connection, kept alive across requests"""
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers = request
+                url = urlparse(target)
+                head_only = method == 'HEAD'
+
+                if method not in ('GET', 'HEAD'):
+                    await send(writer, 405, {'Allow': 'GET, HEAD'})
+                elif url.path == '/events':
+                    await stream_events(writer)
+                    break
+                elif url.path.startswith('/api/'):
+                    cube = await asyncio.to_thread(current_cube)
+                    if cube is None:
+                        await send_json(writer, 404, {'error': "No count cube yet; run analyze_tb_data.py first"}, head_only)
+                    else:
+                        response = await asyncio.to_thread(cube_server.api_response, url, cube, store)
+                        status, obj = response or (404, {'error': f"Unknown API path {url.path}"})
+                        await send_json(writer, status, obj, head_only)
+                else:
+                    await serve_static(writer, url.path, headers, head_only)
+
+                if headers.get('connection', '').lower() == 'close' or headers['http-version'] == 'HTTP/1.0':
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def watch_results():
+        """Poll the results files and push the new version to every open dashboard when it changes"""
+        watched = [directory / tb.MANIFEST_FILE, directory / 'analysis_results.json']
+        last_stats = [_file_stat(path) for path in watched]
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            stats = [_file_stat(path) for path in watched]
+            if stats == last_stats:
+                continue
+            last_stats = stats
+            version = await asyncio.to_thread(results_version, directory)
+            if version != state['version']:
+                state['version'] = version
+                for queue in state['clients']:
+                    queue.put_nowait(version)
+                print(f"🔄 Results changed; notified {len(state['clients'])} open dashboard(s)")
+
+    return handle, watch_results
+
+async def start_server(handle, host, port):
+    """Listen on port, or on the next free one when it is taken"""
+    for candidate in range(port, port + PORT_ATTEMPTS):
+        try:
+            return await asyncio.start_server(handle, host, candidate), candidate
+        except OSError as e:
+            if e.errno != errno.EADDRINUSE:
+                raise
+            print(f"⚠️  Port {candidate} is in use, trying {candidate + 1}...")
+    raise OSError(f"No free port between {port} and {port + PORT_ATTEMPTS - 1}")
+
+async def serve(args, store=None):
+    handle, watch_results = make_app(args.directory, store)
+    server, port = await start_server(handle, args.host or None, args.port)
+    print(f"✅ Serving {Path(args.directory).resolve()} on http://localhost:{port}/index.html")
+    print("Open dashboards reload by themselves when analyze_tb_data.py writes new results.")
+    async with server:
+        await asyncio.gather(server.serve_forever(), watch_results())
+
+def main(argv=None):
+    """Serve the dashboard until interrupted"""
+    parser = argparse.ArgumentParser(description="Serve the TB dashboard with caching, compression and live reload")
+    parser.add_argument('--port', type=int, default=3000,
+                        help=f"Port to listen on; the next free one of {PORT_ATTEMPTS} is used when taken (default: 3000)")
+    parser.add_argument('--host', default='', help="Interface to listen on (default: all)")
+    parser.add_argument('--directory', default='.', help="Folder with index.html and the analysis results")
+    parser.add_argument('--data', metavar='FILE',
+                        help="Data file whose patient store answers /api/patients (built on first use)")
+    args = parser.parse_args(argv)
+
+    if not Path(args.directory, 'index.html').exists():
+        print(f"⚠️  No index.html in {args.directory}; only the results files will be served")
+
+    store = None
+    if args.data:
+        cube_path = Path(args.directory) / f"count_cube{tb._columnar_suffix()}"
+        store = cube_server.open_store(args.data, tb.load_count_cube(cube_path) if cube_path.exists() else None)
+
+    try:
+        asyncio.run(serve(args, store))
+    except KeyboardInterrupt:
+        print("\nServer stopped.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())